@@ -1,15 +1,23 @@
+import io
+import multiprocessing
 import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import gbm_drm_gen as drm
+import h5py
+import matplotlib.pyplot as plt
 import numpy as np
 import re
 import yaml
 from gbm_drm_gen.io.balrog_drm import BALROG_DRM
-from threeML.utils.data_builders.fermi.gbm_data import GBMTTEFile
 from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
 from threeML.utils.spectrum.binned_spectrum import BinnedSpectrumWithDispersion
 from threeML.utils.time_series.event_list import EventListWithDeadTime
+from morgoth.configuration import morgoth_config
 from morgoth.utils.trig_reader import TrigReader
+from morgoth.utils.tte_reader import TTEReader
 
 from morgoth.utils import file_utils
 
@@ -32,19 +40,35 @@ _gbm_detectors = [
     "b1",
 ]
 
+# start of the lightcurve plots relative to the trigger time
+_lightcurve_start = -150
+
+# width of the bins 3ML uses for the background fit of event lists
+_poly_fit_bin_width = 1.0
+
 
 class BkgFittingTrigdat(object):
-    def __init__(self, grb_name, version, trigdat_file, time_selection_file_path):
+    def __init__(
+        self,
+        grb_name,
+        version,
+        trigdat_file,
+        time_selection_file_path,
+        analysis_cache=None,
+    ):
         """
         Object used for fitting of the background in every detector and echan.
         :param grb_name: Name of GRB
         :param version: Version number of data
         :param time_selection_file_path: Path to yaml file with time selection information
+        :param analysis_cache: optional AnalysisCache, the background fits of the same
+        trigdat file and time selection are restored from it instead of fitted again
         """
         self._grb_name = grb_name
         self._version = version
         self._trigdat_file = trigdat_file
         self._time_selection_file_path = time_selection_file_path
+        self._analysis_cache = analysis_cache
 
         self._build_bkg_plugins()
         self._choose_dets()
@@ -63,21 +87,44 @@ class BkgFittingTrigdat(object):
             poly_order = data["poly_order"]
             fine = data["fine"]
 
+        cached = None
+
+        if self._analysis_cache is not None:
+            self._cache_key = self._analysis_cache.key(
+                self._trigdat_file, self._time_selection_file_path
+            )
+            cached = self._analysis_cache.get("bkg_fit_trigdat", self._cache_key)
+
+        self._restored_from_cache = cached is not None
+
+        if self._restored_from_cache:
+            restore_poly_fit = {
+                det: os.path.join(cached, f"bkg_det_{det}.h5") for det in _gbm_detectors
+            }
+        else:
+            restore_poly_fit = None
+
         self._trig_reader = TrigReader(
-            self._trigdat_file, fine=fine, verbose=False, poly_order=poly_order
+            self._trigdat_file,
+            fine=fine,
+            verbose=False,
+            poly_order=poly_order,
+            restore_poly_fit=restore_poly_fit,
+            analysis_cache=self._analysis_cache,
         )
 
         self._trig_reader.set_active_time_interval(
             f"{active_time['start']}-{active_time['stop']}"
         )
-        self._trig_reader.set_background_selections(
-            f"{bkg_time_neg['start']}-{bkg_time_neg['stop']}",
-            f"{bkg_time_pos['start']}-{bkg_time_pos['stop']}",
-        )
 
-        self._trigdat_time_series = self._trig_reader._time_series
+        # the restored fits already belong to these selections
+        if not self._restored_from_cache:
+            self._trig_reader.set_background_selections(
+                f"{bkg_time_neg['start']}-{bkg_time_neg['stop']}",
+                f"{bkg_time_pos['start']}-{bkg_time_pos['stop']}",
+            )
 
-        self._trigdat_plugins = self._trig_reader.to_plugin(*_gbm_detectors)
+        self._trigdat_time_series = self._trig_reader._time_series
 
     def save_lightcurves(self, dir_path):
         """
@@ -94,7 +141,7 @@ class BkgFittingTrigdat(object):
         file_utils.if_dir_containing_file_not_existing_then_make(dir_path)
 
         plots = self._trig_reader.view_lightcurve(
-            start=-150, stop=float(max_time), return_plots=True
+            start=_lightcurve_start, stop=float(max_time), return_plots=True
         )
 
         self._lightcurve_plots = {}
@@ -126,27 +173,26 @@ class BkgFittingTrigdat(object):
             )
             self._bkg_fits_files[det_name] = file_path
 
+        if self._analysis_cache is not None and not self._restored_from_cache:
+            self._analysis_cache.put_files(
+                "bkg_fit_trigdat",
+                self._cache_key,
+                {
+                    os.path.basename(path): path
+                    for path in self._bkg_fits_files.values()
+                },
+            )
+
     def _choose_dets(self):
         """
         Function to automatically choose the detectors which should be used in the fit
         :return:
         """
-        # create plugin with the detectors you wish to use for the fit
-        sign_list = []
-        ndet = 7
+        # get significance of all the detectors, without building their plugins
+        significances = self._trig_reader.significances(*_gbm_detectors)
 
-        # get significance of all the detectors
-        for i, det in enumerate(self._trigdat_plugins):
-            sign_list.append([det.significance, i])
-        sign_list = np.array(sign_list)
-
-        # delete nan entries
-        sign_list = sign_list[~np.isnan(sign_list[:, 0])]
-
-        # get index with the most significance
-        sign_list_sort = sign_list[sign_list[:, 0].argsort()]
-
-        index_sign_max = sign_list_sort[-1, 1]
+        # get index with the most significance, ignoring the nan entries
+        index_sign_max = int(np.nanargmax(significances))
 
         side_1_indices = [0, 1, 2, 3, 4, 5, 12]
         side_2_indices = [6, 7, 8, 9, 10, 11, 13]
@@ -232,6 +278,8 @@ class BkgFittingTTE(object):
         cspec_files,
         time_selection_file_path,
         bkg_fitting_file_path,
+        n_workers=None,
+        warm_start=None,
     ):
         """
         Object used for fitting of the background in every detector and echan for tte data.
@@ -239,12 +287,23 @@ class BkgFittingTTE(object):
         :param version: Version number of data
         :param time_selection_file_path: Path to yaml file with time selection information
         :param bkg_fitting_file_path: Path to yaml file with information for trigdat bkg fitting
+        :param n_workers: number of processes that fit the detectors, default from the config
+        :param warm_start: use the polynomial orders of the trigdat background fits instead
+        of searching the order again, default from the config
         """
         self._grb_name = grb_name
         self._version = version
         self._time_selection_file_path = time_selection_file_path
         self._trigdat_bkg_fitting_path = bkg_fitting_file_path
 
+        if n_workers is None:
+            n_workers = morgoth_config["bkg_fit"]["n_workers"]
+        self._n_workers = int(n_workers)
+
+        if warm_start is None:
+            warm_start = morgoth_config["bkg_fit"]["warm_start"]
+        self._warm_start = bool(warm_start)
+
         self._trigdat_file = trigdat_file
 
         # Create dictionaries containing the tte and cspec files
@@ -268,60 +327,126 @@ class BkgFittingTTE(object):
         with open(self._time_selection_file_path, "r") as f:
             data = yaml.safe_load(f)
 
-            active_time = (
+            self._active_time = (
                 f"{data['active_time']['start']}-{data['active_time']['stop']}"
             )
             background_time_neg = f"{data['background_time']['before']['start']}-{data['background_time']['before']['stop']}"
             background_time_pos = f"{data['background_time']['after']['start']}-{data['background_time']['after']['stop']}"
-            poly_order = data["poly_order"]
+            self._background_times = (background_time_neg, background_time_pos)
+            self._poly_order = data["poly_order"]
+
+        # only the events in this window are read from the tte files
+        self._window = _tte_window(data)
+
+        # end of the lightcurve plots
+        self._lightcurve_stop = float(data["max_time"])
+
+        self._poly_orders = self._det_poly_orders()
+
+        self._timings = {}
+
+        if self._n_workers > 1:
+            self._parallel_bkg_fits()
+            return
 
         det_ts = []
 
         for det in _gbm_detectors:
-            # Response Setup
-
-            rsp = BALROG_DRM(
-                drm.DRMGenTTE(
-                    tte_file=self._tte_files[det],
-                    trigdat=self._trigdat_file,
-                    mat_type=2,
-                    cspecfile=self._cspec_files[det],
-                ),
-                0.0,
-                0.0,
+            ts, self._timings[det] = _tte_time_series(
+                det,
+                self._tte_files[det],
+                self._cspec_files[det],
+                self._trigdat_file,
+                self._poly_orders[det],
+                self._background_times,
+                self._active_time,
+                window=self._window,
             )
+            det_ts.append(ts)
 
-            # Time Series
-            gbm_tte_file = GBMTTEFile(self._tte_files[det])
-            event_list = EventListWithDeadTime(
-                arrival_times=gbm_tte_file.arrival_times - gbm_tte_file.trigger_time,
-                measurement=gbm_tte_file.energies,
-                n_channels=gbm_tte_file.n_channels,
-                start_time=gbm_tte_file.tstart - gbm_tte_file.trigger_time,
-                stop_time=gbm_tte_file.tstop - gbm_tte_file.trigger_time,
-                dead_time=gbm_tte_file.deadtime,
-                first_channel=0,
-                instrument=gbm_tte_file.det_name,
-                mission=gbm_tte_file.mission,
-                verbose=True,
-            )
+        self._ts = det_ts
+        self._bkg_payloads = None
+        self._lightcurve_payloads = None
 
-            ts = TimeSeriesBuilder(
-                det,
-                event_list,
-                response=rsp,
-                poly_order=poly_order,
-                unbinned=False,
-                verbose=True,
-                container_type=BinnedSpectrumWithDispersion,
+    def _det_poly_orders(self):
+        """
+        The polynomial order of the background fit of every det. If the time
+        selection does not fix the order, the orders found by the trigdat
+        background fits are used in the warm start mode, so the likelihood
+        ratio search of the order is skipped. Dets without a readable trigdat
+        fit search the order again.
+        :return: dict with the order of every det
+        """
+        poly_orders = {det: self._poly_order for det in _gbm_detectors}
+
+        if not self._warm_start or self._poly_order != -1:
+            return poly_orders
+
+        try:
+            with open(self._trigdat_bkg_fitting_path, "r") as f:
+                trigdat_bkg_files = yaml.safe_load(f)["bkg_fit_files"]
+
+        except (OSError, KeyError, TypeError) as e:
+            print(f"No trigdat background fits for the warm start: {e}")
+            return poly_orders
+
+        for det in _gbm_detectors:
+            try:
+                with h5py.File(trigdat_bkg_files[det], "r") as store:
+                    poly_orders[det] = int(store.attrs["poly_order"])
+
+            except (OSError, KeyError) as e:
+                print(f"No trigdat background fit of {det} for the warm start: {e}")
+
+        print(f"Polynomial orders of the background fits: {poly_orders}")
+
+        return poly_orders
+
+    def _parallel_bkg_fits(self):
+        """
+        Build the responses, read the events and fit the background of the
+        detectors in a process pool. The workers return the background fits
+        as the content of the h5 files of save_background and the lightcurve
+        plots as png, so the events are only read in the workers
+        :return:
+        """
+        n = len(_gbm_detectors)
+
+        with ProcessPoolExecutor(
+            max_workers=min(self._n_workers, n),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as pool:
+            results = list(
+                pool.map(
+                    _fit_tte_detector,
+                    _gbm_detectors,
+                    [self._tte_files[det] for det in _gbm_detectors],
+                    [self._cspec_files[det] for det in _gbm_detectors],
+                    [self._trigdat_file] * n,
+                    [self._poly_orders[det] for det in _gbm_detectors],
+                    [self._background_times] * n,
+                    [self._active_time] * n,
+                    [self._window] * n,
+                    [self._lightcurve_stop] * n,
+                )
             )
 
-            ts.set_background_interval(
-                background_time_neg, background_time_pos)
-            ts.set_active_time_interval(active_time)
-            det_ts.append(ts)
+        self._bkg_payloads = {}
+        self._lightcurve_payloads = {}
 
-        self._ts = det_ts
+        for det, result in zip(_gbm_detectors, results):
+            self._bkg_payloads[det] = result["background"]
+            self._lightcurve_payloads[det] = result["lightcurve"]
+            self._timings[det] = result["timings"]
+
+        self._ts = None
+
+    @property
+    def timings(self):
+        """
+        Seconds spent for the response, the events and the background fit of every det
+        """
+        return self._timings
 
     def save_lightcurves(self, dir_path):
         """
@@ -329,23 +454,23 @@ class BkgFittingTTE(object):
         :param dir_path: Directory path where to save the plots
         :return:
         """
-        # Max time from yaml file
-        with open(self._time_selection_file_path, "r") as f:
-            data = yaml.safe_load(f)
-            max_time = data["max_time"]
-
         file_utils.if_dir_containing_file_not_existing_then_make(dir_path)
 
         self._lightcurve_plots = {}
 
-        for det_name, ts in zip(_gbm_detectors, self._ts):
+        for i, det_name in enumerate(_gbm_detectors):
             file_path = os.path.join(
                 dir_path,
                 f"{self._grb_name}_lightcurve_tte_detector_{det_name}_plot_{self._version}.png",
             )
 
-            fig = ts.view_lightcurve(start=-150, stop=float(max_time))
-            fig.savefig(file_path, dpi=350, bbox_inches="tight")
+            if self._lightcurve_payloads is not None:
+                # plotted by the workers
+                with open(file_path, "wb") as f:
+                    f.write(self._lightcurve_payloads[det_name])
+
+            else:
+                _save_lightcurve(self._ts[i], self._lightcurve_stop, file_path)
 
             self._lightcurve_plots[det_name] = file_path
 
@@ -362,7 +487,14 @@ class BkgFittingTTE(object):
 
         for i, det_name in enumerate(_gbm_detectors):
             file_path = os.path.join(dir_path, f"bkg_det_{det_name}.h5")
-            self._ts[i].save_background(file_path, overwrite=True)
+
+            if self._bkg_payloads is not None:
+                with open(file_path, "wb") as f:
+                    f.write(self._bkg_payloads[det_name])
+
+            else:
+                self._ts[i].save_background(file_path, overwrite=True)
+
             self._bkg_fits_files[det_name] = file_path
 
     def save_yaml(self, path):
@@ -425,3 +557,177 @@ class BkgFittingTTE(object):
                 raise Exception("Wrong format for detector selection")
 
         self._use_dets = det_list_final
+
+
+def _tte_window(time_selection):
+    """
+    The time window of the tte events that are needed: from the start of the
+    background before the trigger to the end of the background after the
+    trigger, extended to the range of the lightcurve plots
+    :param time_selection: dict of the time selection yaml
+    :return: tmin and tmax relative to the trigger time
+    """
+    background = time_selection["background_time"]
+
+    tmin = min(float(background["before"]["start"]), _lightcurve_start)
+    tmax = float(background["after"]["stop"])
+
+    if "max_time" in time_selection:
+        tmax = max(tmax, float(time_selection["max_time"]))
+
+    return tmin, tmax
+
+
+def _tte_time_series(
+    det,
+    tte_file,
+    cspec_file,
+    trigdat_file,
+    poly_order,
+    background_times,
+    active_time,
+    window=None,
+):
+    """
+    Build the response and the time series of one det and fit the background
+    :param det: the detector name
+    :param tte_file: path to the tte file of the det
+    :param cspec_file: path to the cspec file of the det
+    :param trigdat_file: path to the trigdat file
+    :param poly_order: the order of the background polynomial
+    :param background_times: the two background selections
+    :param active_time: the active time selection
+    :param window: optional (tmin, tmax), only the events in it are used
+    :return: TimeSeriesBuilder and the seconds spent for the single steps
+    """
+    timings = {}
+
+    t0 = time.perf_counter()
+
+    # Response Setup
+    rsp = BALROG_DRM(
+        drm.DRMGenTTE(
+            tte_file=tte_file,
+            trigdat=trigdat_file,
+            mat_type=2,
+            cspecfile=cspec_file,
+        ),
+        0.0,
+        0.0,
+    )
+
+    timings["response"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+
+    # Time Series, only the events in the window are read from the memory
+    # mapped file, they are copied so the file can be closed
+    if window is None:
+        window = (None, None)
+
+    with TTEReader(
+        tte_file, tmin=window[0], tmax=window[1], grid=_poly_fit_bin_width
+    ) as gbm_tte_file:
+        event_list = EventListWithDeadTime(
+            arrival_times=gbm_tte_file.relative_arrival_times,
+            measurement=np.array(gbm_tte_file.energies),
+            n_channels=gbm_tte_file.n_channels,
+            start_time=gbm_tte_file.tstart - gbm_tte_file.trigger_time,
+            stop_time=gbm_tte_file.tstop - gbm_tte_file.trigger_time,
+            dead_time=gbm_tte_file.deadtime,
+            first_channel=0,
+            instrument=gbm_tte_file.det_name,
+            mission=gbm_tte_file.mission,
+            verbose=True,
+        )
+
+    timings["events"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+
+    ts = TimeSeriesBuilder(
+        det,
+        event_list,
+        response=rsp,
+        poly_order=poly_order,
+        unbinned=False,
+        verbose=True,
+        container_type=BinnedSpectrumWithDispersion,
+    )
+
+    ts.set_background_interval(*background_times)
+    ts.set_active_time_interval(active_time)
+
+    timings["background_fit"] = time.perf_counter() - t0
+
+    print(
+        f"Background fit of {det}: response {timings['response']:.1f} s, "
+        f"events {timings['events']:.1f} s, fit {timings['background_fit']:.1f} s"
+    )
+
+    return ts, timings
+
+
+def _save_lightcurve(ts, stop, file_path):
+    """
+    Plot the lightcurve of a det
+    :param ts: the TimeSeriesBuilder of the det
+    :param stop: end of the plot relative to the trigger time
+    :param file_path: the png file or a file object
+    :return:
+    """
+    fig = ts.view_lightcurve(start=_lightcurve_start, stop=stop)
+    fig.savefig(file_path, format="png", dpi=350, bbox_inches="tight")
+    plt.close(fig)
+
+
+def _fit_tte_detector(
+    det,
+    tte_file,
+    cspec_file,
+    trigdat_file,
+    poly_order,
+    background_times,
+    active_time,
+    window=None,
+    lightcurve_stop=None,
+):
+    """
+    Fit the background of one det and plot its lightcurve in a worker process
+    :param det: the detector name
+    :param tte_file: path to the tte file of the det
+    :param cspec_file: path to the cspec file of the det
+    :param trigdat_file: path to the trigdat file
+    :param poly_order: the order of the background polynomial
+    :param background_times: the two background selections
+    :param active_time: the active time selection
+    :param window: optional (tmin, tmax), only the events in it are used
+    :param lightcurve_stop: end of the lightcurve plot, no plot if None
+    :return: dict with the content of the background h5 file, the lightcurve
+    png and the timings
+    """
+    ts, timings = _tte_time_series(
+        det,
+        tte_file,
+        cspec_file,
+        trigdat_file,
+        poly_order,
+        background_times,
+        active_time,
+        window=window,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, f"bkg_det_{det}.h5")
+
+        ts.save_background(file_path, overwrite=True)
+
+        with open(file_path, "rb") as f:
+            background = f.read()
+
+    lightcurve = None
+
+    if lightcurve_stop is not None:
+        buffer = io.BytesIO()
+        _save_lightcurve(ts, lightcurve_stop, buffer)
+        lightcurve = buffer.getvalue()
+
+    return dict(background=background, lightcurve=lightcurve, timings=timings)
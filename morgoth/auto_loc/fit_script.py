@@ -29,14 +29,33 @@ data_type = sys.argv[6]
 # get fit object
 
 if data_type == "trigdat":
+    # optional result of the grid scan for the position priors
+    grid_result_file = sys.argv[7] if len(sys.argv) > 7 else None
+
     multinest_fit = MultinestFitTrigdat(
-        grb_name, version, trigdat_file, bkg_fit_yaml_file, time_selection_yaml_file
+        grb_name,
+        version,
+        trigdat_file,
+        bkg_fit_yaml_file,
+        time_selection_yaml_file,
+        grid_result_file=grid_result_file,
     )
     multinest_fit.fit()
     multinest_fit.save_fit_result()
     multinest_fit.create_spectrum_plot()
     multinest_fit.move_chains_dir()
 
+elif data_type == "trigdat_grid":
+    grid_result_file = sys.argv[7]
+    grid_healpix_file = sys.argv[8]
+    nside = int(sys.argv[9])
+
+    multinest_fit = MultinestFitTrigdat(
+        grb_name, version, trigdat_file, bkg_fit_yaml_file, time_selection_yaml_file
+    )
+    multinest_fit.pre_localize(nside)
+    multinest_fit.save_grid_result(grid_result_file, grid_healpix_file)
+
 elif data_type == "tte":
     multinest_fit = MultinestFitTTE(
         grb_name, version, trigdat_file, bkg_fit_yaml_file, time_selection_yaml_file
@@ -1,18 +1,25 @@
 from operator import length_hint
+import copy
+import inspect
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import yaml
 import numpy as np
 
-from astropy.stats import bayesian_blocks
-
+from morgoth.configuration import morgoth_config
 from morgoth.utils.trig_reader import TrigReader
+from morgoth.auto_loc.utils.bayesian_blocks import BayesianBlocks
 from morgoth.auto_loc.utils.functions_for_auto_loc import *
 
 from threeML.utils.statistics.stats_tools import Significance
 
 base_dir = os.environ.get("GBM_TRIGGER_DATA_DIR")
 
+# part of the key of the cached selections, increase it when the selection changes
+time_selection_version = 1
+
 
 class TimeSelection(object):
     def __init__(self, grb_name, trigdat_file, fine=False):
@@ -218,6 +225,29 @@ class TimeSelectionKnown(TimeSelection):
 class TimeSelectionBB(TimeSelection):
     """Automatically sets active trigger time as well as neg and pos (before and after trigger) background"""
 
+    @classmethod
+    def cache_params(cls, **params):
+        """Parameters that change the selection, for the key of the analysis cache
+
+        Args:
+            params: the arguments of the selection, the others get their defaults
+
+        Returns:
+            dict: the arguments, the time_selection config and the version of the selection
+        """
+        for name, p in inspect.signature(cls.__init__).parameters.items():
+            # they do not change the selection
+            if name in ("self", "n_workers", "analysis_cache"):
+                continue
+
+            if p.default is not inspect.Parameter.empty:
+                params.setdefault(name, p.default)
+
+        section = morgoth_config["time_selection"]
+        config = {k: section[k] for k in section.leaves if k != "n_workers"}
+
+        return dict(params, config=config, version=time_selection_version)
+
     def __init__(
         self,
         grb_name,
@@ -226,6 +256,8 @@ class TimeSelectionBB(TimeSelection):
         gamma=0.776,
         mean_factor=1.1,
         significance_dets=3,
+        n_workers=None,
+        analysis_cache=None,
     ):
         """Starts Timeselection
 
@@ -235,12 +267,20 @@ class TimeSelectionBB(TimeSelection):
             fine (bool, optional): Use fine data binning. Defaults to False.
             gamma (float, optional): gamma value for bayesian blocks (influences number of blocks). Defaults to 0.776.
             mean_factor (float, optional): factor scaling the mean cps rate used for ruling out too long selections
+            n_workers (int, optional): number of processes for the timeselection of the detectors. Defaults to the config value.
+            analysis_cache (AnalysisCache, optional): cache for the parsed trigdat data. Defaults to None.
         """
         self._fine = fine
+
+        if n_workers is None:
+            n_workers = morgoth_config["time_selection"]["n_workers"]
+        self._n_workers = int(n_workers)
         self._trigdat_file = trigdat_file
 
         # Load Trigdat file
-        self._trigreader_obj = TrigReader(self._trigdat_file, fine=self._fine)
+        self._trigreader_obj = TrigReader(
+            self._trigdat_file, fine=self._fine, analysis_cache=analysis_cache
+        )
 
         # Names of detectors
         self.dets = [
@@ -394,6 +434,11 @@ class TimeSelectionBB(TimeSelection):
         self._lower_trigger_bound = lower_trigger_bound
         self._upper_trigger_bound = upper_trigger_bound
         self._max_trigger_length = max_trigger_length
+        self._cps_cond_dict = {}
+
+        if self._n_workers > 1:
+            self._parallel_timeselection()
+            return
 
         for det in self.dets:
             print(f"Run Timeselection for detector {det}")
@@ -413,6 +458,44 @@ class TimeSelectionBB(TimeSelection):
             # calculate the significance during the trigger time
             self._getSignificance(det)
 
+    def _parallel_timeselection(self):
+        """runs the bayesian blocks, the start-stop search, the background selection and
+        fit and the significance of the detectors in a process pool. The forked workers
+        get the TrigReader from the pool initializer and only return the significances,
+        the background fits of the detectors are done again with the final selection in
+        fixSelections
+        """
+        # the workers get a copy without the TrigReader, so it is only sent once
+        detached = copy.copy(self)
+        detached._trigreader_obj = None
+
+        # the initargs of forked workers are inherited and not pickled
+        with ProcessPoolExecutor(
+            max_workers=min(self._n_workers, len(self.dets)),
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self._trigreader_obj,),
+        ) as pool:
+            results = list(
+                pool.map(
+                    _timeselection_of_detector,
+                    [detached] * len(self.dets),
+                    self.dets,
+                )
+            )
+
+        for det, result in zip(self.dets, results):
+            self._bayesian_block_edges_dict[det] = result["edges"]
+            self._bayesian_block_times_dict[det] = result["times"]
+            self._bayesian_block_cps_dict[det] = result["cps"]
+            self._bayesian_block_widths_dict[det] = result["widths"]
+            self._start_trigger_dict[det] = result["start_trigger"]
+            self._stop_trigger_dict[det] = result["stop_trigger"]
+            self.neg_bkg_dict[det] = result["neg_bkg"]
+            self.pos_bkg_dict[det] = result["pos_bkg"]
+            self._bkg_list_dict[det] = [result["neg_bkg"], result["pos_bkg"]]
+            self._significance_dict[det] = result["significance"]
+
     def fixSelections(self):
         """Improves the timeselection by combining multiple detectors with the highest significance in the data
 
@@ -498,7 +581,7 @@ class TimeSelectionBB(TimeSelection):
     def _processTrigdat(self):
         """Loads trigdat data and stores times, observed cps and bin widths"""
         # get cps and times from Trigdat object
-        obs_array, _ = self._trigreader_obj.observed_and_background()
+        obs_array, _ = self._trigreader_obj.observed_and_background_array()
         start_times, end_times = self._trigreader_obj.tstart_tstop()
         times_dets = start_times.tolist()
         # Fix for bayesian Blocks (add an additional block with count rate zero )
@@ -526,6 +609,9 @@ class TimeSelectionBB(TimeSelection):
                 obs_dets[det_nr].pop(i_d)
 
         self._times = times_no_duplicates
+        self._times_array = np.array(self._times)
+        # the block edges only depend on the times, shared by all detectors
+        self._bb_engine = BayesianBlocks(self._times_array, gamma=self._gamma)
         self._max_time = times_dets[-1]
 
         self._cps_dets = {}
@@ -543,9 +629,7 @@ class TimeSelectionBB(TimeSelection):
         Args:
             det (str): Name of detector (or multiple ones)
         """
-        self._bayesian_block_edges_dict[det] = bayesian_blocks(
-            self._times, self._cps_dets[det], fitness="events", gamma=self._gamma
-        )
+        self._bayesian_block_edges_dict[det] = self._bb_engine.fit(self._cps_dets[det])
         (
             self._bayesian_block_times_dict[det],
             self._bayesian_block_cps_dict[det],
@@ -640,31 +724,7 @@ class TimeSelectionBB(TimeSelection):
         Returns:
             (float, int, int): new trigger length, start id, end id
         """
-        min_id, max_id = self.startStopToObsTimes(
-            self._lower_trigger_bound, self._upper_trigger_bound
-        )
-        min_id_start, max_id_stop = self.startStopToObsTimes(
-            self._lower_trigger_bound - 20, self._upper_trigger_bound + 20
-        )
-
-        # create mask selecting 50s before and 50s after allowed trigger times
-        mask = np.zeros_like(self._cps_dets[det])
-        mask[min_id_start:min_id] = 1
-        mask[max_id + 1 : max_id_stop] = 1
-
-        if np.sum(mask) != 0:
-            # caclulate the weighted average of the selected area
-            try:
-                mean_cps_trigger_area = np.average(
-                    self._cps_dets[det] * mask,
-                    weights=self._timebin_widths[det[:2]] * mask,
-                )
-            except ZeroDivisionError:
-                mean_cps_trigger_area = np.mean(self._cps_dets[det] * mask)
-        else:
-            mean_cps_trigger_area = np.mean(self._cps_dets[det])
-
-        cps_cond = mean_cps_trigger_area * self._mean_factor
+        cps_cond = self._get_cps_cond(det)
 
         length_h = length_in + self._bayesian_block_widths_dict[det][id_h + 1]
         length_l = length_in + self._bayesian_block_widths_dict[det][id_l - 1]
@@ -757,6 +817,50 @@ class TimeSelectionBB(TimeSelection):
             )
         return length_r, id_l_r, id_h_r
 
+    def _get_cps_cond(self, det):
+        """Gets the count rate a block needs to be added to the trigger selection. It only
+        depends on the detector and the trigger bounds and is calculated once per detector
+
+        Args:
+            det (str): detector name
+
+        Returns:
+            float: the cps condition
+        """
+        key = (det, self._lower_trigger_bound, self._upper_trigger_bound)
+        if key in self._cps_cond_dict:
+            return self._cps_cond_dict[key]
+
+        min_id, max_id = self.startStopToObsTimes(
+            self._lower_trigger_bound, self._upper_trigger_bound
+        )
+        min_id_start, max_id_stop = self.startStopToObsTimes(
+            self._lower_trigger_bound - 20, self._upper_trigger_bound + 20
+        )
+
+        # create mask selecting 50s before and 50s after allowed trigger times
+        mask = np.zeros_like(self._cps_dets[det])
+        mask[min_id_start:min_id] = 1
+        mask[max_id + 1 : max_id_stop] = 1
+
+        if np.sum(mask) != 0:
+            # caclulate the weighted average of the selected area
+            try:
+                mean_cps_trigger_area = np.average(
+                    self._cps_dets[det] * mask,
+                    weights=self._timebin_widths[det[:2]] * mask,
+                )
+            except ZeroDivisionError:
+                mean_cps_trigger_area = np.mean(self._cps_dets[det] * mask)
+        else:
+            mean_cps_trigger_area = np.mean(self._cps_dets[det])
+
+        cps_cond = mean_cps_trigger_area * self._mean_factor
+
+        self._cps_cond_dict[key] = cps_cond
+
+        return cps_cond
+
     def _check_counts(
         self, length_h, length_l, counts_l, counts_h, length_in, id_l, id_h, det
     ):
@@ -1013,17 +1117,23 @@ class TimeSelectionBB(TimeSelection):
         Returns:
             (int, int): start id, end id
         """
-        start_trigger_id = 0
-        end_trigger_id = len(self._times) - 1
-        for i, t in enumerate(self._times):
-            if t < start_trigger and i > start_trigger_id:
-                start_trigger_id = i
-            elif t > end_trigger and i < end_trigger_id:
-                end_trigger_id = i
+        times = self._times_array
+
+        # last time before the start
+        start_trigger_id = max(np.searchsorted(times, start_trigger, side="left") - 1, 0)
+
+        # first time after the end, that is not before the start
+        first_after_end = np.searchsorted(times, end_trigger, side="right")
+        if first_after_end > 0:
+            first_after_end = max(
+                first_after_end, np.searchsorted(times, start_trigger, side="left")
+            )
+        end_trigger_id = min(first_after_end, len(times) - 1)
+
         start_trigger_id += 1
         end_trigger_id -= 1
 
-        return start_trigger_id, end_trigger_id
+        return int(start_trigger_id), int(end_trigger_id)
 
     def _getSignificance(self, det):
         """Calculates the significance for a given detector using threeML
@@ -1068,6 +1178,60 @@ class TimeSelectionBB(TimeSelection):
         return cps_temp
 
 
+# the TrigReader of the selection in a worker process of the pool
+_worker_trigreader = None
+
+
+def _init_worker(trigreader):
+    """Initializer of the worker processes of the time selection
+
+    Args:
+        trigreader (TrigReader): TrigReader of the selection
+    """
+    global _worker_trigreader
+
+    _worker_trigreader = trigreader
+
+
+def _timeselection_of_detector(time_selection, det):
+    """Runs the selection, the background fit and the significance of one detector
+    in a worker process
+
+    Args:
+        time_selection (TimeSelectionBB): TimeSelectionBB Object without TrigReader
+        det (str): detector name
+
+    Returns:
+        dict: the blocks, trigger times, background bounds and significance of the detector
+    """
+    time_selection._trigreader_obj = _worker_trigreader
+
+    print(f"Run Timeselection for detector {det}")
+    # calculate BB for det
+    time_selection._bayesianBlocks(det)
+
+    # get the best start-stop of active time for the det
+    time_selection._calcStartStopTrigger(det)
+
+    # select and fit the background for det
+    BackgroundSelector(time_selection, det).runSelector()
+
+    # calculate the significance during the trigger time
+    time_selection._getSignificance(det)
+
+    return dict(
+        edges=time_selection._bayesian_block_edges_dict[det],
+        times=time_selection._bayesian_block_times_dict[det],
+        cps=time_selection._bayesian_block_cps_dict[det],
+        widths=time_selection._bayesian_block_widths_dict[det],
+        start_trigger=time_selection._start_trigger_dict[det],
+        stop_trigger=time_selection._stop_trigger_dict[det],
+        neg_bkg=time_selection.neg_bkg_dict[det],
+        pos_bkg=time_selection.pos_bkg_dict[det],
+        significance=time_selection._significance_dict[det],
+    )
+
+
 class BackgroundSelector:
     """Class for background selection"""
 
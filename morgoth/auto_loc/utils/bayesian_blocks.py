@@ -0,0 +1,180 @@
+import numpy as np
+
+
+class BayesianBlocks(object):
+    """
+    Bayesian Blocks (Scargle et al. 2013) with the events fitness for binned
+    trigdat count rates. Gives the same edges as astropy's
+    bayesian_blocks(t, x, fitness="events", gamma=gamma), but only keeps the
+    change point candidates that can still be optimal (PELT, Killick et al. 2012),
+    which makes the common case close to linear in the number of bins.
+
+    The edges and block lengths only depend on the times, so one object
+    can be used for all detectors of a trigdat file.
+    """
+
+    def __init__(self, t, gamma=0.776):
+        """
+        :param t: times of the measurements
+        :param gamma: prior on the number of blocks, p ~ gamma^N_blocks
+        """
+        t = np.asarray(t, dtype=float)
+
+        if t.ndim != 1:
+            raise ValueError("t must be a one-dimensional array")
+
+        self._t, self._unique_ids = np.unique(t, return_index=True)
+
+        if len(self._t) != len(t):
+            raise ValueError("Repeated values in t not supported when x is specified")
+
+        self._ncp_prior = -np.log(gamma)
+
+        # same edges and block lengths as astropy
+        self._edges = np.concatenate(
+            [self._t[:1], 0.5 * (self._t[1:] + self._t[:-1]), self._t[-1:]]
+        )
+        self._block_length = self._t[-1] - self._edges
+
+    @property
+    def edges(self):
+        return self._edges
+
+    def fit(self, x):
+        """
+        Get the edges of the optimal blocks for the counts x
+
+        :param x: integer counts for every time
+        :returns: the edges of the blocks
+        :rtype: np.ndarray
+
+        """
+        x = np.asarray(x, dtype=float) + np.zeros_like(self._t)
+
+        if np.any(x % 1 > 0):
+            raise ValueError("x must be integer counts for fitness='events'")
+
+        x = x[self._unique_ids]
+
+        if np.any(x < 0):
+            # the pruning only holds for positive counts
+            return self._fit_full(x)
+
+        n = len(x)
+
+        best = np.zeros(n, dtype=float)
+        last = np.zeros(n, dtype=int)
+
+        # best fitness of the blocks before a candidate, 0 for the first one
+        best_before = np.zeros(n + 1, dtype=float)
+
+        # counts from the start to a time, N_k of a block is the difference
+        cum_counts = np.concatenate(([0.0], np.cumsum(x)))
+
+        # a block with zero counts has fitness nan. astropy's argmax then
+        # returns the first nan, so from the first zero on the result is known
+        zeros = np.flatnonzero(x == 0)
+        first_zero = zeros[0] if len(zeros) > 0 else n
+
+        candidates = np.array([0])
+
+        for r in range(first_zero):
+            n_k = cum_counts[r + 1] - cum_counts[candidates]
+            t_k = self._block_length[candidates] - self._block_length[r + 1]
+
+            a_r = n_k * np.log(n_k / t_k) - self._ncp_prior
+            a_r += best_before[candidates]
+
+            i_max = np.argmax(a_r)
+            last[r] = candidates[i_max]
+            best[r] = a_r[i_max]
+            best_before[r + 1] = best[r]
+
+            # a candidate that is worse than the best partition without the
+            # prior can not become optimal for a later end of the block
+            tolerance = 1e-8 * (abs(best[r]) + 1)
+            keep = a_r + self._ncp_prior >= best[r] - tolerance
+
+            candidates = np.append(candidates[keep], r + 1)
+
+        zero_run_start = None
+
+        for r in range(first_zero, n):
+            if x[r] == 0:
+                if zero_run_start is None:
+                    zero_run_start = r
+                last[r] = min(first_zero + 1, zero_run_start)
+            else:
+                zero_run_start = None
+                last[r] = first_zero + 1
+
+            best[r] = np.nan
+
+        return self._edges[self._change_points(last)]
+
+    def _fit_full(self, x):
+        """
+        The full O(n^2) algorithm without pruning, as in astropy
+
+        :param x: counts for every time
+        :returns: the edges of the blocks
+        :rtype: np.ndarray
+
+        """
+        n = len(x)
+
+        best = np.zeros(n, dtype=float)
+        last = np.zeros(n, dtype=int)
+
+        for r in range(n):
+            t_k = self._block_length[: (r + 1)] - self._block_length[r + 1]
+            n_k = np.cumsum(x[: (r + 1)][::-1])[::-1]
+
+            a_r = n_k * np.log(n_k / t_k) - self._ncp_prior
+            a_r[1:] += best[:r]
+
+            i_max = np.argmax(a_r)
+            last[r] = i_max
+            best[r] = a_r[i_max]
+
+        return self._edges[self._change_points(last)]
+
+    @staticmethod
+    def _change_points(last):
+        """
+        Walk back from the end through the best partitions
+
+        :param last: start of the last block of the best partition up to every time
+        :returns: indices of the edges
+        :rtype: np.ndarray
+
+        """
+        n = len(last)
+
+        change_points = np.zeros(n, dtype=int)
+        i_cp = n
+        ind = n
+        while i_cp > 0:
+            i_cp -= 1
+            change_points[i_cp] = ind
+            if ind == 0:
+                break
+            ind = last[ind - 1]
+        if i_cp == 0:
+            change_points[i_cp] = 0
+
+        return change_points[i_cp:]
+
+
+def bayesian_blocks(t, x, gamma=0.776):
+    """
+    Edges of the Bayesian Blocks of the counts x at times t
+
+    :param t: times of the measurements
+    :param x: integer counts for every time
+    :param gamma: prior on the number of blocks
+    :returns: the edges of the blocks
+    :rtype: np.ndarray
+
+    """
+    return BayesianBlocks(t, gamma=gamma).fit(x)
@@ -1,18 +1,35 @@
 import os
+import pickle
 import shutil
 import time
 
+import astropy.units as u
 import gbm_drm_gen as drm
+import gbmgeometry
+import healpy as hp
 import matplotlib.pyplot as plt
 import numpy as np
 import yaml
+from gbm_drm_gen.input_edges import tte_edges
 from gbm_drm_gen.io.balrog_drm import BALROG_DRM
 from threeML import *
-from threeML.utils.data_builders.fermi.gbm_data import GBMTTEFile
+from threeML.utils.OGIP.response import InstrumentResponse
 from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
 from threeML.utils.spectrum.binned_spectrum import BinnedSpectrumWithDispersion
 from threeML.utils.time_series.event_list import EventListWithDeadTime
-from morgoth.utils.trig_reader import TrigReader
+from morgoth.configuration import morgoth_config
+from morgoth.auto_loc.utils.grid_scan import GridScan, grid_localization, prior_box
+from morgoth.auto_loc.utils.joint_balrog import JointBALROG
+from morgoth.utils.analysis_cache import input_key
+from morgoth.utils.fit_events import FitInstrumentation, events_file_path
+from morgoth.utils.multinest_chains import prepare_chains_dir
+from morgoth.utils.shared_data import (
+    share_arrays,
+    spectrum_from_arrays,
+    spectrum_to_arrays,
+)
+from morgoth.utils.trig_reader import TrigReader, lu
+from morgoth.utils.tte_reader import TTEReader
 
 
 from morgoth.utils.file_utils import if_dir_containing_file_not_existing_then_make
@@ -50,6 +67,184 @@ except:
     using_mpi = False
 base_dir = os.environ.get("GBM_TRIGGER_DATA_DIR")
 
+n_live_points = morgoth_config["multinest"]["n_live_points"]
+n_threads = morgoth_config["multinest"]["n_threads"]
+pre_localization = morgoth_config["pre_localization"]
+response_interpolation = morgoth_config["response_interpolation"]
+instrumentation_interval = morgoth_config["instrumentation"]["interval"]
+
+
+def _prepare_chains_dir(chains_dir, chain_path, key):
+    """
+    Prepare the temp chains dir on the first rank and tell all ranks
+    if the run resumes from a partial run with the same inputs
+    :param chains_dir: the temp chains dir
+    :param chain_path: the chain name of the run
+    :param key: key of the inputs of the run
+    :return: resume the run
+    """
+    resume = morgoth_config["multinest"]["resume"]
+
+    if using_mpi:
+        if rank == 0:
+            resume = prepare_chains_dir(chains_dir, chain_path, key, resume=resume)
+
+        resume = comm.bcast(resume, root=0)
+
+    else:
+        resume = prepare_chains_dir(chains_dir, chain_path, key, resume=resume)
+
+    return resume
+
+
+def _drm_gen_tte(position_interpolator, det, ebounds):
+    """
+    The DRMGenTTE of a det at time 0 like rank 0 builds it from the tte, cspec and
+    trigdat files, but from the position interpolator and the output edges of rank 0
+    :param position_interpolator: the position interpolator of the trigdat file
+    :param det: the det
+    :param ebounds: the output edges of the DRMGenTTE of rank 0
+    :return: DRMGenTTE
+    """
+    det_number = lu.index(det)
+
+    rsp = drm.DRMGenTTE.__new__(drm.DRMGenTTE)
+
+    rsp._gbm = gbmgeometry.GBM(
+        position_interpolator.quaternion(0.0),
+        position_interpolator.sc_pos(0.0) * u.km,
+    )
+
+    drm.DRMGen.__init__(
+        rsp,
+        position_interpolator=position_interpolator,
+        det_number=det_number,
+        ebin_edge_in=tte_edges["bgo" if det_number > 11 else "nai"],
+        mat_type=2,
+        ebin_edge_out=ebounds,
+        occult=True,
+        time=0.0,
+    )
+
+    return rsp
+
+
+def _active_measurements(det):
+    """
+    The energy range of a det in the fits
+    :param det: the det
+    :return: 8.1-700 keV for the NaI and 350 keV to 25 MeV for the BGO dets
+    """
+    if det == "b0" or det == "b1":
+        return "350-25000"
+
+    return "8.1-700"
+
+
+def _spectrum_arrays(dets, det_sl, det_rsp):
+    """
+    The arrays of the observed and background spectra of the spectrum likes and of
+    the responses, so they can be put into shared memory
+    :param dets: the dets
+    :param det_sl: the spectrum likes of the dets
+    :param det_rsp: the DRM generators of the dets at ra=0, dec=0
+    :return: dict with the arrays and dict with the other information of the spectra
+    """
+    arrays = {}
+    infos = {}
+
+    for det, sl, rsp in zip(dets, det_sl, det_rsp):
+        for kind, spectrum in [
+            ("observed", sl.observed_spectrum),
+            ("background", sl.background_spectrum),
+        ]:
+            spectrum_arrays, infos[f"{det}_{kind}"] = spectrum_to_arrays(
+                spectrum, f"{det}_{kind}_"
+            )
+            arrays.update(spectrum_arrays)
+
+        arrays[f"{det}_matrix"] = rsp.matrix
+        arrays[f"{det}_ebounds"] = rsp.ebounds
+        arrays[f"{det}_monte_carlo_energies"] = rsp.monte_carlo_energies
+
+    return arrays, infos
+
+
+def _spectrum_like_from_arrays(det, arrays, infos):
+    """
+    Create the spectrum like of a det from the arrays of _spectrum_arrays
+    :param det: the det
+    :param arrays: dict with the (shared) arrays
+    :param infos: dict with the other information of the spectra
+    :return: DispersionSpectrumLike
+    """
+    # the response of the spectra at ra=0, dec=0 like on rank 0, the plugins
+    # get a BALROG_DRM of the DRM generator
+    response = InstrumentResponse(
+        arrays[f"{det}_matrix"],
+        arrays[f"{det}_ebounds"],
+        arrays[f"{det}_monte_carlo_energies"],
+    )
+
+    observed, background = [
+        spectrum_from_arrays(
+            arrays, infos[f"{det}_{kind}"], f"{det}_{kind}_", response=response
+        )
+        for kind in ["observed", "background"]
+    ]
+
+    sl = DispersionSpectrumLike(det, observed, background, verbose=True)
+    sl.set_active_measurements(_active_measurements(det))
+
+    return sl
+
+
+def _interpolation():
+    """
+    Settings of the ResponseGrid of the fits, None if the responses are built exactly
+    :return: dict or None
+    """
+    if not response_interpolation["enabled"]:
+        return None
+
+    return {
+        key: value for key, value in response_interpolation.items() if key != "enabled"
+    }
+
+
+def _print_interpolation_stats(joint):
+    """
+    Print how many responses of the fit were interpolated
+    :param joint: the JointBALROG of the fit
+    """
+    if joint.response_grid is not None:
+        print(
+            f"Interpolated responses of rank {rank if using_mpi else 0}: "
+            f"{joint.response_grid.stats}"
+        )
+
+
+def _instrumentation(grb_name, report_type, version, use_dets, resume):
+    """
+    Instrumentation of the MultiNest run of a fit, only rank 0 writes the events
+    :return: FitInstrumentation
+    """
+    return FitInstrumentation(
+        events_file_path(base_dir, grb_name, report_type, version),
+        run_info=dict(
+            grb=grb_name,
+            report_type=report_type,
+            version=version,
+            dets=[str(det) for det in use_dets],
+            n_live_points=n_live_points,
+            n_ranks=size if using_mpi else 1,
+            n_threads=n_threads,
+            resumed=bool(resume),
+        ),
+        rank=rank if using_mpi else 0,
+        interval=instrumentation_interval,
+    )
+
 
 class MultinestFitTrigdat(object):
     def __init__(
@@ -59,16 +254,20 @@ class MultinestFitTrigdat(object):
         trigdat_file,
         bkg_fit_yaml_file,
         time_selection_yaml_file,
+        grid_result_file=None,
     ):
         """
         Initalize MultinestFit for Balrog
         :param grb_name: Name of GRB
         :param version: Version of data
         :param bkg_fit_yaml_file: Path to bkg fit yaml file
+        :param grid_result_file: optional result of the grid scan, the position priors
+        are shrunk to a box around it
         """
         # Basic input
         self._grb_name = grb_name
         self._version = version
+        self._grid_result_file = grid_result_file
         self._bkg_fit_yaml_file = bkg_fit_yaml_file
         self._time_selection_yaml_file = time_selection_yaml_file
 
@@ -91,10 +290,11 @@ class MultinestFitTrigdat(object):
         self._set_plugins()
         self._define_model()
 
-    def _set_plugins(self):
+    def _create_trig_reader(self, responses=None):
         """
-        Set the plugins using the saved background hdf5 files
-        :return:
+        Create the TrigReader with the saved background hdf5 files
+        :param responses: optional responses of all detectors
+        :return: TrigReader
         """
         success_restore = False
         i = 0
@@ -105,7 +305,12 @@ class MultinestFitTrigdat(object):
                     fine=self._fine,
                     verbose=False,
                     restore_poly_fit=self._bkg_fit_files,
+                    responses=responses,
+                    lazy=True,
                 )
+                # only the used detectors are created, this restores their background fits
+                for det in self._use_dets:
+                    trig_reader.time_series[det]
                 success_restore = True
                 i = 0
             except:
@@ -114,10 +319,45 @@ class MultinestFitTrigdat(object):
             if i == 50:
                 raise AssertionError("Can not restore background fit...")
 
+        return trig_reader
+
+    def _set_plugins(self):
+        """
+        Set the plugins using the saved background hdf5 files
+        :return:
+        """
+        if using_mpi:
+            # rank 0 builds the responses once and sends them to all other ranks
+            payload = None
+            if rank == 0:
+                trig_reader = self._create_trig_reader()
+                try:
+                    payload = pickle.dumps(
+                        {det: trig_reader.response(det) for det in self._use_dets}
+                    )
+                except Exception as e:
+                    print(f"Can not broadcast the responses: {e}")
+
+            payload = comm.bcast(payload, root=0)
+
+            if rank != 0:
+                responses = pickle.loads(payload) if payload is not None else None
+                trig_reader = self._create_trig_reader(responses)
+
+        else:
+            trig_reader = self._create_trig_reader()
+
         trig_reader.set_active_time_interval(self._active_time)
 
+        self._trig_reader = trig_reader
+
         trig_data = trig_reader.to_plugin(*self._use_dets)
 
+        # the plugins build the responses of all detectors together
+        self._joint = JointBALROG(
+            trig_data, interpolation=_interpolation(), n_threads=n_threads
+        )
+
         self._data_list = DataList(*trig_data)
 
     def _define_model(self, spectrum="cpl"):
@@ -125,6 +365,8 @@ class MultinestFitTrigdat(object):
         Define a Model for the fit
         :param spectrum: Which spectrum type should be used (cpl, band, pl, sbpl or solar_flare)
         """
+        self._spectrum = spectrum
+
         # data_list=comm.bcast(data_list, root=0)
         if spectrum == "cpl":
             # we define the spectral model
@@ -190,6 +432,122 @@ class MultinestFitTrigdat(object):
         else:
             raise Exception("Use valid model type: cpl, pl, sbpl, band or solar_flare")
 
+    def _chains_key(self):
+        """
+        Key of the inputs of the fit, a partial run in the chains dir is only resumed
+        if it was started with the same data, bkg fits and model
+        :return: the key
+        """
+        return input_key(
+            self._trigdat_file,
+            self._bkg_fit_yaml_file,
+            self._time_selection_yaml_file,
+            *[self._bkg_fit_files[det] for det in self._use_dets],
+            model=self._model.to_dict_with_types(),
+            n_live_points=n_live_points,
+        )
+
+    def pre_localize(self, nside):
+        """
+        Fast localization with a scan of the likelihood over a HEALPix grid,
+        the pixels are split between the MPI ranks
+        :param nside: nside of the grid
+        :return:
+        """
+        plugins = self._trig_reader.to_plugin(*self._use_dets, free_position=False)
+
+        grid_scan = GridScan(plugins, self._model, nside=nside, n_threads=n_threads)
+
+        pixels = np.arange(grid_scan.n_pixels)
+
+        if using_mpi:
+            log_like, best_params = grid_scan.scan(np.array_split(pixels, size)[rank])
+
+            # the pixels of the ranks are in order
+            parts = comm.gather((log_like, best_params), root=0)
+
+            if rank == 0:
+                log_like = np.concatenate([part[0] for part in parts])
+                best_params = np.concatenate([part[1] for part in parts])
+
+        else:
+            log_like, best_params = grid_scan.scan(pixels)
+
+        self._grid_nside = nside
+        self._grid_log_like = log_like
+        self._grid_best_params = best_params
+        self._grid_param_names = grid_scan.param_names
+
+    def save_grid_result(self, result_path, healpix_path):
+        """
+        Save the position and spectrum of the grid scan in a yaml file and the
+        normalized likelihood of all pixels as HEALPix map
+        :param result_path: path of the yaml file
+        :param healpix_path: path of the HEALPix map
+        :return:
+        """
+        if using_mpi and rank != 0:
+            return
+
+        result = grid_localization(self._grid_nside, self._grid_log_like)
+
+        best = int(np.nanargmax(self._grid_log_like))
+
+        result["nside"] = self._grid_nside
+        result["model"] = self._spectrum
+        result["log_like"] = float(self._grid_log_like[best])
+        result["spectrum"] = {
+            name: float(value)
+            for name, value in zip(
+                self._grid_param_names, self._grid_best_params[best]
+            )
+        }
+
+        if_dir_containing_file_not_existing_then_make(result_path)
+
+        with open(result_path, "w") as f:
+            yaml.dump(result, f, default_flow_style=False)
+
+        like = np.exp(self._grid_log_like - result["log_like"])
+        like[~np.isfinite(like)] = 0.0
+
+        hp.write_map(healpix_path, like / like.sum(), overwrite=True)
+
+    def _seed_position_prior(self):
+        """
+        Set the position priors to a box around the grid scan result, that is
+        prior_box_scale times the 2 sigma circle of the scan but at least
+        min_prior_box deg wide
+        :return: if the ra prior covers the full circle
+        """
+        with open(self._grid_result_file, "r") as f:
+            grid = yaml.safe_load(f)
+
+        width = max(
+            pre_localization["prior_box_scale"] * grid["two_sig_err_circle"],
+            pre_localization["min_prior_box"],
+        )
+
+        ra_min, ra_max, dec_min, dec_max = prior_box(grid["ra"], grid["dec"], width)
+
+        print(
+            f"Position prior from the grid scan: ra {ra_min:.1f}-{ra_max:.1f}, "
+            f"dec {dec_min:.1f}-{dec_max:.1f}"
+        )
+
+        for source in self._model.point_sources.values():
+            source.position.ra.prior = Uniform_prior(
+                lower_bound=ra_min, upper_bound=ra_max
+            )
+            source.position.dec.prior = Cosine_Prior(
+                lower_bound=dec_min, upper_bound=dec_max
+            )
+
+            source.position.ra.value = grid["ra"]
+            source.position.dec.value = grid["dec"]
+
+        return ra_min == 0.0 and ra_max == 360.0
+
     def fit(self):
         """
         Fit the model to data using multinest
@@ -202,25 +560,48 @@ class MultinestFitTrigdat(object):
         wrap = [0] * len(self._model.free_parameters)
         wrap[0] = 1
 
+        # a box around the grid scan result shrinks the prior volume
+        if self._grid_result_file is not None and pre_localization["seed_prior"]:
+            if not self._seed_position_prior():
+                # the ra range does not cover the full circle
+                wrap[0] = 0
+
         # define temp chain save path
         self._temp_chains_dir = os.path.join(
             base_dir, self._grb_name, f"c_trig_{self._version}"
         )
         chain_path = os.path.join(self._temp_chains_dir, f"trigdat_{self._version}_")
 
-        # Make temp chains folder if it does not exists already
-        if not os.path.exists(self._temp_chains_dir):
-            os.mkdir(os.path.join(self._temp_chains_dir))
+        # keep a partial run of a killed fit with the same inputs to resume from it
+        resume = _prepare_chains_dir(
+            self._temp_chains_dir, chain_path, self._chains_key()
+        )
+
+        # likelihood evaluations and evidence progress of the run
+        instrumentation = _instrumentation(
+            self._grb_name, "trigdat", self._version, self._use_dets, resume
+        )
 
         # use multinest to sample the posterior
         # set main_path+trigger to whatever you want to use
 
         self._bayes.set_sampler("multinest", share_spectrum=True)
         self._bayes.sampler.setup(
-            n_live_points=800, chain_name=chain_path, wrapped_params=wrap, verbose=True
+            n_live_points=n_live_points,
+            chain_name=chain_path,
+            wrapped_params=wrap,
+            verbose=True,
+            resume=resume,
+            dump_callback=instrumentation.dump_callback,
         )
+        instrumentation.attach(self._bayes.sampler)
+
         self._bayes.sample()
 
+        instrumentation.finish()
+
+        _print_interpolation_stats(self._joint)
+
     def save_fit_result(self):
         """
         Save the fits result to '{base_dir}/{grb_name}/{report_type}/{version}/trigdat_{version}_loc_results.fits'
@@ -386,10 +767,42 @@ class MultinestFitTTE(object):
 
     def _set_plugins(self):
         """
-        Set the plugins using the saved background hdf5 files
+        Set the plugins using the saved background hdf5 files. With MPI only rank 0
+        reads the tte and cspec files and bins the data, the other ranks get the
+        spectra from shared memory
         :return:
         """
+        if using_mpi:
+            det_sl, det_rsp = self._share_spectrum_likes()
+
+        else:
+            det_sl, det_rsp = self._load_spectrum_likes()
 
+        # Mean of active time
+        rsp_time = (float(self._active_time_start) + float(self._active_time_stop)) / 2
+
+        # Make Balrog Like
+        det_bl = []
+        for i, det in enumerate(self._use_dets):
+            det_bl.append(
+                drm.BALROGLike.from_spectrumlike(
+                    det_sl[i], rsp_time, det_rsp[i], free_position=True
+                )
+            )
+
+        # the plugins build the responses of all detectors together
+        self._joint = JointBALROG(
+            det_bl, interpolation=_interpolation(), n_threads=n_threads
+        )
+
+        self._data_list = DataList(*det_bl)
+
+    def _load_spectrum_likes(self):
+        """
+        Read the tte and cspec files of the used dets and create their spectrum likes
+        with the restored background fits
+        :return: the spectrum likes and the DRM generators of the dets
+        """
         det_ts = []
         det_rsp = []
 
@@ -408,21 +821,20 @@ class MultinestFitTTE(object):
 
             det_rsp.append(rsp)
 
-            # Time Series
-            gbm_tte_file = GBMTTEFile(tte_file)
-
-            event_list = EventListWithDeadTime(
-                arrival_times=gbm_tte_file.arrival_times - gbm_tte_file.trigger_time,
-                measurement=gbm_tte_file.energies,
-                n_channels=gbm_tte_file.n_channels,
-                start_time=gbm_tte_file.tstart - gbm_tte_file.trigger_time,
-                stop_time=gbm_tte_file.tstop - gbm_tte_file.trigger_time,
-                dead_time=gbm_tte_file.deadtime,
-                first_channel=0,
-                instrument=gbm_tte_file.det_name,
-                mission=gbm_tte_file.mission,
-                verbose=True,
-            )
+            # Time Series, the events are copied so the file can be closed
+            with TTEReader(tte_file) as gbm_tte_file:
+                event_list = EventListWithDeadTime(
+                    arrival_times=gbm_tte_file.relative_arrival_times,
+                    measurement=np.array(gbm_tte_file.energies),
+                    n_channels=gbm_tte_file.n_channels,
+                    start_time=gbm_tte_file.tstart - gbm_tte_file.trigger_time,
+                    stop_time=gbm_tte_file.tstop - gbm_tte_file.trigger_time,
+                    dead_time=gbm_tte_file.deadtime,
+                    first_channel=0,
+                    instrument=gbm_tte_file.det_name,
+                    mission=gbm_tte_file.mission,
+                    verbose=True,
+                )
 
             success_restore = False
             i = 0
@@ -451,32 +863,59 @@ class MultinestFitTTE(object):
             )
             det_ts.append(ts)
 
-        # Mean of active time
-        rsp_time = (float(self._active_time_start) + float(self._active_time_stop)) / 2
-
         # Spectrum Like
         det_sl = []
         # set up energy range
         for series in det_ts:
-            if series._name != "b0" and series._name != "b1":
-                sl = series.to_spectrumlike()
-                sl.set_active_measurements("8.1-700")
-                det_sl.append(sl)
-            else:
-                sl = series.to_spectrumlike()
-                sl.set_active_measurements("350-25000")
-                det_sl.append(sl)
+            sl = series.to_spectrumlike()
+            sl.set_active_measurements(_active_measurements(series._name))
+            det_sl.append(sl)
 
-        # Make Balrog Like
-        det_bl = []
-        for i, det in enumerate(self._use_dets):
-            det_bl.append(
-                drm.BALROGLike.from_spectrumlike(
-                    det_sl[i], rsp_time, det_rsp[i], free_position=True
-                )
+        return det_sl, det_rsp
+
+    def _share_spectrum_likes(self):
+        """
+        Rank 0 creates the spectrum likes and puts the observed and background spectra
+        and the responses into shared memory windows, the other ranks create their
+        spectrum likes from the shared arrays and only build the DRM generators,
+        from the position interpolator of rank 0
+        :return: the spectrum likes and the DRM generators of the dets
+        """
+        arrays = None
+        infos = None
+        position_interpolator = None
+
+        if rank == 0:
+            det_sl, det_rsp = self._load_spectrum_likes()
+
+            arrays, infos = _spectrum_arrays(self._use_dets, det_sl, det_rsp)
+
+            position_interpolator = det_rsp[0]._position_interpolator
+
+        infos = comm.bcast(infos, root=0)
+
+        # the trigdat file is only read by rank 0
+        position_interpolator = comm.bcast(position_interpolator, root=0)
+
+        # the windows have to be kept as long as the plugins are used
+        self._shared_arrays, self._shared_window = share_arrays(comm, arrays)
+
+        if rank == 0:
+            return det_sl, det_rsp
+
+        arrays = self._shared_arrays
+
+        det_sl = []
+        det_rsp = []
+
+        for det in self._use_dets:
+            det_rsp.append(
+                _drm_gen_tte(position_interpolator, det, arrays[f"{det}_ebounds"])
             )
 
-        self._data_list = DataList(*det_bl)
+            det_sl.append(_spectrum_like_from_arrays(det, arrays, infos))
+
+        return det_sl, det_rsp
 
     def _define_model(self, spectrum="band"):
         """
@@ -548,6 +987,21 @@ class MultinestFitTTE(object):
         else:
             raise Exception("Use valid model type: cpl, pl, sbpl, band or solar_flare")
 
+    def _chains_key(self):
+        """
+        Key of the inputs of the fit, a partial run in the chains dir is only resumed
+        if it was started with the same data, bkg fits and model
+        :return: the key
+        """
+        return input_key(
+            self._trigdat_file,
+            self._bkg_fit_yaml_file,
+            self._time_selection_yaml_file,
+            *[self._bkg_fit_files[det] for det in self._use_dets],
+            model=self._model.to_dict_with_types(),
+            n_live_points=n_live_points,
+        )
+
     def fit(self):
         """
         Fit the model to data using multinest
@@ -566,9 +1020,15 @@ class MultinestFitTTE(object):
         )
         chain_path = os.path.join(self._temp_chains_dir, f"tte_{self._version}_")
 
-        # Make temp chains folder if it does not exists already
-        if not os.path.exists(self._temp_chains_dir):
-            os.mkdir(os.path.join(self._temp_chains_dir))
+        # keep a partial run of a killed fit with the same inputs to resume from it
+        resume = _prepare_chains_dir(
+            self._temp_chains_dir, chain_path, self._chains_key()
+        )
+
+        # likelihood evaluations and evidence progress of the run
+        instrumentation = _instrumentation(
+            self._grb_name, "tte", self._version, self._use_dets, resume
+        )
 
         # use multinest to sample the posterior
         # set main_path+trigger to whatever you want to use
@@ -576,10 +1036,21 @@ class MultinestFitTTE(object):
         self._bayes.set_sampler("multinest", share_spectrum=True)
 
         self._bayes.sampler.setup(
-            n_live_points=800, chain_name=chain_path, wrapped_params=wrap, verbose=True
+            n_live_points=n_live_points,
+            chain_name=chain_path,
+            wrapped_params=wrap,
+            verbose=True,
+            resume=resume,
+            dump_callback=instrumentation.dump_callback,
         )
+        instrumentation.attach(self._bayes.sampler)
+
         self._bayes.sample()
 
+        instrumentation.finish()
+
+        _print_interpolation_stats(self._joint)
+
     def save_fit_result(self):
         """
         Save the fits result to '{base_dir}/{grb_name}/{report_type}/{version}/tte_{version}_loc_results.fits'
@@ -3,6 +3,8 @@ import scipy
 from numpy import sqrt
 from scipy.special import erfinv
 
+from morgoth.utils.intervals import drop_short_runs, gaps, merge_intervals, min_length
+
 
 class PoissonResiduals(object):
     """
@@ -149,98 +151,51 @@ class Significance(object):
 
 
 def time_with_less_sigma(residuals, tstart, tstop, sigma_lim):
-    j = 0
+    """
+    Get the time intervals in which the residuals of a detector are below sigma_lim.
+    Single bins above the threshold are ignored, gaps in the data are filled,
+    only intervals starting between -150 and 150 s are used, intervals less than
+    0.2 s apart are merged and intervals shorter than 2 s are dropped.
+    :param residuals: the residuals of all detectors
+    :param tstart: start times of the bins
+    :param tstop: stop times of the bins
+    :param sigma_lim: the sigma threshold
+    :return: list with the time intervals of every detector, for which there is more than one
+    """
     time_intervals_all = []
-    tstart_save = tstart
-    tstop_save = tstop
-    while j < len(residuals):
-        tstart = tstart_save
-        tstop = tstop_save
-        i = 0
-        # get the indices of the bins that are above the threshold
-        index_del = []
-        while i < len(residuals[j]):
-            if residuals[j][i] > sigma_lim:
-                index_del.append(i)
-            i += 1
-        # get the indices of single bins that are above threshold => leave them out later on
-
-        i = 0
-        while i < len(index_del):
-            if i == 0 and len(index_del) > 1:
-                if index_del[i + 1] != index_del[i] + 1:
-                    del index_del[i]
-                else:
-                    i += 1
-            elif i == len(index_del) - 1 and len(index_del) > 1:
-                if index_del[i - 1] != index_del[i] - 1:
-                    del index_del[i]
-                else:
-                    i += 1
-            elif len(index_del) > 2:
-                if (
-                    index_del[i - 1] != index_del[i] - 1
-                    and index_del[i + 1] != index_del[i] + 1
-                ):
-                    del index_del[i]
-                else:
-                    i += 1
-            else:
-                i += 1
-        if len(index_del) == 1:
-            index_del = []
-
-        tstart = tstart.tolist()
-        tstop = tstop.tolist()
-        # fill the missing time
-        i = 0
-        tstartadd = []
-        tstopadd = []
-        while i < len(tstart) - 1:
-            if tstart[i + 1] > tstop[i] + 0.1:
-                tstartadd.append(tstop[i])
-                tstopadd.append(tstart[i + 1])
-            i += 1
+
+    tstart = np.asarray(tstart, dtype=np.float64)
+    tstop = np.asarray(tstop, dtype=np.float64)
+
+    # fill the missing time
+    gap_start, gap_stop = gaps(tstart, tstop, min_gap=0.1)
+
+    for residual in residuals:
+        # get the bins that are above the threshold, without the single bins
+        above = drop_short_runs(np.asarray(residual) > sigma_lim, 2)
+
         # delete the bins that are above the threshold
-        sub = 0
-        for i in index_del:
-            del tstart[i - sub]
-            del tstop[i - sub]
-            sub += 1
-        tstart = sorted(tstart + tstartadd)
-        tstop = sorted(tstop + tstopadd)
-        time_bins = np.vstack((tstart, tstop)).T
-        time_bins = time_bins.tolist()
+        keep = np.ones(len(tstart), dtype=bool)
+        keep[np.flatnonzero(above)] = False
+
+        # starts and stops are sorted independently
+        starts = np.sort(np.concatenate((tstart[keep], gap_start)))
+        stops = np.sort(np.concatenate((tstop[keep], gap_stop)))
+
         # delete time_bins outside of -150-150
-        i = 0
-        while i < len(time_bins):
-            if time_bins[i][0] < -150 or time_bins[i][0] > 150:
-                del time_bins[i]
-            else:
-                i += 1
+        inside = (starts >= -150) & (starts <= 150)
+        starts = starts[inside]
+        stops = stops[inside]
+
         # merge time_bins that are less than 0.2 sec seperated
-        i = 0
-        while i < len(time_bins) - 1:
-            if len(time_bins) == 1:
-                not_whole_time = False
-                break
-            if time_bins[i + 1][0] - time_bins[i][1] < 0.2:
-                time_bins[i] = [time_bins[i][0], time_bins[i + 1][1]]
-                del time_bins[i + 1]
-            else:
-                i += 1
+        starts, stops = merge_intervals(starts, stops, max_gap=0.2)
+
         # delete time selections that are shorter than 2 seconds
-        i = 0
-        while i < len(time_bins):
-            if time_bins[i][1] - time_bins[i][0] < 2:
-                del time_bins[i]
-            else:
-                i += 1
+        starts, stops = min_length(starts, stops, length=2)
 
         # only use the result when it is not one time section from the beginning to the end
-        if len(time_bins) > 1:
-            time_intervals_all.append(time_bins)
-        j += 1
+        if len(starts) > 1:
+            time_intervals_all.append(np.vstack((starts, stops)).T.tolist())
 
     return time_intervals_all
 
@@ -278,8 +233,8 @@ def new_intervals(time_intervals_all):
 
 
 def get_new_intervals(sigma_lim, trig_reader):
-    # get data and bkg rate for all bins
-    observed, background = trig_reader.observed_and_background()
+    # get data and bkg rate for all bins, as (n_det, n_bins) arrays
+    observed, background = trig_reader.observed_and_background_array()
     residuals = []
     i = 0
     while i < len(observed):
@@ -453,6 +408,56 @@ def active_time_selection(
 def bb_binner(t, x, edges):
     """bins x- and t-values into blocks with given edges (BB = Bayesian Blocks)
 
+    The rate of a block is the average of the measurements in it, weighted with
+    the length of their time intervals. A measurement that was cut by the previous
+    edge is used with its full length, the one cut by the end of the block with the
+    length up to the edge. The weighted sums of all blocks are taken from one
+    cumulative sum.
+
+    Args:
+        t (array like): times of measurements
+        x (array like): measurments
+        edges (array like): edges of bayesian blocks
+
+    Returns:
+        list: bin start times, bin values, bin widths
+    """
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+
+    # index of the measurement that contains the end of each block
+    end_ids = np.searchsorted(t, edges[1:], side="left") - 1
+
+    # the blocks have to end inside of the measured time range, one after the other
+    if (
+        len(end_ids) == 0
+        or end_ids[0] < 0
+        or end_ids[-1] > len(t) - 2
+        or np.any(np.diff(end_ids) < 0)
+    ):
+        return _bb_binner_loop(t, x, edges)
+
+    start_ids = np.concatenate(([0], end_ids[:-1]))
+
+    # full measurements from the start to the end of a block
+    weighted = np.concatenate(([0.0], np.cumsum(x[:-1] * np.diff(t))))
+    total_weights = np.concatenate(([0.0], np.cumsum(np.diff(t))))
+
+    # the measurement cut by the end of the block
+    edge_weights = edges[1:] - t[end_ids]
+
+    bb_x = (weighted[end_ids] - weighted[start_ids] + x[end_ids] * edge_weights) / (
+        total_weights[end_ids] - total_weights[start_ids] + edge_weights
+    )
+
+    return edges[:-1], list(bb_x), list(np.diff(edges))
+
+
+def _bb_binner_loop(t, x, edges):
+    """bb_binner for edges outside of the measured times, where the edge cases
+    of the loop have to be followed exactly
+
     Args:
         t (array like): times of measurements
         x (array like): measurments
@@ -0,0 +1,294 @@
+import healpy as hp
+import numpy as np
+from astromodels import clone_model
+from astromodels.functions.priors import Log_uniform_prior
+from scipy.optimize import minimize, minimize_scalar
+
+from morgoth.auto_loc.utils.joint_balrog import JointBALROG
+
+# 2 delta log likelihood of the 1 and 2 sigma regions of the two position parameters
+_delta_chi2_one_sig = 2.30
+_delta_chi2_two_sig = 6.18
+
+
+def healpix_grid(nside):
+    """
+    The centers of all pixels of a HEALPix grid
+    :param nside: nside of the grid
+    :return: ra and dec of the pixel centers in deg
+    """
+    return hp.pix2ang(nside, np.arange(hp.nside2npix(nside)), lonlat=True)
+
+
+class GridScan(object):
+    def __init__(
+        self, plugins, model, nside=8, n_threads=1, batch_size=64, max_iter=20
+    ):
+        """
+        Coarse scan of the BALROG likelihood over a HEALPix grid of positions. The
+        responses of all detectors are built for batches of pixels at once. At
+        every pixel the normalization is profiled first, with the other spectral
+        parameters at their start values, which only scales the fluxes of the
+        start spectrum. All spectral parameters are then profiled from there.
+        Every pixel starts from the center of the priors, in log space for the
+        normalizations, as the start values of the model can be far from any
+        burst. The profiles have at most max_iter iterations, so a bad pixel
+        does not spread to the others.
+        :param plugins: BALROGLike plugins with a fixed position
+        :param model: the model of the fit, the scan uses a copy of it
+        :param nside: nside of the grid
+        :param n_threads: threads that build the responses of the detectors
+        :param batch_size: number of pixels whose responses are built together
+        :param max_iter: max iterations of the profiles of a pixel
+        """
+        self._plugins = plugins
+        self._nside = nside
+        self._batch_size = batch_size
+        self._max_iter = max_iter
+
+        self._model = clone_model(model)
+
+        for source in self._model.point_sources.values():
+            source.position.ra.free = False
+            source.position.dec.free = False
+
+        for plugin in self._plugins:
+            plugin.set_model(self._model)
+
+        self._joint = JointBALROG(self._plugins, n_threads=n_threads)
+
+        self._params = list(self._model.free_parameters.values())
+
+        names = self.param_names
+
+        assert "K" in names, "The scan profiles the normalization K of the spectrum"
+
+        self._norm = names.index("K")
+
+        # the normalizations are optimized in log space
+        self._log = np.array(
+            [isinstance(param.prior, Log_uniform_prior) for param in self._params]
+        )
+
+        self._bounds = [
+            self._param_bounds(param, log)
+            for param, log in zip(self._params, self._log)
+        ]
+
+        # the center of the bounds, the start values of the model are only used
+        # without bounds
+        self._start = np.array(
+            [
+                (lower + upper) / 2 if lower is not None and upper is not None else x
+                for (lower, upper), x in zip(
+                    self._bounds,
+                    self._to_internal([param.value for param in self._params]),
+                )
+            ]
+        )
+
+        # number of likelihood evaluations
+        self.n_evaluations = 0
+
+    @staticmethod
+    def _param_bounds(param, log):
+        bounds = [param.min_value, param.max_value]
+
+        if param.prior is not None and hasattr(param.prior, "lower_bound"):
+            # the prior within the allowed values of the parameter
+            lower = param.prior.lower_bound.value
+            upper = param.prior.upper_bound.value
+
+            bounds = [
+                lower if bounds[0] is None else max(lower, bounds[0]),
+                upper if bounds[1] is None else min(upper, bounds[1]),
+            ]
+
+        if log:
+            bounds = [np.log10(b) if b is not None else None for b in bounds]
+
+        return tuple(bounds)
+
+    def _to_internal(self, values):
+        values = np.array(values, dtype=float)
+        return np.where(self._log, np.log10(np.abs(values)), values)
+
+    def _to_values(self, x):
+        return np.where(self._log, 10**x, x)
+
+    def _set_params(self, x):
+        for param, value in zip(self._params, self._to_values(x)):
+            param.value = value
+
+    def _log_like(self, flux_scale=1.0):
+        self.n_evaluations += 1
+
+        log_like = self._joint.get_log_like(flux_scale=flux_scale)
+
+        if not np.isfinite(log_like):
+            return -1e30
+
+        return log_like
+
+    def _neg_log_like(self, x):
+        self._set_params(x)
+
+        return -self._log_like()
+
+    def _profile_norm(self):
+        """
+        Profile the normalization at the current position, the other spectral
+        parameters are at the start values
+        :return: max log likelihood and the internal value of the normalization
+        """
+        start = self._start[self._norm]
+        start_value = self._to_values(self._start)[self._norm]
+
+        def neg_log_like(v):
+            value = 10**v if self._log[self._norm] else v
+
+            return -self._log_like(flux_scale=value / start_value)
+
+        bounds = self._bounds[self._norm]
+
+        res = minimize_scalar(
+            neg_log_like,
+            bounds=(
+                bounds[0] if bounds[0] is not None else start - 10,
+                bounds[1] if bounds[1] is not None else start + 10,
+            ),
+            method="bounded",
+            options=dict(maxiter=self._max_iter),
+        )
+
+        return -res.fun, res.x
+
+    def _profile(self):
+        """
+        Profile the spectrum at the current position. The normalization is
+        profiled first, from a spectrum far from the burst the full profile can
+        get stuck on the flat likelihood of a source without counts
+        :return: max log likelihood and the internal values of the spectral parameters
+        """
+        # the fluxes of the start spectrum are scaled for the normalization
+        self._set_params(self._start)
+
+        value, norm = self._profile_norm()
+
+        x = self._start.copy()
+        x[self._norm] = norm
+
+        res = minimize(
+            self._neg_log_like,
+            x,
+            method="L-BFGS-B",
+            bounds=self._bounds,
+            options=dict(maxiter=self._max_iter),
+        )
+
+        if -res.fun > value:
+            return -res.fun, res.x
+
+        return value, x
+
+    def scan(self, pixels=None):
+        """
+        Profile likelihood of the spectrum at the pixels
+        :param pixels: pixels to scan, all pixels of the grid if None
+        :return: max log likelihood and best spectral parameters of every pixel
+        """
+        if pixels is None:
+            pixels = np.arange(self.n_pixels)
+
+        pixels = np.asarray(pixels)
+
+        ra, dec = hp.pix2ang(self._nside, pixels, lonlat=True)
+
+        log_like = np.full(len(pixels), -np.inf)
+        best_params = np.full((len(pixels), len(self._params)), np.nan)
+
+        for first in range(0, len(pixels), self._batch_size):
+            batch = slice(first, first + self._batch_size)
+
+            # the responses of all detectors for the pixels of the batch
+            matrices = self._joint.build(ra[batch], dec[batch])
+
+            for i, pixel_matrices in zip(range(len(pixels))[batch], matrices):
+                self._joint.set_matrices(ra[i], dec[i], pixel_matrices)
+
+                value, x = self._profile()
+
+                if value > -1e30:
+                    log_like[i] = value
+                    best_params[i] = self._to_values(x)
+
+        return log_like, best_params
+
+    @property
+    def n_pixels(self):
+        return hp.nside2npix(self._nside)
+
+    @property
+    def param_names(self):
+        return [param.name for param in self._params]
+
+
+def grid_localization(nside, log_like):
+    """
+    Best position and error circles from the profile likelihood of all pixels
+    :param nside: nside of the grid
+    :param log_like: max log likelihood of every pixel
+    :return: dict with the best position, its errors and the 1 and 2 sigma error circles
+    """
+    ra, dec = healpix_grid(nside)
+
+    best = int(np.nanargmax(log_like))
+
+    delta = 2 * (log_like[best] - log_like)
+
+    # the distance of all pixels to the best pixel in deg
+    best_vec = hp.ang2vec(ra[best], dec[best], lonlat=True)
+    vecs = np.array(hp.ang2vec(ra, dec, lonlat=True))
+    distance = np.rad2deg(np.arccos(np.clip(vecs.dot(best_vec), -1, 1)))
+
+    # the regions have at least the size of a pixel
+    half_pixel = 0.5 * np.rad2deg(hp.nside2resol(nside))
+
+    one_sig = float(distance[delta <= _delta_chi2_one_sig].max() + half_pixel)
+    two_sig = float(distance[delta <= _delta_chi2_two_sig].max() + half_pixel)
+
+    cos_dec = max(np.cos(np.deg2rad(dec[best])), 1e-3)
+
+    return dict(
+        ra=float(ra[best]),
+        dec=float(dec[best]),
+        ra_err=float(min(one_sig / cos_dec, 180.0)),
+        dec_err=one_sig,
+        one_sig_err_circle=one_sig,
+        two_sig_err_circle=two_sig,
+    )
+
+
+def prior_box(ra, dec, width):
+    """
+    Box around a position for the position priors. The ra range is the full circle
+    if the box contains a pole or crosses ra=0, as ra can only have one interval
+    :param ra: ra of the center in deg
+    :param dec: dec of the center in deg
+    :param width: half width of the box in deg
+    :return: ra_min, ra_max, dec_min, dec_max
+    """
+    dec_min = max(dec - width, -90.0)
+    dec_max = min(dec + width, 90.0)
+
+    max_abs_dec = max(abs(dec_min), abs(dec_max))
+
+    if max_abs_dec >= 90.0:
+        return 0.0, 360.0, dec_min, dec_max
+
+    ra_width = width / np.cos(np.deg2rad(max_abs_dec))
+
+    if ra - ra_width < 0.0 or ra + ra_width > 360.0:
+        return 0.0, 360.0, dec_min, dec_max
+
+    return float(ra - ra_width), float(ra + ra_width), dec_min, dec_max
@@ -0,0 +1,627 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import gbm_drm_gen
+import gbm_drm_gen.drmgen as drmgen
+import healpy as hp
+import numba as nb
+import numpy as np
+from gbm_drm_gen.utils.geometry import is_occulted
+
+
+def _threadsafe_numba():
+    """
+    Choose a thread safe threading layer of numba. The matrix kernel of
+    gbm_drm_gen calls the parallel at_scat kernel, which the threads of a
+    JointBALROG launch at the same time. The workqueue layer aborts on
+    concurrent launches, only the tbb and omp layers are thread safe. The
+    layer can only be chosen before the first parallel kernel runs.
+    :return: True if the threading layer is thread safe
+    """
+    try:
+        layer = nb.threading_layer()
+
+    except ValueError:
+        # no parallel kernel ran yet
+        nb.config.THREADING_LAYER = "threadsafe"
+
+        try:
+            # starts the threading layer
+            nb.get_num_threads()
+
+        except ValueError as e:
+            print(f"No thread safe threading layer of numba: {e}")
+            nb.config.THREADING_LAYER = "default"
+            return False
+
+        layer = nb.threading_layer()
+
+    return layer in ("tbb", "omp")
+
+
+# the version of gbm_drm_gen whose matrix kernel _make_drm calls
+_nogil_version = "1.2.2"
+
+# the matrix kernel of gbm_drm_gen compiled without the GIL
+_build_drm_nogil = None
+
+
+def _release_gil():
+    """
+    Compile a copy of the matrix kernel of gbm_drm_gen without the GIL, so the
+    threads of a JointBALROG build the matrices of the detectors at the same time.
+    The copy is called with the arguments of the pinned version of gbm_drm_gen,
+    with another version or without a thread safe threading layer of numba the
+    matrices are built in one thread. The kernel is compiled on its first call.
+    :return: True if the matrices can be built in threads
+    """
+    global _build_drm_nogil
+
+    if gbm_drm_gen.__version__ != _nogil_version:
+        print(
+            f"The threads need gbm_drm_gen {_nogil_version}, "
+            f"found {gbm_drm_gen.__version__}"
+        )
+        return False
+
+    if not _threadsafe_numba():
+        return False
+
+    if _build_drm_nogil is None:
+        _build_drm_nogil = nb.njit(nogil=True, fastmath=True)(
+            drmgen._build_drm.py_func
+        )
+
+    return True
+
+
+def _make_drm(gen, src_az, src_el, geo_az, geo_el):
+    """
+    The DRMGen._make_drm_numba of the pinned gbm_drm_gen with the kernel without the GIL
+    :param gen: the DRM generator
+    :param src_az: azimuth of the source in the spacecraft frame in deg
+    :param src_el: elevation of the source in the spacecraft frame in deg
+    :param geo_az: azimuth of the Earth in the spacecraft frame in deg
+    :param geo_el: elevation of the Earth in the spacecraft frame in deg
+    :return: the drm
+    """
+    n_tmp_phot_bin = 2 * gen._nobins_in + gen._nobins_in % 2
+
+    tmp_phot_bin = np.zeros(n_tmp_phot_bin)
+    tmp_phot_bin[::2] = gen._in_edge[:-1]
+    tmp_phot_bin[1::2] = 10 ** (
+        (np.log10(gen._in_edge[:-1]) + np.log10(gen._in_edge[1:])) / 2.0
+    )
+
+    database = gen._database_nb
+
+    return _build_drm_nogil(
+        src_az,
+        src_el,
+        geo_az,
+        geo_el,
+        nobins_in=gen._nobins_in,
+        nobins_out=gen._nobins_out,
+        Azimuth=database.Azimuth,
+        Zenith=database.Zenith,
+        grid_points_list=database.grid_points_list,
+        milliaz=database.milliaz,
+        millizen=database.millizen,
+        in_edge=gen._in_edge,
+        lat_edge=database.lat_edge,
+        lat_cent=database.lat_cent,
+        theta_cent=database.theta_cent,
+        phi_cent=database.phi_cent,
+        double_phi_cent=database.double_phi_cent,
+        ienerg=database.ienerg,
+        out_edge=gen._out_edge,
+        ein=gen._ein,
+        epx_lo=database.epx_lo,
+        epx_hi=database.epx_hi,
+        ichan=database.ichan,
+        matrix_type=gen._matrix_type,
+        rsps=database.rsps,
+        n_tmp_phot_bin=n_tmp_phot_bin,
+        tmp_phot_bin=tmp_phot_bin,
+        at_scat_data=database.at_scat_data,
+        trigdat_precalc_rsps=gen._database_precalc_trigdat.rsps,
+        trigdat=gen._trigdat,
+        trigdat_mask=gen._trigdat_mask,
+    )
+
+
+def _drm_builder(gen, nogil):
+    """
+    The function that builds the drm of a generator, the kernel without the GIL
+    is only used for generators that do not build the drm on their own
+    :param gen: the DRM generator
+    :param nogil: if the kernel without the GIL is used
+    :return: function of the source and Earth directions
+    """
+    if nogil and type(gen)._make_drm_numba is drmgen.DRMGen._make_drm_numba:
+        return partial(_make_drm, gen)
+
+    return gen._make_drm_numba
+
+
+def _limit_numba_threads(n_threads):
+    """
+    Initializer of the threads of a JointBALROG, the threads share the numba
+    threads of the process for the parallel kernels
+    :param n_threads: number of threads that build matrices
+    """
+    nb.set_num_threads(max(nb.config.NUMBA_NUM_THREADS // n_threads, 1))
+
+
+def _group(arrays):
+    """
+    Index of the first equal array for every array
+    :param arrays: list of arrays
+    :return: the distinct arrays and the index of every array in them
+    """
+    distinct = []
+    index = np.zeros(len(arrays), dtype=int)
+
+    for i, array in enumerate(arrays):
+        for j, other in enumerate(distinct):
+            if array.shape == other.shape and np.array_equal(array, other):
+                index[i] = j
+                break
+
+        else:
+            index[i] = len(distinct)
+            distinct.append(array)
+
+    return distinct, index
+
+
+def _deviation(matrices, reference):
+    """
+    Largest deviation of the matrices of all detectors from the reference matrices,
+    relative to the largest element of the reference matrix of the detector
+    :param matrices: matrices of all detectors
+    :param reference: reference matrices of all detectors
+    :return: the relative deviation
+    """
+    deviation = 0.0
+
+    for matrix, ref in zip(matrices, reference):
+        diff = np.max(np.abs(matrix - ref))
+        scale = np.max(np.abs(ref))
+
+        if diff > 0:
+            deviation = max(deviation, diff / scale if scale > 0 else np.inf)
+
+    return deviation
+
+
+class ResponseGrid(object):
+    def __init__(
+        self,
+        build,
+        nside=64,
+        max_pixels=1000,
+        tolerance=0.05,
+        validate=False,
+        max_cost=1.0,
+        cost_window=200,
+    ):
+        """
+        Responses of all detectors on a HEALPix grid, the response at a position is
+        interpolated between the neighbouring pixels. The pixels are built when they
+        are needed for the first time, so only the region the sampler visits is
+        built, and the least recently used pixels are dropped above max_pixels.
+        Where the neighbouring pixels differ by more than the tolerance, e.g. at
+        the Earth horizon, the response is built exactly. In the validation mode
+        every interpolated response is also compared with the exact one.
+
+        Building the missing pixels of a position costs up to four builds, so while
+        the sampler still explores the whole sky this is more expensive than
+        building the response exactly. The missing pixels are only built while the
+        mean number of builds per response of the last cost_window responses is
+        at most max_cost, otherwise the response is built exactly without pixels.
+        :param build: function of ra and dec that builds the exact matrices of all detectors
+        :param nside: nside of the grid
+        :param max_pixels: max number of pixels in memory
+        :param tolerance: max relative deviation of the neighbouring pixels from the
+        interpolated response
+        :param validate: compare the interpolated responses with the exact ones
+        :param max_cost: max mean number of builds per response to build pixels,
+        an exact build is one
+        :param cost_window: number of responses of the mean
+        """
+        self._build = build
+        self._nside = nside
+        self._max_pixels = max_pixels
+        self._tolerance = tolerance
+        self._validate = validate
+        self._max_cost = max_cost
+
+        self._pixels = OrderedDict()
+
+        # the number of builds of the last responses
+        self._costs = deque(maxlen=cost_window)
+
+        self._stats = dict(
+            responses=0,
+            builds=0,
+            pixel_builds=0,
+            pixel_hits=0,
+            interpolated=0,
+            exact=0,
+            fallback=0,
+            validated=0,
+            max_error=0.0,
+            above_tolerance=0,
+        )
+
+    def _pixel(self, pixel):
+        if pixel in self._pixels:
+            self._pixels.move_to_end(pixel)
+            self._stats["pixel_hits"] += 1
+
+        else:
+            ra, dec = hp.pix2ang(self._nside, pixel, lonlat=True)
+
+            self._pixels[pixel] = self._build(ra, dec)
+            self._stats["pixel_builds"] += 1
+
+            if len(self._pixels) > self._max_pixels:
+                self._pixels.popitem(last=False)
+
+        return self._pixels[pixel]
+
+    def _exact(self, ra, dec, cost):
+        self._costs.append(cost + 1)
+        self._stats["builds"] += cost + 1
+
+        return self._build(ra, dec)
+
+    def matrices(self, ra, dec):
+        """
+        The matrices of all detectors for a position
+        :param ra: ra in deg
+        :param dec: dec in deg
+        :return: list with the matrix of every detector
+        """
+        self._stats["responses"] += 1
+
+        pixels, weights = hp.get_interp_weights(self._nside, ra, dec, lonlat=True)
+
+        pixels = [int(pixel) for pixel, weight in zip(pixels, weights) if weight > 0]
+        weights = [weight for weight in weights if weight > 0]
+
+        missing = sum(pixel not in self._pixels for pixel in pixels)
+
+        if missing > 0 and self._costs and np.mean(self._costs) > self._max_cost:
+            # the pixels would cost more than building the response
+            self._stats["fallback"] += 1
+            return self._exact(ra, dec, 0)
+
+        neighbours = [
+            (weight, self._pixel(pixel)) for pixel, weight in zip(pixels, weights)
+        ]
+
+        matrices = [
+            sum(weight * pixel[det] for weight, pixel in neighbours)
+            for det in range(len(neighbours[0][1]))
+        ]
+
+        if any(
+            _deviation(pixel, matrices) > self._tolerance for _, pixel in neighbours
+        ):
+            self._stats["exact"] += 1
+            return self._exact(ra, dec, missing)
+
+        self._costs.append(missing)
+        self._stats["builds"] += missing
+        self._stats["interpolated"] += 1
+
+        if self._validate:
+            error = _deviation(matrices, self._build(ra, dec))
+
+            self._stats["validated"] += 1
+            self._stats["max_error"] = max(self._stats["max_error"], error)
+
+            if error > self._tolerance:
+                self._stats["above_tolerance"] += 1
+
+        return matrices
+
+    @property
+    def stats(self):
+        """
+        Number of responses, of builds for them (exact builds of the responses and
+        of the pixels, without the validation), of built pixels and of pixels found
+        in memory, of interpolated responses and of responses built exactly at a
+        horizon or because the pixels were too expensive, the mean number of builds
+        per response (1 without the grid) and, in the validation mode, the largest
+        error of the interpolated responses and how many were above the tolerance
+        """
+        stats = dict(self._stats, pixels=len(self._pixels))
+        stats["builds_per_response"] = stats["builds"] / max(stats["responses"], 1)
+
+        return stats
+
+    def clear(self):
+        """
+        Drop the pixels, e.g. when the responses were set to another time
+        :return:
+        """
+        self._pixels.clear()
+        self._costs.clear()
+
+
+class JointBALROG(object):
+    def __init__(self, plugins, interpolation=None, n_threads=1):
+        """
+        Joint likelihood of the BALROGLike plugins of all detectors of a fit. All
+        detectors see the source at the same position, so for a new position the
+        direction in the spacecraft frame and the Earth occultation are computed
+        once and the responses of all detectors are built in one pass, instead of
+        every plugin doing it on its own. The plugins with the same photon energy
+        grid share the integral of the spectrum, which is kept for the last
+        spectral parameters.
+
+        The set_location of the responses of the plugins is replaced, so the
+        plugins with a free position build all responses through this object when
+        the sampler changes the position and the other plugins of the same
+        likelihood evaluation reuse them. Their set_time is wrapped, so a new time
+        updates the spacecraft frames and the next position is built again. The
+        get_log_like of the plugins is wrapped, so the likelihood of the sampler
+        also integrates the spectrum once per photon energy grid.
+        :param plugins: the BALROGLike plugins, the time of their responses has to be set
+        :param interpolation: optional dict with the settings of a ResponseGrid to
+        interpolate the responses instead of building them for every position
+        :param n_threads: threads that build the matrices of the detectors
+        """
+        self._plugins = plugins
+        self._generators = [plugin.response._drm_generator for plugin in plugins]
+
+        self._update_frames()
+
+        # the detectors with the same photon energy grid
+        grids, self._grid_index = _group(
+            [np.asarray(plugin.response.monte_carlo_energies) for plugin in plugins]
+        )
+        self._grid_plugins = [
+            plugins[int(np.argmax(self._grid_index == i))] for i in range(len(grids))
+        ]
+
+        self._pool = None
+        nogil = False
+
+        if n_threads > 1 and len(plugins) > 1:
+            nogil = _release_gil()
+
+            if nogil:
+                n_threads = min(n_threads, len(plugins))
+
+                self._pool = ThreadPoolExecutor(
+                    max_workers=n_threads,
+                    initializer=_limit_numba_threads,
+                    initargs=(n_threads,),
+                )
+
+            else:
+                print("The matrices of the detectors are built in one thread")
+
+        self._make_drm = [_drm_builder(gen, nogil) for gen in self._generators]
+
+        self._response_grid = (
+            ResponseGrid(self._build, **interpolation)
+            if interpolation is not None
+            else None
+        )
+
+        self._location = None
+        self._spectrum_key = None
+        self._fluxes = None
+
+        for plugin, grid in zip(plugins, self._grid_index):
+            plugin.response.set_location = self._set_response_location
+            plugin.response.set_time = partial(self._set_response_time, plugin.response)
+            plugin.get_log_like = partial(self._get_plugin_log_like, plugin, grid)
+
+    def _update_frames(self):
+        """
+        Group the detectors by their spacecraft frame, usually all are in the same
+        frame as the responses are built for the same time
+        :return:
+        """
+        frames, self._frame_index = _group(
+            [
+                np.array([gen._scx, gen._scy, gen._scz, gen._sc_pos])
+                for gen in self._generators
+            ]
+        )
+        frames = np.array(frames)
+
+        self._rotations = frames[:, :3]
+        self._sc_pos = frames[:, 3]
+
+    def _set_response_location(self, ra, dec, cache=False):
+        self.set_location(ra, dec)
+
+    def _get_plugin_log_like(self, plugin, grid, precalc_fluxes=None):
+        """
+        The log likelihood of a plugin with the shared fluxes of its photon energy grid
+        :param plugin: the plugin
+        :param grid: the index of its photon energy grid
+        :param precalc_fluxes: fluxes to use instead of the shared ones
+        :return: log likelihood
+        """
+        if precalc_fluxes is None:
+            precalc_fluxes = self._spectrum_fluxes()[grid]
+
+        return type(plugin).get_log_like(plugin, precalc_fluxes=precalc_fluxes)
+
+    def _set_response_time(self, response, time):
+        """
+        Set the time of a response, the frames, the current position and the
+        pixels of the grid are of the old time
+        :param response: the BALROG_DRM of a plugin
+        :param time: the time
+        :return:
+        """
+        type(response).set_time(response, time)
+
+        self._update_frames()
+        self._location = None
+
+        if self._response_grid is not None:
+            self._response_grid.clear()
+
+    def _build(self, ra, dec):
+        """
+        Build the matrices of all detectors for a position
+        :param ra: ra of the source in deg
+        :param dec: dec of the source in deg
+        :return: list with the matrix of every detector
+        """
+        return self.build([ra], [dec])[0]
+
+    def build(self, ra, dec):
+        """
+        Build the matrices of all detectors for a batch of positions. The
+        directions in the spacecraft frames are computed for all positions at
+        once and the matrices of all detectors and positions are built in one
+        pass over the threads
+        :param ra: array with the ra of the positions in deg
+        :param dec: array with the dec of the positions in deg
+        :return: list with the list of the matrices of every detector for every position
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+        ra_rad = np.deg2rad(ra)
+        dec_rad = np.deg2rad(dec)
+
+        cart = np.stack(
+            [
+                np.cos(dec_rad) * np.cos(ra_rad),
+                np.cos(dec_rad) * np.sin(ra_rad),
+                np.sin(dec_rad),
+            ],
+            axis=-1,
+        )
+
+        # the direction of the sources in all spacecraft frames at once
+        direction = np.einsum("fij,nj->nfi", self._rotations, cart)
+
+        az = np.arctan2(direction[..., 1], direction[..., 0])
+        az = np.rad2deg(np.where(az < 0.0, az + 2 * np.pi, az))
+        el = 90 - np.rad2deg(np.arccos(np.clip(direction[..., 2], -1.0, 1.0)))
+
+        occulted = [
+            [is_occulted(r, d, sc_pos) for sc_pos in self._sc_pos]
+            for r, d in zip(ra, dec)
+        ]
+
+        jobs = [
+            (position, det, frame)
+            for position in range(len(ra))
+            for det, frame in enumerate(self._frame_index)
+        ]
+
+        def build_drm(job):
+            position, det, frame = job
+            gen = self._generators[det]
+
+            if gen._occult and occulted[position][frame]:
+                return gen._occulted_DRM
+
+            return self._make_drm[det](
+                az[position, frame], el[position, frame], gen._geo_az, gen._geo_el
+            )
+
+        if self._pool is not None:
+            drms = list(self._pool.map(build_drm, jobs))
+
+        else:
+            drms = list(map(build_drm, jobs))
+
+        n = len(self._generators)
+
+        # the matrix of a DRM generator is the transposed drm
+        return [
+            [drm.T for drm in drms[position * n : (position + 1) * n]]
+            for position in range(len(ra))
+        ]
+
+    def set_location(self, ra, dec):
+        """
+        Set the responses of all detectors to a position, nothing is done if it
+        is the position of the current responses
+        :param ra: ra of the source in deg
+        :param dec: dec of the source in deg
+        :return:
+        """
+        if self._location == (ra, dec):
+            return
+
+        if self._response_grid is not None:
+            matrices = self._response_grid.matrices(ra, dec)
+
+        else:
+            matrices = self._build(ra, dec)
+
+        self.set_matrices(ra, dec, matrices)
+
+    def set_matrices(self, ra, dec, matrices):
+        """
+        Set the responses of all detectors to matrices built for a position
+        :param ra: ra of the position in deg
+        :param dec: dec of the position in deg
+        :param matrices: list with the matrix of every detector, see build
+        :return:
+        """
+        for plugin, matrix in zip(self._plugins, matrices):
+            response = plugin.response
+            response._matrix = matrix
+            response._matrix_transpose = matrix.T
+
+        self._location = (ra, dec)
+
+    @property
+    def response_grid(self):
+        """
+        The ResponseGrid of the interpolated responses, None if they are built exactly
+        """
+        return self._response_grid
+
+    def _spectrum_fluxes(self):
+        """
+        The integral of the spectrum over every photon energy grid, only computed
+        again if a parameter of the spectrum changed
+        :return: list with the fluxes of every grid
+        """
+        model = self._plugins[0]._like_model
+
+        key = (id(model),) + tuple(
+            param.value
+            for name, param in model.parameters.items()
+            if ".position." not in name
+        )
+
+        if key != self._spectrum_key:
+            self._fluxes = [plugin._integral_flux() for plugin in self._grid_plugins]
+            self._spectrum_key = key
+
+        return self._fluxes
+
+    def get_log_like(self, flux_scale=1.0):
+        """
+        The summed log likelihood of all plugins for the current model
+        :param flux_scale: factor of the fluxes of the current spectrum. The fluxes
+        are linear in the normalization, so a profile of the normalization reuses
+        the fluxes of one normalization
+        :return: log likelihood
+        """
+        fluxes = self._spectrum_fluxes()
+
+        return sum(
+            plugin.get_log_like(precalc_fluxes=flux_scale * fluxes[grid])
+            for plugin, grid in zip(self._plugins, self._grid_index)
+        )
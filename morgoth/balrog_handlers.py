@@ -18,14 +18,21 @@ from morgoth.exceptions.custom_exceptions import UnkownReportType
 from morgoth.time_selection_handler import TimeSelectionHandler
 from morgoth.trigger import OpenGBMFile
 from morgoth.utils.env import get_env_value
-from morgoth.utils.result_reader import ResultReader
+from morgoth.utils.fit_events import events_file_path
+from morgoth.utils.multinest_chains import ChainProgressMonitor
+from morgoth.utils.result_reader import GridResultReader, ResultReader
 from threeML import loud_mode
 
 loud_mode()
 
 base_dir = get_env_value("GBM_TRIGGER_DATA_DIR")
 n_cores_multinest = morgoth_config["multinest"]["n_cores"]
+n_threads_multinest = morgoth_config["multinest"]["n_threads"]
 path_to_python = morgoth_config["multinest"]["path_to_python"]
+n_live_points = morgoth_config["multinest"]["n_live_points"]
+progress_interval = morgoth_config["multinest"]["progress_interval"]
+pre_localization = morgoth_config["pre_localization"]
+prometheus_dir = morgoth_config["instrumentation"]["prometheus_dir"]
 
 
 _gbm_detectors = (
@@ -46,6 +53,67 @@ _gbm_detectors = (
 )
 
 
+def _mpiexec():
+    """
+    The mpiexec part of the fit commands. One rank per core, or in the hybrid
+    mode n_cores / n_threads ranks that get n_threads cores each for the threads
+    that build the responses of the detectors. The numba threads of a rank are
+    limited to its cores
+    :return: list with the arguments
+    """
+    if n_threads_multinest > 1:
+        n_ranks = max(n_cores_multinest // n_threads_multinest, 1)
+
+        return [
+            "mpiexec",
+            "-n",
+            f"{n_ranks}",
+            "--map-by",
+            f"slot:PE={n_threads_multinest}",
+            "--bind-to",
+            "core",
+            "-x",
+            f"NUMBA_NUM_THREADS={n_threads_multinest}",
+        ]
+
+    return ["mpiexec", "-n", f"{n_cores_multinest}", "--bind-to", "core"]
+
+
+def _run_with_progress(task, chain_path, report_type):
+    """
+    Run the fit script of a RunBalrog task and report the progress of
+    the MultiNest run from its instrumentation events or its chains as
+    status message of the task and as Prometheus text file
+    :param task: the RunBalrog task
+    :param chain_path: the chain name of the MultiNest run
+    :param report_type: trigdat or tte
+    :return:
+    """
+    events_file = events_file_path(base_dir, task.grb_name, report_type, task.version)
+
+    prom_file = os.path.join(
+        prometheus_dir if prometheus_dir else os.path.dirname(events_file),
+        f"morgoth_{task.grb_name}_{report_type}_{task.version}.prom",
+    )
+
+    if not os.path.exists(os.path.dirname(prom_file)):
+        os.makedirs(os.path.dirname(prom_file))
+
+    def report(message):
+        print(f"{task.grb_name} {task.version}: {message}")
+        task.set_status_message(message)
+
+    with ChainProgressMonitor(
+        chain_path,
+        report,
+        n_live_points=n_live_points,
+        interval=progress_interval,
+        events_file=events_file,
+        prom_file=prom_file,
+    ):
+        ExternalProgramTask.run(task)
+
+
 class ProcessFitResults(luigi.Task):
     resources = {"max_workers": 1}
     grb_name = luigi.Parameter()
@@ -178,12 +246,7 @@ class RunBalrogTTE(ExternalProgramTask):
             f"{os.path.dirname(os.path.abspath(__file__))}/auto_loc/fit_script.py"
         )
 
-        command = [
-            "mpiexec",
-            f"-n",
-            f"{n_cores_multinest}",
-            f"--bind-to",
-            f"core",
+        command = _mpiexec() + [
             f"{path_to_python}",
             f"{fit_script_path}",
             f"{self.grb_name}",
@@ -196,6 +259,14 @@ class RunBalrogTTE(ExternalProgramTask):
 
         return command
 
+    def run(self):
+        # the fit resumes from the chains of a killed run in the temp chains dir
+        chain_path = os.path.join(
+            base_dir, self.grb_name, f"c_tte_{self.version}", f"tte_{self.version}_"
+        )
+
+        _run_with_progress(self, chain_path, "tte")
+
 
 class RunBalrogTrigdat(ExternalProgramTask):
     resources = {"max_workers": 1}
@@ -205,7 +276,7 @@ class RunBalrogTrigdat(ExternalProgramTask):
     always_log_stderr = True
 
     def requires(self):
-        return {
+        requirements = {
             "trigdat_file": DownloadTrigdat(
                 grb_name=self.grb_name, version=self.version
             ),
@@ -217,6 +288,14 @@ class RunBalrogTrigdat(ExternalProgramTask):
             ),
         }
 
+        # the grid scan seeds the position priors
+        if pre_localization["enabled"] and pre_localization["seed_prior"]:
+            requirements["grid_scan"] = RunGridScanTrigdat(
+                grb_name=self.grb_name, version=self.version
+            )
+
+        return requirements
+
     def output(self):
         base_job = os.path.join(base_dir, self.grb_name, "trigdat", self.version)
         fit_result_name = f"trigdat_{self.version}_loc_results.fits"
@@ -237,12 +316,7 @@ class RunBalrogTrigdat(ExternalProgramTask):
             f"{os.path.dirname(os.path.abspath(__file__))}/auto_loc/fit_script.py"
         )
 
-        command = [
-            "mpiexec",
-            f"-n",
-            f"{n_cores_multinest}",
-            f"--bind-to",
-            f"core",
+        command = _mpiexec() + [
             f"{path_to_python}",
             f"{fit_script_path}",
             f"{self.grb_name}",
@@ -253,4 +327,119 @@ class RunBalrogTrigdat(ExternalProgramTask):
             f"trigdat",
         ]
 
+        if "grid_scan" in self.input():
+            command.append(f"{self.input()['grid_scan']['grid_result'].path}")
+
         return command
+
+    def run(self):
+        # the fit resumes from the chains of a killed run in the temp chains dir
+        chain_path = os.path.join(
+            base_dir,
+            self.grb_name,
+            f"c_trig_{self.version}",
+            f"trigdat_{self.version}_",
+        )
+
+        _run_with_progress(self, chain_path, "trigdat")
+
+
+class RunGridScanTrigdat(ExternalProgramTask):
+    resources = {"max_workers": 1}
+    grb_name = luigi.Parameter()
+    version = luigi.Parameter(default="v00")
+    priority = 200
+    always_log_stderr = True
+
+    def requires(self):
+        return {
+            "trigdat_file": DownloadTrigdat(
+                grb_name=self.grb_name, version=self.version
+            ),
+            "bkg_fit": BackgroundFitTrigdat(
+                grb_name=self.grb_name, version=self.version
+            ),
+            "time_selection": TimeSelectionHandler(
+                grb_name=self.grb_name, version=self.version, report_type="trigdat"
+            ),
+        }
+
+    def output(self):
+        base_job = os.path.join(base_dir, self.grb_name, "trigdat", self.version)
+
+        return {
+            "grid_result": luigi.LocalTarget(
+                os.path.join(base_job, f"trigdat_{self.version}_grid_result.yml")
+            ),
+            "healpix": luigi.LocalTarget(
+                os.path.join(base_job, f"trigdat_{self.version}_grid_healpix.fits")
+            ),
+        }
+
+    def program_args(self):
+        fit_script_path = (
+            f"{os.path.dirname(os.path.abspath(__file__))}/auto_loc/fit_script.py"
+        )
+
+        command = _mpiexec() + [
+            f"{path_to_python}",
+            f"{fit_script_path}",
+            f"{self.grb_name}",
+            f"{self.version}",
+            f"{self.input()['trigdat_file'].path}",
+            f"{self.input()['bkg_fit']['bkg_fit_yml'].path}",
+            f"{self.input()['time_selection'].path}",
+            f"trigdat_grid",
+            f"{self.output()['grid_result'].path}",
+            f"{self.output()['healpix'].path}",
+            f"{pre_localization['nside']}",
+        ]
+
+        return command
+
+
+class ProcessGridResults(luigi.Task):
+    resources = {"max_workers": 1}
+    grb_name = luigi.Parameter()
+    version = luigi.Parameter(default="v00")
+    priority = 200
+
+    def requires(self):
+        return {
+            "gbm_file": OpenGBMFile(grb=self.grb_name),
+            "time_selection": TimeSelectionHandler(
+                grb_name=self.grb_name, version=self.version, report_type="trigdat"
+            ),
+            "bkg_fit": BackgroundFitTrigdat(
+                grb_name=self.grb_name, version=self.version
+            ),
+            "grid_scan": RunGridScanTrigdat(
+                grb_name=self.grb_name, version=self.version
+            ),
+        }
+
+    def output(self):
+        base_job = os.path.join(base_dir, self.grb_name, "trigdat", self.version)
+        result_name = f"grid_{self.version}_fit_result.yml"
+
+        return {
+            "result_file": luigi.LocalTarget(os.path.join(base_job, result_name)),
+        }
+
+    def run(self):
+        trigdat_file = DownloadTrigdat(
+            grb_name=self.grb_name, version=self.version
+        ).output()
+
+        result_reader = GridResultReader(
+            grb_name=self.grb_name,
+            report_type="grid",
+            version=self.version,
+            trigger_file=self.input()["gbm_file"].path,
+            time_selection_file=self.input()["time_selection"].path,
+            background_file=self.input()["bkg_fit"]["bkg_fit_yml"].path,
+            grid_result_file=self.input()["grid_scan"]["grid_result"].path,
+            trigdat_file=trigdat_file,
+        )
+
+        result_reader.save_result_yml(self.output()["result_file"].path)
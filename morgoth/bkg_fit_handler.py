@@ -12,6 +12,7 @@ from morgoth.downloaders import (
     GatherTrigdatDownload,
 )
 from morgoth.time_selection_handler import TimeSelectionHandler
+from morgoth.utils.analysis_cache import AnalysisCache
 
 base_dir = os.environ.get("GBM_TRIGGER_DATA_DIR")
 
@@ -147,6 +148,7 @@ class BackgroundFitTrigdat(luigi.Task):
             self.version,
             trigdat_file=self.input()["trigdat_file"].path,
             time_selection_file_path=self.input()["time_selection"].path,
+            analysis_cache=AnalysisCache(self.grb_name),
         )
 
         # Save background fit
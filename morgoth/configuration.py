@@ -5,7 +5,31 @@ structure = {}
 
 structure["pygcn"] = dict(port=8099)
 structure["luigi"] = dict(n_workers=16)
-structure["multinest"] = dict(n_cores=8, path_to_python="/home/balrog/.environs/test_3.9.11.2/bin/python")
+structure["dispatcher"] = dict(enabled=False, max_bursts=4)
+structure["time_selection"] = dict(n_workers=1)
+structure["cache"] = dict(enabled=True, max_size_gb=10)
+structure["response_cache"] = dict(max_disk_size_gb=1)
+structure["bkg_fit"] = dict(n_workers=1, warm_start=False)
+structure["multinest"] = dict(
+    n_cores=8,
+    n_threads=1,
+    path_to_python="/home/balrog/.environs/test_3.9.11.2/bin/python",
+    n_live_points=800,
+    resume=True,
+    progress_interval=60,
+)
+structure["instrumentation"] = dict(interval=30, prometheus_dir="")
+structure["response_interpolation"] = dict(
+    enabled=False,
+    nside=64,
+    max_pixels=1000,
+    tolerance=0.05,
+    validate=False,
+    max_cost=1.0,
+)
+structure["pre_localization"] = dict(
+    enabled=False, nside=8, seed_prior=False, prior_box_scale=3, min_prior_box=30
+)
 structure["download"] = dict(
     trigdat=dict(
         v00=dict(interval=5, max_time=1800),
@@ -22,6 +46,8 @@ structure["download"] = dict(
         v01=dict(interval=5, max_time=7200),
         v02=dict(interval=5, max_time=7200),
     ),
+    probe=dict(min_wait=2, max_wait=30, max_time=7200),
+    chunk_size=1048576,
 )
 structure["upload"] = dict(
     report=dict(
@@ -0,0 +1,210 @@
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from morgoth.configuration import morgoth_config
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_up():
+    """
+    Imports the heavy modules (threeML, astromodels, gbm_drm_gen,
+    astropy, ...) in the dispatcher before the workers are forked,
+    so that no burst has to pay for the cold import.
+
+    :returns:
+    :rtype:
+
+    """
+    import luigi
+
+    import morgoth.reports
+
+
+def _build_pipeline(grb, n_workers):
+    """
+    Run the full luigi pipeline for one burst inside a warm worker.
+
+    :param grb: name of the burst
+    :param n_workers: number of luigi workers for this burst
+    :returns: True if luigi scheduled all tasks successfully
+    :rtype: bool
+
+    """
+    import luigi
+
+    from morgoth.reports import CreateAllPages
+
+    return luigi.build(
+        [CreateAllPages(grb_name=grb)],
+        workers=n_workers,
+        local_scheduler=False,
+        scheduler_host="localhost",
+        log_level="INFO",
+    )
+
+
+class PipelineDispatcher(object):
+    def __init__(self, max_bursts=None, n_workers=None, build_function=_build_pipeline):
+        """
+        A long lived dispatcher that keeps a pool of warm worker processes
+        and submits the pipeline of new bursts to it, instead of forking
+        a luigi CLI for every notice. At most max_bursts run at the same
+        time, the bursts above are queued and started in order when a
+        running burst is finished.
+
+        :param max_bursts: max number of bursts that are processed at the same time
+        :param n_workers: number of luigi workers per burst
+        :param build_function: function(grb, n_workers) that runs the pipeline
+        :returns:
+        :rtype:
+
+        """
+        if max_bursts is None:
+            max_bursts = morgoth_config["dispatcher"]["max_bursts"]
+
+        if n_workers is None:
+            n_workers = morgoth_config["luigi"]["n_workers"]
+
+        self._max_bursts = int(max_bursts)
+        self._n_workers = int(n_workers)
+        self._build_function = build_function
+
+        self._lock = threading.Lock()
+        self._active = {}
+        self._queue = deque()
+        self._queued_at = {}
+        self._finished = {}
+
+        # the workers are forked with the modules of the dispatcher
+        _warm_up()
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self._max_bursts,
+            mp_context=multiprocessing.get_context("fork"),
+        )
+
+    @property
+    def max_bursts(self):
+        return self._max_bursts
+
+    @property
+    def n_active(self):
+        with self._lock:
+            return len(self._active)
+
+    @property
+    def active_bursts(self):
+        with self._lock:
+            return list(self._active.keys())
+
+    @property
+    def queued_bursts(self):
+        with self._lock:
+            return list(self._queue)
+
+    def stats(self):
+        """
+        Summary of what the dispatcher has admitted so far
+
+        :returns: dict with the run times of the active and finished bursts
+        and the waiting times of the queued bursts
+        :rtype: dict
+
+        """
+        now = time.time()
+
+        with self._lock:
+            return dict(
+                max_bursts=self._max_bursts,
+                active={grb: now - t0 for grb, (t0, _) in self._active.items()},
+                queued={grb: now - self._queued_at[grb] for grb in self._queue},
+                finished=dict(self._finished),
+            )
+
+    def submit(self, grb):
+        """
+        Admit a burst and run its pipeline in the warm pool, if max_bursts
+        are running the burst is queued
+
+        :param grb: name of the burst
+        :returns: the future of the pipeline run or None if the burst was queued
+        or is already in the dispatcher
+        :rtype:
+
+        """
+        with self._lock:
+            if grb in self._active or grb in self._queue:
+                logger.info(f"{grb} is already in the dispatcher")
+                return None
+
+            if len(self._active) >= self._max_bursts:
+                logger.info(
+                    f"Dispatcher is full ({self._max_bursts} bursts), {grb} is queued "
+                    f"behind {len(self._queue)} bursts"
+                )
+                self._queue.append(grb)
+                self._queued_at[grb] = time.time()
+                return None
+
+            future = self._start(grb)
+
+        future.add_done_callback(lambda f, grb=grb: self._done(grb, f))
+
+        return future
+
+    def _start(self, grb):
+        # called with the lock
+        future = self._pool.submit(self._build_function, grb, self._n_workers)
+        self._active[grb] = (time.time(), future)
+
+        return future
+
+    def _done(self, grb, future):
+        with self._lock:
+            t0, _ = self._active.pop(grb)
+
+            try:
+                success = bool(future.result())
+            except Exception as e:
+                logger.error(f"Pipeline of {grb} failed in the dispatcher:\n{e}")
+                success = False
+
+            self._finished[grb] = dict(run_time=time.time() - t0, success=success)
+
+            next_future = None
+
+            if self._queue:
+                next_grb = self._queue.popleft()
+                wait_time = time.time() - self._queued_at.pop(next_grb)
+
+                logger.info(f"Start {next_grb} after {wait_time:.0f} s in the queue")
+
+                next_future = self._start(next_grb)
+
+        if next_future is not None:
+            next_future.add_done_callback(
+                lambda f, grb=next_grb: self._done(grb, f)
+            )
+
+    def shutdown(self, wait=True):
+        """
+        Drop the queued bursts and stop the pool
+
+        :param wait: wait for the running bursts
+        :returns:
+        :rtype:
+
+        """
+        with self._lock:
+            for grb in self._queue:
+                logger.warning(f"{grb} is dropped from the dispatcher queue")
+
+            self._queue.clear()
+            self._queued_at.clear()
+
+        self._pool.shutdown(wait=wait)
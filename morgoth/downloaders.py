@@ -1,16 +1,20 @@
+import fcntl
 import os
+import subprocess
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import luigi
 import yaml
 
-import urllib.request
-from urllib.error import HTTPError
-
 from morgoth.configuration import morgoth_config
 from morgoth.trigger import GBMTriggerFile, OpenGBMFile
 from morgoth.utils import file_utils
+from morgoth.utils.availability_probe import AvailabilityProbe
 from morgoth.utils.download_file import BackgroundDownload
+from morgoth.utils.trigdat_watcher import TrigdatWatcher
 from morgoth.utils.env import get_env_value
 
 base_dir = get_env_value("GBM_TRIGGER_DATA_DIR")
@@ -32,94 +36,266 @@ lu = [
 ]
 
 
-class GatherTrigdatDownload(luigi.Task):
-    priority = 50
-    resources = {"max_workers": 1}
-    grb_name = luigi.Parameter()
+def _detach(cmd, pass_fds=()):
+    """
+    Start a command in a session of its own. It is started by an intermediate
+    process that exits at once, so the command is reparented to init, which
+    reaps it, and no zombie is left in the calling process
 
-    def requires(self):
-        return OpenGBMFile(grb=self.grb_name)
+    :param cmd: list with the command
+    :param pass_fds: file descriptors the command inherits
+    :returns:
+    :rtype:
 
-    def output(self):
-        return luigi.LocalTarget(
-            os.path.join(base_dir, self.grb_name, f"gather_trigdat_complete.yml")
+    """
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import subprocess, sys; "
+            f"subprocess.Popen(sys.argv[1:], pass_fds={tuple(pass_fds)!r}, "
+            "start_new_session=True)",
+        ]
+        + list(cmd),
+        pass_fds=pass_fds,
+        check=True,
+    )
+
+
+def _trigger_pipeline(grb_name):
+    """
+    Run the luigi pipeline of the burst again, so the tasks that need the
+    trigdat file that was just downloaded are scheduled. The central scheduler
+    does not run the tasks twice that the other runs of the burst still run.
+
+    :param grb_name: the name of the burst
+    :returns:
+    :rtype:
+
+    """
+    from morgoth.handler import form_morgoth_cmd_string
+
+    _detach(form_morgoth_cmd_string(grb_name, background=False))
+
+
+def watch_trigdat(grb_name):
+    """
+    Watch the current/ directory of a burst and download every trigdat
+    version as soon as it shows up. The downloads run in threads, so the
+    listing goes on while a version is downloaded. After every download the
+    pipeline of the burst is run again for the tasks that wait for the file.
+    A failed download is recorded for its version and the watcher keeps
+    going. The latencies and the errors are written to
+    trigdat/trigdat_watcher.yml at the end.
+
+    This runs in the process that WatchTrigdat starts.
+
+    :param grb_name: the name of the burst
+    :returns:
+    :rtype:
+
+    """
+    info = GBMTriggerFile.from_file(OpenGBMFile(grb=grb_name).output())
+
+    versions = ["v00", "v01", "v02"]
+    trigdat_config = morgoth_config["download"]["trigdat"]
+
+    watcher = TrigdatWatcher(
+        info.uri,
+        grb_name,
+        versions=versions,
+        interval=min(float(trigdat_config[v]["interval"]) for v in versions),
+        max_time=max(float(trigdat_config[v]["max_time"]) for v in versions),
+        trigger_time=info.trigger_time,
+    )
+
+    store_path = os.path.join(base_dir, grb_name, "trigdat")
+
+    gather_lock = threading.Lock()
+
+    def download(version, uri):
+        dl = BackgroundDownload(
+            uri,
+            store_path,
+            wait_time=float(trigdat_config[version]["interval"]),
+            max_time=float(trigdat_config[version]["max_time"]),
         )
+        dl.run()
 
-    def run(self):
-        # the time spent waiting so far
-        time_spent = 0  # seconds
+        # Create the version subfolder when download is done
+        file_utils.if_directory_not_existing_then_make(
+            os.path.join(store_path, version)
+        )
+
+        # the first version that is downloaded starts the trigdat analysis
+        gather = GatherTrigdatDownload(grb_name=grb_name)
 
-        while True:
-            if DownloadTrigdat(grb_name=self.grb_name, version="v00").complete():
-                version = "v00"
-                break
+        with gather_lock:
+            if not gather.complete():
+                version_dict = {"trigdat_version": version}
 
-            if DownloadTrigdat(grb_name=self.grb_name, version="v01").complete():
-                version = "v01"
-                break
+                with gather.output().open("w") as f:
+                    yaml.dump(
+                        version_dict,
+                        f,
+                        Dumper=yaml.SafeDumper,
+                        default_flow_style=False,
+                    )
 
-            if DownloadTrigdat(grb_name=self.grb_name, version="v02").complete():
-                version = "v02"
-                break
+        # the tasks that need this version were left pending
+        _trigger_pipeline(grb_name)
 
-            time.sleep(2)
+    pool = ThreadPoolExecutor(max_workers=len(versions))
+    downloads = {}
 
-            # up date the time we have left
-            time_spent += 2
+    watcher.add_callback(
+        lambda version, uri: downloads.update(
+            {version: pool.submit(download, version, uri)}
+        )
+    )
 
-        print(f"The total waiting time was: {time_spent}")
+    errors = {}
 
-        version_dict = {"trigdat_version": version}
+    try:
+        watcher.run()
 
-        with self.output().open("w") as f:
-            yaml.dump(version_dict, f, Dumper=yaml.SafeDumper, default_flow_style=False)
+    finally:
+        for version, future in downloads.items():
+            try:
+                future.result()
 
+            except Exception as e:
+                print(f"Download of trigdat {version} of {grb_name} failed: {e}")
+                errors[version] = repr(e)
 
-class DownloadTrigdat(luigi.Task):
+        pool.shutdown()
+
+        watcher_dict = {
+            "latencies": watcher.latencies,
+            "missing": watcher.missing,
+            "errors": errors,
+            "n_listings": watcher.n_listings,
+        }
+
+        with WatchTrigdat(grb_name=grb_name).output().open("w") as f:
+            yaml.dump(watcher_dict, f, Dumper=yaml.SafeDumper, default_flow_style=False)
+
+
+class WatchTrigdat(luigi.Task):
     """
-    Downloads a Trigdat file of a given
-    version
+    Starts the single process of a burst that watches the current/
+    directory and downloads every trigdat version, see watch_trigdat.
+    The task is complete as soon as the watcher runs. The watcher holds
+    a lock on trigdat/trigdat_watcher.lock as long as it runs.
     """
 
-    resources = {"max_workers": 1}
     priority = 100
     grb_name = luigi.Parameter()
-    version = luigi.Parameter()
 
     def requires(self):
         return OpenGBMFile(grb=self.grb_name)
 
     def output(self):
-        trigdat = f"glg_trigdat_all_bn{self.grb_name[3:]}_{self.version}.fit"
         return luigi.LocalTarget(
-            os.path.join(base_dir, self.grb_name, "trigdat", trigdat)
+            os.path.join(base_dir, self.grb_name, "trigdat", "trigdat_watcher.yml")
+        )
+
+    def _lock_file(self):
+        return os.path.join(
+            base_dir, self.grb_name, "trigdat", "trigdat_watcher.lock"
         )
 
+    def running(self):
+        """
+        If the watcher process of the burst is running, i.e. holds the lock
+
+        :returns: True if it is running
+        :rtype: bool
+
+        """
+        try:
+            fd = os.open(self._lock_file(), os.O_RDWR)
+
+        except FileNotFoundError:
+            return False
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        except BlockingIOError:
+            return True
+
+        finally:
+            os.close(fd)
+
+        return False
+
+    def complete(self):
+        return self.output().exists() or self.running()
+
     def run(self):
-        # get the info from the stored yaml file
-        info = GBMTriggerFile.from_file(self.input())
+        file_utils.if_directory_not_existing_then_make(
+            os.path.dirname(self._lock_file())
+        )
 
-        # parse the trigdat
-        trigdat = f"glg_trigdat_all_bn{self.grb_name[3:]}_{self.version}.fit"
+        fd = os.open(self._lock_file(), os.O_RDWR | os.O_CREAT)
 
-        uri = os.path.join(info.uri, trigdat)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
 
-        store_path = os.path.join(base_dir, info.name, "trigdat")
-        dl = BackgroundDownload(
-            uri,
-            store_path,
-            wait_time=float(
-                morgoth_config["download"]["trigdat"][self.version]["interval"]
-            ),
-            max_time=float(
-                morgoth_config["download"]["trigdat"][self.version]["max_time"]
-            ),
+        except BlockingIOError:
+            # another worker started the watcher
+            os.close(fd)
+            return
+
+        # the watcher inherits the locked file, the lock is released when
+        # it stops. A process of its own, so it does not block a luigi worker
+        try:
+            _detach(
+                [
+                    sys.executable,
+                    "-c",
+                    "from morgoth.downloaders import watch_trigdat; "
+                    f"watch_trigdat({self.grb_name!r})",
+                ],
+                pass_fds=(fd,),
+            )
+
+        finally:
+            os.close(fd)
+
+
+class GatherTrigdatDownload(luigi.ExternalTask):
+    """
+    The first trigdat version that is available.
+    Written by the trigdat watcher, that runs the pipeline
+    again when it is there, so no worker waits for it.
+    """
+
+    priority = 50
+    grb_name = luigi.Parameter()
+
+    def output(self):
+        return luigi.LocalTarget(
+            os.path.join(base_dir, self.grb_name, f"gather_trigdat_complete.yml")
         )
-        dl.run()
 
-        # Create the version subfolder when download is done
-        file_utils.if_directory_not_existing_then_make(
-            os.path.join(base_dir, info.name, "trigdat", self.version)
+
+class DownloadTrigdat(luigi.ExternalTask):
+    """
+    A Trigdat file of a given version.
+    Downloaded by the trigdat watcher, that runs the pipeline
+    again when it is there, so no worker waits for it.
+    """
+
+    priority = 100
+    grb_name = luigi.Parameter()
+    version = luigi.Parameter()
+
+    def output(self):
+        trigdat = f"glg_trigdat_all_bn{self.grb_name[3:]}_{self.version}.fit"
+        return luigi.LocalTarget(
+            os.path.join(base_dir, self.grb_name, "trigdat", trigdat)
         )
 
 
@@ -225,34 +401,25 @@ class DownloadTTEResources(luigi.Task):
 
     def run(self):
         base_url = f"https://heasarc.gsfc.nasa.gov/FTP/fermi/data/gbm/triggers/20{self.grb_name.strip('GRB')[:2]}/bn{self.grb_name.strip('GRB')}/current/"
-        found_tte = []
-        found_cspec = []
+
+        urls = []
+        for d in lu:
+            urls.append(
+                base_url + f"glg_tte_{d}_bn{self.grb_name.strip('GRB')}_v00.fit"
+            )
+            urls.append(
+                base_url + f"glg_cspec_{d}_bn{self.grb_name.strip('GRB')}_v00.pha"
+            )
+
         start = time.time()
-        while len(found_tte) < len(lu) and len(found_cspec) <len(lu):
-            found_one = False
-            for d in lu:
-                if d not in found_tte:
-                    url = (
-                        base_url + f"glg_tte_{d}_bn{self.grb_name.strip('GRB')}_v00.fit"
-                    )
-                    try:
-                        urllib.request.urlopen(url)
-                        found_tte.append(d)
-                        found_one = True
-                    except HTTPError:
-                        pass
-                if d not in found_cspec:
-                    url = (
-                        base_url
-                        + f"glg_cspec_{d}_bn{self.grb_name.strip('GRB')}_v00.pha"
-                    )
-                    try:
-                        urllib.request.urlopen(url)
-                        found_cspec.append(d)
-                        found_one = True
-                    except HTTPError:
-                        pass
-            if not found_one:
-                time.sleep(180)
+
+        probe = AvailabilityProbe(
+            urls,
+            min_wait=float(morgoth_config["download"]["probe"]["min_wait"]),
+            max_wait=float(morgoth_config["download"]["probe"]["max_wait"]),
+            max_time=float(morgoth_config["download"]["probe"]["max_time"]),
+        )
+        probe.run()
+
         with self.output().open("w") as f:
             f.write(str(time.time() - start))
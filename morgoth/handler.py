@@ -8,6 +8,24 @@ from morgoth.trigger import parse_trigger_file_and_write
 
 n_workers = int(morgoth_config["luigi"]["n_workers"])
 
+# the optional long lived dispatcher with warm workers
+_dispatcher = None
+
+
+def use_dispatcher(dispatcher):
+    """
+    Route new bursts to a PipelineDispatcher instead
+    of launching a luigi CLI for every notice
+
+    :param dispatcher: a PipelineDispatcher or None to go back to the CLI
+    :returns:
+    :rtype:
+
+    """
+    global _dispatcher
+
+    _dispatcher = dispatcher
+
 
 @gcn.include_notice_types(
     gcn.notice_types.FERMI_GBM_FLT_POS,  # Fermi GBM localization (flight)
@@ -30,6 +48,13 @@ def handler(payload, root):
 
     # form the luigi command
     if most_likely != "SOLAR_FLARE":
+
+        if _dispatcher is not None:
+
+            # the dispatcher queues the burst if it is full
+            _dispatcher.submit(grb)
+            return
+
         cmd = form_morgoth_cmd_string(grb)
 
         # launch luigi
@@ -46,11 +71,12 @@ def handler(payload, root):
     pass
 
 
-def form_morgoth_cmd_string(grb):
+def form_morgoth_cmd_string(grb, background=True):
     """
     makes the command string for luigi
 
     :param grb:
+    :param background: end the command with & for os.system
     :returns:
     :rtype:
 
@@ -60,7 +86,10 @@ def form_morgoth_cmd_string(grb):
 
     cmd = f"{base_cmd} CreateAllPages --grb-name {grb} "
 
-    cmd += f"--workers {n_workers} --scheduler-host localhost --log-level INFO &"
+    cmd += f"--workers {n_workers} --scheduler-host localhost --log-level INFO"
+
+    if background:
+        cmd += " &"
 
     cmd = shlex.split(cmd)
 
@@ -2,7 +2,14 @@ import luigi
 import os
 
 from morgoth.utils.env import get_env_value
-from morgoth.upload import UploadReport, UploadAllPlots, UploadAllDataFiles
+from morgoth.downloaders import WatchTrigdat
+from morgoth.configuration import morgoth_config
+from morgoth.upload import (
+    UploadReport,
+    UploadAllPlots,
+    UploadAllDataFiles,
+    UploadGridReport,
+)
 
 base_dir = get_env_value("GBM_TRIGGER_DATA_DIR")
 
@@ -13,6 +20,7 @@ class CreateAllPages(luigi.WrapperTask):
 
     def requires(self):
         return {
+            "trigdat_watcher": WatchTrigdat(grb_name=self.grb_name),
             "tte_v00": CreateReportTTE(grb_name=self.grb_name),
             "trigdat_v00": CreateReportTrigdat(grb_name=self.grb_name, version="v00"),
             "trigdat_v01": CreateReportTrigdat(grb_name=self.grb_name, version="v01"),
@@ -52,7 +60,7 @@ class CreateReportTrigdat(luigi.Task):
     version = luigi.Parameter(default="v00")
 
     def requires(self):
-        return {
+        requirements = {
             "report": UploadReport(
                 grb_name=self.grb_name, report_type="trigdat", version=self.version
             ),
@@ -64,6 +72,14 @@ class CreateReportTrigdat(luigi.Task):
             ),
         }
 
+        # the early report of the grid scan
+        if morgoth_config["pre_localization"]["enabled"]:
+            requirements["grid_report"] = UploadGridReport(
+                grb_name=self.grb_name, version=self.version
+            )
+
+        return requirements
+
     def output(self):
         filename = f"trigdat_{self.version}_report_done.txt"
         return luigi.LocalTarget(os.path.join(base_dir, self.grb_name, filename))
@@ -1,6 +1,9 @@
 import pytest
 import lxml.etree
 import os
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 os.environ["GBM_TRIGGER_DATA_DIR"] = "./"
 
@@ -8,6 +11,32 @@ from morgoth.utils.package_data import get_path_of_data_file
 from morgoth.trigger import parse_trigger_file_and_write
 
 
+def pytest_addoption(parser):
+
+    parser.addoption(
+        "--benchmark", action="store_true", help="run the benchmark tests"
+    )
+
+
+def pytest_configure(config):
+
+    config.addinivalue_line(
+        "markers", "benchmark: timing comparison, only run with --benchmark"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+
+    if config.getoption("--benchmark"):
+        return
+
+    skip = pytest.mark.skip(reason="benchmark, run with --benchmark")
+
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture(scope="session")
 def payload1():
 
@@ -66,3 +95,49 @@ def grb2(root2, payload2):
     grb = parse_trigger_file_and_write(root2, payload2)
 
     return grb
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # answer open ended range requests (bytes=N-) like HEASARC does
+        range_header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+
+        if range_header is None or not os.path.isfile(path):
+            return super().do_GET()
+
+        start = int(range_header.split("=")[1].split("-")[0])
+        size = os.path.getsize(path)
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture()
+def http_server(tmp_path):
+    """
+    A local HTTP stand-in for the HEASARC server, serving
+    the files in the directory it returns
+    """
+
+    handler = functools.partial(_QuietHandler, directory=str(tmp_path))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}/", tmp_path
+
+    server.shutdown()
+    server.server_close()
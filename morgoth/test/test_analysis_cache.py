@@ -0,0 +1,188 @@
+import os
+
+import astropy.io.fits as fits
+import numpy as np
+import pytest
+from configya.tree import Node
+
+import morgoth.auto_loc.time_selection as time_selection
+import morgoth.utils.analysis_cache as analysis_cache
+from morgoth.auto_loc.time_selection import TimeSelectionBB
+from morgoth.exceptions.custom_exceptions import ImproperlyConfigured
+from morgoth.utils.analysis_cache import AnalysisCache, evict
+from morgoth.utils.trig_reader import TrigReader
+
+
+def _write_trigdat(path, seed=0):
+    # a minimal trigdat file with the columns the TrigReader reads
+    rng = np.random.default_rng(seed)
+
+    trigtime = 5.0e8
+    starts = np.concatenate(
+        [np.arange(-100, -10, 8.192), np.arange(-10, 20, 1.024), np.arange(0, 1, 0.256)]
+    )
+    widths = np.concatenate(
+        [np.full(11, 8.192), np.full(30, 1.024), np.full(4, 0.256)]
+    )
+    n = len(starts)
+
+    columns = fits.ColDefs(
+        [
+            fits.Column(name="TIME", format="D", array=starts + trigtime),
+            fits.Column(name="ENDTIME", format="D", array=starts + widths + trigtime),
+            fits.Column(name="RATE", format="112E", array=rng.uniform(10, 100, (n, 112))),
+            fits.Column(name="SCATTITD", format="4E", array=rng.uniform(-1, 1, (n, 4))),
+            fits.Column(name="EIC", format="3E", array=rng.uniform(-7e6, 7e6, (n, 3))),
+        ]
+    )
+
+    rates = fits.BinTableHDU.from_columns(columns, name="EVNTRATE")
+    rates.header["TRIGTIME"] = trigtime
+
+    primary = fits.PrimaryHDU()
+    primary.header["RA_OBJ"] = 120.0
+    primary.header["DEC_OBJ"] = -30.0
+    primary.header["ERR_RAD"] = 5.0
+
+    fits.HDUList([primary, rates]).writeto(path)
+
+
+def test_key(tmp_path, monkeypatch):
+    cache = AnalysisCache("GRB000000000", data_dir=str(tmp_path))
+
+    f1 = tmp_path / "a.fit"
+    f1.write_bytes(b"abc")
+    f2 = tmp_path / "b.fit"
+    f2.write_bytes(b"abc")
+
+    # only the content of the files counts
+    assert cache.key(str(f1), fine=True) == cache.key(str(f2), fine=True)
+    assert cache.key(str(f1), fine=True) != cache.key(str(f1), fine=False)
+    assert cache.key(x=np.arange(3.0)) != cache.key(x=np.arange(4.0))
+
+    key = cache.key(str(f1), fine=True)
+    monkeypatch.setattr(analysis_cache, "cache_version", 2)
+    assert cache.key(str(f1), fine=True) != key
+
+
+def test_time_selection_params(monkeypatch):
+    params = TimeSelectionBB.cache_params(fine=True)
+
+    assert params["fine"] and params["gamma"] == 0.776
+    assert "n_workers" not in params and "analysis_cache" not in params
+    assert params["config"] == {}
+    assert TimeSelectionBB.cache_params(fine=True, gamma=0.5) != params
+
+    section = Node("time_selection")
+    section.add_child(Node("n_workers", value=1))
+    section.add_child(Node("p0", value=0.05))
+    monkeypatch.setattr(time_selection, "morgoth_config", {"time_selection": section})
+
+    assert TimeSelectionBB.cache_params(fine=True)["config"] == dict(p0=0.05)
+
+
+def test_arrays_and_files(tmp_path):
+    cache = AnalysisCache("GRB000000000", data_dir=str(tmp_path))
+
+    key = cache.key(gamma=0.776)
+
+    assert cache.load_arrays("stage", key) is None
+
+    cache.put_arrays("stage", key, x=np.arange(5), y=np.float64(2.5))
+
+    data = cache.load_arrays("stage", key)
+    np.testing.assert_array_equal(data["x"], np.arange(5))
+    assert float(data["y"]) == 2.5
+
+    f = tmp_path / "bkg.h5"
+    f.write_bytes(b"fit")
+
+    entry = cache.put_files("files", key, {"bkg_det_n0.h5": str(f)})
+
+    assert entry == cache.get("files", key)
+    assert os.path.exists(os.path.join(entry, "bkg_det_n0.h5"))
+
+    # storing the same entry twice keeps the first one
+    assert cache.put_files("files", key, {"bkg_det_n0.h5": str(f)}) == entry
+
+    disabled = AnalysisCache("GRB000000000", data_dir=str(tmp_path), enabled=False)
+    assert disabled.get("files", key) is None
+
+
+def test_evict_across_bursts(tmp_path):
+    for i, grb in enumerate(["GRB000000001", "GRB000000002", "GRB000000003"]):
+        cache = AnalysisCache(grb, data_dir=str(tmp_path), max_size_gb=1)
+        entry = cache.put_arrays("stage", "k", x=np.zeros(1000))
+
+        # oldest burst first
+        os.utime(entry, (1000 + i, 1000 + i))
+
+    size = os.path.getsize(os.path.join(entry, "arrays.npz"))
+
+    deleted = evict(str(tmp_path), 2 * size)
+
+    assert deleted == [str(tmp_path / "GRB000000001" / "cache" / "stage" / "k")]
+    assert os.path.isdir(tmp_path / "GRB000000003" / "cache" / "stage" / "k")
+
+
+def test_evict_on_schedule(tmp_path, monkeypatch):
+    walks = []
+    monkeypatch.setattr(analysis_cache, "evict", lambda *args: walks.append(args))
+    monkeypatch.setattr(analysis_cache, "_last_eviction", {})
+
+    cache = AnalysisCache("GRB000000000", data_dir=str(tmp_path))
+
+    for i in range(3):
+        cache.put_arrays("stage", f"k{i}", x=np.zeros(10))
+
+    # the other caches of the process share the schedule
+    AnalysisCache("GRB000000001", data_dir=str(tmp_path)).put_arrays(
+        "stage", "k", x=np.zeros(10)
+    )
+
+    assert len(walks) == 1
+
+    analysis_cache._last_eviction[str(tmp_path)] -= analysis_cache.eviction_interval
+
+    cache.put_arrays("stage", "k3", x=np.zeros(10))
+
+    assert len(walks) == 2
+
+
+def test_data_dir_has_to_be_set(monkeypatch):
+    monkeypatch.delenv("GBM_TRIGGER_DATA_DIR")
+
+    with pytest.raises(ImproperlyConfigured, match="GBM_TRIGGER_DATA_DIR"):
+        AnalysisCache("GRB000000000")
+
+
+def test_trig_reader_uses_cache(tmp_path, monkeypatch):
+    trigdat_file = str(tmp_path / "glg_trigdat_all_bn000000000_v00.fit")
+    _write_trigdat(trigdat_file)
+
+    cache = AnalysisCache("GRB000000000", data_dir=str(tmp_path))
+
+    reads = []
+    read_trigdat = TrigReader._read_trigdat
+
+    def counting_read(trigdat_file, fine):
+        reads.append(fine)
+        return read_trigdat(trigdat_file, fine)
+
+    monkeypatch.setattr(TrigReader, "_read_trigdat", staticmethod(counting_read))
+
+    readers = [
+        TrigReader(trigdat_file, fine=True, lazy=True, analysis_cache=cache)
+        for _ in range(2)
+    ]
+    uncached = TrigReader(trigdat_file, fine=True, lazy=True)
+
+    # the second reader got the data from the cache
+    assert reads == [True, True]
+
+    for reader in readers:
+        for name in ["_tstart", "_tstop", "_rates", "_qauts", "_sc_pos"]:
+            np.testing.assert_array_equal(getattr(reader, name), getattr(uncached, name))
+
+        assert reader._trigtime == uncached._trigtime
+        assert reader._fsw_ra == uncached._fsw_ra
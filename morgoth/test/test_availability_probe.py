@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from morgoth.utils.availability_probe import AvailabilityProbe
+
+
+def test_probe_finds_all_files(http_server):
+
+    url, directory = http_server
+
+    names = [f"glg_tte_n{i}_bn230514996_v00.fit" for i in range(10)]
+
+    for name in names[:5]:
+        (directory / name).write_bytes(b"tte")
+
+    def late_files():
+        time.sleep(0.5)
+        for name in names[5:]:
+            (directory / name).write_bytes(b"tte")
+
+    thread = threading.Thread(target=late_files)
+    thread.start()
+
+    probe = AvailabilityProbe(
+        [url + name for name in names], min_wait=0.1, max_wait=0.2, max_time=10
+    )
+
+    found = probe.run()
+
+    thread.join()
+
+    assert len(found) == len(names)
+    assert len(probe.missing) == 0
+    assert probe.n_sweeps > 1
+
+    for name in names[:5]:
+        assert found[url + name] < 0.5
+
+
+def test_probe_gives_up(http_server):
+
+    url, directory = http_server
+
+    probe = AvailabilityProbe(
+        [url + "glg_cspec_n0_bn230514996_v00.pha"],
+        min_wait=0.1,
+        max_wait=0.1,
+        max_time=0.5,
+    )
+
+    with pytest.raises(AssertionError):
+        probe.run()
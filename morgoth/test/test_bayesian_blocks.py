@@ -0,0 +1,100 @@
+import time
+import warnings
+
+import numpy as np
+import pytest
+from astropy.stats import bayesian_blocks as astropy_bayesian_blocks
+
+from morgoth.auto_loc.utils.bayesian_blocks import BayesianBlocks, bayesian_blocks
+
+
+def _astropy_edges(times, cps, gamma):
+    # astropy warns about the log of the empty blocks
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return astropy_bayesian_blocks(times, cps, fitness="events", gamma=gamma)
+
+
+def _trigdat_lightcurve(seed):
+    rng = np.random.default_rng(seed)
+
+    times = np.concatenate(
+        [
+            np.arange(-400, -20, 8.192),
+            np.arange(-20, 120, 1.024),
+            np.arange(120, 600, 8.192),
+        ]
+    )
+    cps = rng.poisson(rng.uniform(50, 2000), size=len(times)).astype(float)
+    burst = (times > 0) & (times < rng.uniform(5, 60))
+    cps[burst] += rng.integers(100, 3000)
+
+    # bins without data
+    if seed % 3 == 0:
+        cps[rng.integers(0, len(times), 3)] = 0
+
+    # the additional block with count rate zero added in the time selection
+    cps[-1] = 0
+
+    return times, cps
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("gamma", [0.776, 0.1, 0.9, 1e-3])
+def test_matches_astropy(seed, gamma):
+    times, cps = _trigdat_lightcurve(seed)
+
+    np.testing.assert_array_equal(
+        bayesian_blocks(times, cps, gamma=gamma), _astropy_edges(times, cps, gamma)
+    )
+
+
+def test_special_light_curves():
+    times = np.arange(100.0)
+
+    engine = BayesianBlocks(times, gamma=0.776)
+
+    for cps in [
+        np.zeros(100),
+        np.full(100, 500.0),
+        np.where(times < 50, 10.0, 0.0),
+        np.where((times > 20) & (times < 30), 5000.0, 100.0),
+        np.arange(100.0) ** 2,
+    ]:
+        np.testing.assert_array_equal(engine.fit(cps), _astropy_edges(times, cps, 0.776))
+
+    # the unpruned path used for negative values
+    cps = np.random.default_rng(1).integers(-5, 100, 100)
+    np.testing.assert_array_equal(engine.fit(cps), _astropy_edges(times, cps, 0.776))
+
+
+def test_invalid_input():
+    with pytest.raises(ValueError):
+        BayesianBlocks([0.0, 1.0, 1.0, 2.0])
+
+    with pytest.raises(ValueError):
+        BayesianBlocks([0.0, 1.0, 2.0]).fit([1.5, 2.0, 3.0])
+
+
+@pytest.mark.benchmark
+def test_benchmark():
+    times, cps = _trigdat_lightcurve(1)
+
+    n_dets = 15
+
+    t0 = time.perf_counter()
+    for _ in range(n_dets):
+        expected = _astropy_edges(times, cps, 0.776)
+    t_astropy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    engine = BayesianBlocks(times, gamma=0.776)
+    for _ in range(n_dets):
+        edges = engine.fit(cps)
+    t_engine = time.perf_counter() - t0
+
+    print(
+        f"{n_dets} detectors: astropy {t_astropy * 1e3:.1f} ms, pruned {t_engine * 1e3:.1f} ms"
+    )
+
+    np.testing.assert_array_equal(edges, expected)
@@ -0,0 +1,260 @@
+from types import SimpleNamespace
+
+import h5py
+import numpy as np
+import yaml
+
+import morgoth.auto_loc.bkg_fit as bkg_fit
+from morgoth.auto_loc.bkg_fit import BkgFittingTTE, _gbm_detectors
+from morgoth.utils.tte_reader import align_window
+
+
+_calls = []
+
+
+def _fake_tte_time_series(
+    det,
+    tte_file,
+    cspec_file,
+    trigdat_file,
+    poly_order,
+    background_times,
+    active_time,
+    window=None,
+):
+    # events of a constant background and a burst, without tte file and response
+    from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
+    from threeML.utils.OGIP.response import InstrumentResponse
+    from threeML.utils.time_series.event_list import EventListWithDeadTime
+
+    rng = np.random.default_rng(_gbm_detectors.index(det))
+    ebounds = np.geomspace(10, 1000, 9)
+
+    background = rng.uniform(-200, 300, 20000)
+    burst = rng.uniform(0, 5, 2000)
+    arrival_times = np.sort(np.concatenate([background, burst]))
+    measurement = rng.integers(0, 8, len(arrival_times))
+
+    start, stop = -200, 300
+
+    # cut the window like the TTEReader
+    if window is not None:
+        start, stop = align_window(*window, start, stop, grid=1.0)
+        first, last = np.searchsorted(arrival_times, [start, stop])
+        arrival_times = arrival_times[first:last]
+        measurement = measurement[first:last]
+
+    _calls.append(dict(det=det, window=window, poly_order=poly_order))
+
+    event_list = EventListWithDeadTime(
+        arrival_times=arrival_times,
+        measurement=measurement,
+        n_channels=8,
+        start_time=start,
+        stop_time=stop,
+        dead_time=np.zeros(len(arrival_times)),
+        first_channel=0,
+        verbose=False,
+    )
+
+    ts = TimeSeriesBuilder(
+        det,
+        event_list,
+        poly_order=poly_order,
+        unbinned=False,
+        verbose=False,
+        response=InstrumentResponse(np.eye(8), ebounds, ebounds),
+    )
+
+    ts.set_background_interval(*background_times)
+    ts.set_active_time_interval(active_time)
+
+    return ts, dict(response=0.0, events=0.0, background_fit=0.0)
+
+
+def _fit(
+    tmp_path,
+    n_workers,
+    poly_order=1,
+    bkg_fitting_file_path="bkg_fit_trigdat.yml",
+    warm_start=None,
+):
+    time_selection = tmp_path / "time_selection.yml"
+
+    with open(time_selection, "w") as f:
+        yaml.dump(
+            dict(
+                active_time=dict(start=0.0, stop=5.0),
+                background_time=dict(
+                    before=dict(start=-150.0, stop=-20.0),
+                    after=dict(start=50.0, stop=250.0),
+                ),
+                poly_order=poly_order,
+                max_time=200.0,
+            ),
+            f,
+        )
+
+    files = lambda kind: [
+        SimpleNamespace(path=f"/data/glg_{kind}_{det}_bn000000000_v00.pha")
+        for det in _gbm_detectors
+    ]
+
+    fit = BkgFittingTTE(
+        "GRB000000000",
+        "v00",
+        trigdat_file="trigdat.fit",
+        tte_files=files("tte"),
+        cspec_files=files("cspec"),
+        time_selection_file_path=str(time_selection),
+        bkg_fitting_file_path=bkg_fitting_file_path,
+        n_workers=n_workers,
+        warm_start=warm_start,
+    )
+
+    out = tmp_path / f"bkg_files_{n_workers}"
+    fit.save_bkg_file(str(out))
+
+    return fit, out
+
+
+def test_parallel_bkg_fit_matches_serial(tmp_path, monkeypatch):
+    monkeypatch.setattr(bkg_fit, "_tte_time_series", _fake_tte_time_series)
+
+    serial, serial_out = _fit(tmp_path, n_workers=1)
+    parallel, parallel_out = _fit(tmp_path, n_workers=4)
+
+    assert set(parallel.timings) == set(_gbm_detectors)
+
+    for det in _gbm_detectors:
+        with h5py.File(serial_out / f"bkg_det_{det}.h5", "r") as s, h5py.File(
+            parallel_out / f"bkg_det_{det}.h5", "r"
+        ) as p:
+            np.testing.assert_array_equal(s["coefficients"][()], p["coefficients"][()])
+            np.testing.assert_array_equal(s["covariance"][()], p["covariance"][()])
+
+    # the lightcurves of the workers are written without reading the events again
+    _calls.clear()
+    parallel.save_lightcurves(str(tmp_path / "lightcurves"))
+
+    assert _calls == []
+
+    for det in _gbm_detectors:
+        with open(parallel._lightcurve_plots[det], "rb") as f:
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+
+def test_window_does_not_change_the_fit(tmp_path, monkeypatch):
+    monkeypatch.setattr(bkg_fit, "_tte_time_series", _fake_tte_time_series)
+
+    _calls.clear()
+    windowed, windowed_out = _fit(tmp_path, n_workers=1)
+
+    # from the start of the lightcurves to the end of the background
+    assert _calls[0]["window"] == (-150.0, 250.0)
+
+    def full_time_series(*args, window=None, **kwargs):
+        return _fake_tte_time_series(*args, window=None, **kwargs)
+
+    monkeypatch.setattr(bkg_fit, "_tte_time_series", full_time_series)
+
+    full, _ = _fit(tmp_path, n_workers=1)
+
+    for ts, full_ts in zip(windowed._ts, full._ts):
+        assert ts.time_series.n_events < full_ts.time_series.n_events
+
+        for poly, full_poly in zip(
+            ts.time_series.polynomials, full_ts.time_series.polynomials
+        ):
+            np.testing.assert_allclose(
+                poly.coefficients, full_poly.coefficients, rtol=1e-10
+            )
+
+
+def test_warm_start_uses_trigdat_orders(tmp_path, monkeypatch):
+    monkeypatch.setattr(bkg_fit, "_tte_time_series", _fake_tte_time_series)
+
+    # trigdat fits of all dets but b1
+    bkg_files = {}
+    for i, det in enumerate(_gbm_detectors[:-1]):
+        bkg_files[det] = str(tmp_path / f"bkg_det_{det}.h5")
+        with h5py.File(bkg_files[det], "w") as store:
+            store.attrs["poly_order"] = i % 3
+
+    bkg_fit_yml = tmp_path / "bkg_fit_trigdat.yml"
+    with open(bkg_fit_yml, "w") as f:
+        yaml.dump(dict(bkg_fit_files=bkg_files, use_dets=[0, 1, 2]), f)
+
+    # without the warm start the order is searched again
+    _calls.clear()
+    _fit(
+        tmp_path,
+        n_workers=1,
+        poly_order=-1,
+        bkg_fitting_file_path=str(bkg_fit_yml),
+        warm_start=False,
+    )
+
+    assert all(call["poly_order"] == -1 for call in _calls)
+
+    _calls.clear()
+    fit, _ = _fit(
+        tmp_path,
+        n_workers=1,
+        poly_order=-1,
+        bkg_fitting_file_path=str(bkg_fit_yml),
+        warm_start=True,
+    )
+
+    orders = {call["det"]: call["poly_order"] for call in _calls}
+
+    assert orders == dict(
+        {det: i % 3 for i, det in enumerate(_gbm_detectors[:-1])}, b1=-1
+    )
+
+    for det, ts in zip(_gbm_detectors[:-1], fit._ts):
+        assert ts.time_series.poly_order == orders[det]
+
+
+def test_tte_file_is_closed(monkeypatch):
+    # the time series of the bundled tte file, with a cheap response
+    import os
+
+    import gbm_drm_gen
+    from threeML.utils.OGIP.response import InstrumentResponse
+
+    data_dir = os.path.join(
+        os.path.dirname(gbm_drm_gen.__file__), "data", "example_data"
+    )
+    tte_file = os.path.join(data_dir, "glg_tte_n6_bn110721200_v00.fit")
+
+    ebounds = np.geomspace(10, 1000, 129)
+    monkeypatch.setattr(bkg_fit.drm, "DRMGenTTE", lambda **kwargs: None)
+    monkeypatch.setattr(
+        bkg_fit,
+        "BALROG_DRM",
+        lambda *args: InstrumentResponse(np.eye(128), ebounds, ebounds),
+    )
+
+    ts, _ = bkg_fit._tte_time_series(
+        "n6",
+        tte_file,
+        None,
+        None,
+        1,
+        ["-20--5", "50-100"],
+        "0-10",
+        window=(-30, 120),
+    )
+
+    assert ts.time_series.poly_fit_exists
+
+    # no open file and no memory map of the tte file is left
+    fds = [
+        os.path.realpath(f"/proc/self/fd/{fd}") for fd in os.listdir("/proc/self/fd")
+    ]
+    with open("/proc/self/maps") as f:
+        maps = f.read()
+
+    assert os.path.realpath(tte_file) not in fds
+    assert os.path.realpath(tte_file) not in maps
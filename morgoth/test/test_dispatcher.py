@@ -0,0 +1,74 @@
+import time
+
+from morgoth.dispatcher import PipelineDispatcher
+
+
+def _build(grb, n_workers):
+    # a stand-in for the luigi pipeline of a burst
+    time.sleep(0.5)
+
+    if grb == "GRB_RAISES":
+        raise RuntimeError("broken pipeline")
+
+    return grb != "GRB_FAILS"
+
+
+def _wait_until_finished(dispatcher, n, timeout=30):
+    start = time.time()
+
+    while len(dispatcher.stats()["finished"]) < n:
+        assert time.time() - start < timeout
+        time.sleep(0.05)
+
+
+def test_dispatcher_caps_and_queues_bursts():
+    dispatcher = PipelineDispatcher(max_bursts=2, n_workers=1, build_function=_build)
+
+    try:
+        start = time.time()
+
+        futures = [dispatcher.submit(grb) for grb in ["GRB1", "GRB2", "GRB3", "GRB4"]]
+
+        # only max_bursts are admitted, the others wait in order
+        assert [f is not None for f in futures] == [True, True, False, False]
+        assert dispatcher.n_active == 2
+        assert dispatcher.queued_bursts == ["GRB3", "GRB4"]
+
+        # a burst is only admitted once
+        assert dispatcher.submit("GRB1") is None
+        assert dispatcher.submit("GRB3") is None
+        assert dispatcher.queued_bursts == ["GRB3", "GRB4"]
+
+        stats = dispatcher.stats()
+        assert stats["max_bursts"] == 2
+        assert set(stats["active"]) == {"GRB1", "GRB2"}
+        assert list(stats["queued"]) == ["GRB3", "GRB4"]
+
+        _wait_until_finished(dispatcher, 4)
+
+        stats = dispatcher.stats()
+        assert stats["active"] == {} and stats["queued"] == {}
+        assert all(run["success"] for run in stats["finished"].values())
+
+        # the queued bursts only started when a running burst was finished
+        assert time.time() - start >= 1.0
+
+    finally:
+        dispatcher.shutdown()
+
+
+def test_dispatcher_records_failed_bursts():
+    dispatcher = PipelineDispatcher(max_bursts=2, n_workers=1, build_function=_build)
+
+    try:
+        dispatcher.submit("GRB_FAILS")
+        dispatcher.submit("GRB_RAISES")
+
+        _wait_until_finished(dispatcher, 2)
+
+        finished = dispatcher.stats()["finished"]
+        assert not finished["GRB_FAILS"]["success"]
+        assert not finished["GRB_RAISES"]["success"]
+
+    finally:
+        dispatcher.shutdown()
@@ -0,0 +1,97 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+from morgoth.utils.download_file import (
+    BackgroundDownload,
+    ChecksumError,
+    download_file,
+)
+
+
+def test_download_is_atomic(http_server, tmp_path_factory):
+
+    url, directory = http_server
+    store_path = tmp_path_factory.mktemp("store")
+
+    content = bytes(range(256)) * 1000
+    (directory / "glg_tte_n0_bn230514996_v00.fit").write_bytes(content)
+
+    path = download_file(
+        url + "glg_tte_n0_bn230514996_v00.fit",
+        str(store_path),
+        chunk_size=1000,
+        checksum=hashlib.sha256(content).hexdigest(),
+    )
+
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+    assert list(store_path.glob("*.part")) == []
+
+
+def test_download_resumes(http_server, tmp_path_factory):
+
+    url, directory = http_server
+    store_path = tmp_path_factory.mktemp("store")
+
+    (directory / "glg_tte_n1_bn230514996_v00.fit").write_bytes(b"a" * 100 + b"b" * 100)
+
+    # an interrupted earlier attempt; only the missing part is requested
+    (store_path / "glg_tte_n1_bn230514996_v00.fit.part").write_bytes(b"x" * 100)
+
+    path = download_file(url + "glg_tte_n1_bn230514996_v00.fit", str(store_path))
+
+    with open(path, "rb") as f:
+        assert f.read() == b"x" * 100 + b"b" * 100
+
+
+def test_download_checksum_mismatch(http_server, tmp_path_factory):
+
+    url, directory = http_server
+    store_path = tmp_path_factory.mktemp("store")
+
+    (directory / "glg_cspec_n0_bn230514996_v00.pha").write_bytes(b"cspec")
+
+    with pytest.raises(ChecksumError):
+        download_file(
+            url + "glg_cspec_n0_bn230514996_v00.pha", str(store_path), checksum="0"
+        )
+
+    assert list(store_path.iterdir()) == []
+
+
+def test_background_download_waits_for_file(http_server, tmp_path_factory):
+
+    url, directory = http_server
+    store_path = tmp_path_factory.mktemp("store")
+
+    def late_file():
+        time.sleep(0.5)
+        (directory / "glg_trigdat_all_bn230514996_v00.fit").write_bytes(b"trigdat")
+
+    thread = threading.Thread(target=late_file)
+    thread.start()
+
+    dl = BackgroundDownload(
+        url + "glg_trigdat_all_bn230514996_v00.fit",
+        str(store_path),
+        wait_time=0.1,
+        max_time=10,
+    )
+    path = dl.run()
+
+    thread.join()
+
+    with open(path, "rb") as f:
+        assert f.read() == b"trigdat"
+
+    with pytest.raises(AssertionError):
+        BackgroundDownload(
+            url + "glg_trigdat_all_bn230514996_v01.fit",
+            str(store_path),
+            wait_time=0.1,
+            max_time=0.3,
+        ).run()
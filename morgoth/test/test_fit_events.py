@@ -0,0 +1,88 @@
+import numpy as np
+
+from morgoth.utils.fit_events import (
+    FitInstrumentation,
+    read_events,
+    status_message,
+    write_prometheus,
+)
+from morgoth.utils.multinest_chains import ChainProgressMonitor
+
+
+class _FakeSampler(object):
+    def _log_like(self, trial_values):
+        return -0.5 * np.sum(trial_values**2)
+
+
+def test_instrumentation(tmp_path):
+    events_file = str(tmp_path / "trigdat" / "v00" / "trigdat_v00_fit_events.jsonl")
+    run_info = dict(grb="GRB000000000", report_type="trigdat", version="v00")
+
+    ranks = [
+        FitInstrumentation(events_file, run_info, rank=rank, interval=0)
+        for rank in [0, 1]
+    ]
+
+    samplers = [_FakeSampler(), _FakeSampler()]
+
+    for instrumentation, sampler in zip(ranks, samplers):
+        instrumentation.attach(sampler)
+
+    # rank 1 evaluates the likelihood first
+    for _ in range(30):
+        assert samplers[1]._log_like(np.ones(2)) == -1.0
+
+    live_points = np.column_stack([np.zeros((100, 2)), np.linspace(-20, -10, 100)])
+    ranks[0].dump_callback(
+        400, 100, 2, live_points, None, None, -10.0, -15.0, -15.0, 0.1, None
+    )
+
+    for _ in range(10):
+        samplers[0]._log_like(np.ones(2))
+
+    for instrumentation in ranks[::-1]:
+        instrumentation.finish()
+
+    events = read_events(events_file)
+
+    assert [e["event"] for e in events[:2]] == ["start", "progress"]
+    assert events[-1]["event"] == "end"
+    assert events[-1]["grb"] == "GRB000000000"
+
+    # the counts of all ranks
+    assert events[-1]["rank_n_like"] == {"0": 10, "1": 30}
+    assert events[-1]["n_like"] == 40
+    assert events[-1]["efficiency"] == 10.0
+    np.testing.assert_allclose(
+        events[-1]["delta_log_z"], np.logaddexp(-15.0, -10.0 - 4.0) + 15.0
+    )
+
+    assert "40 likelihood evaluations" in status_message(events[-1])
+
+    prom_file = str(tmp_path / "run.prom")
+    write_prometheus(events[-1], prom_file)
+
+    with open(prom_file) as f:
+        metrics = f.read()
+
+    labels = 'grb="GRB000000000",report_type="trigdat",version="v00"'
+    assert f"morgoth_multinest_likelihood_evaluations{{{labels}}} 40" in metrics
+    assert (
+        f'morgoth_multinest_rank_likelihood_evaluations{{{labels},rank="1"}} 30'
+        in metrics
+    )
+
+    # the monitor of the luigi task reports the last event
+    messages = []
+
+    with ChainProgressMonitor(
+        str(tmp_path / "c_trig_v00" / "trigdat_v00_"),
+        messages.append,
+        interval=10,
+        events_file=events_file,
+        prom_file=str(tmp_path / "monitor.prom"),
+    ):
+        pass
+
+    assert messages == [status_message(events[-1])]
+    assert (tmp_path / "monitor.prom").exists()
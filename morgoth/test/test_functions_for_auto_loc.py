@@ -0,0 +1,293 @@
+import time
+
+import numpy as np
+import pytest
+
+from morgoth.auto_loc.utils.functions_for_auto_loc import time_with_less_sigma
+from morgoth.utils.intervals import drop_short_runs, merge_intervals, runs
+
+
+# the list based implementation time_with_less_sigma used before
+def _legacy_time_with_less_sigma(residuals, tstart, tstop, sigma_lim):
+    j = 0
+    time_intervals_all = []
+    tstart_save = tstart
+    tstop_save = tstop
+    while j < len(residuals):
+        tstart = tstart_save
+        tstop = tstop_save
+        i = 0
+        # get the indices of the bins that are above the threshold
+        index_del = []
+        while i < len(residuals[j]):
+            if residuals[j][i] > sigma_lim:
+                index_del.append(i)
+            i += 1
+        # get the indices of single bins that are above threshold => leave them out later on
+
+        i = 0
+        while i < len(index_del):
+            if i == 0 and len(index_del) > 1:
+                if index_del[i + 1] != index_del[i] + 1:
+                    del index_del[i]
+                else:
+                    i += 1
+            elif i == len(index_del) - 1 and len(index_del) > 1:
+                if index_del[i - 1] != index_del[i] - 1:
+                    del index_del[i]
+                else:
+                    i += 1
+            elif len(index_del) > 2:
+                if (
+                    index_del[i - 1] != index_del[i] - 1
+                    and index_del[i + 1] != index_del[i] + 1
+                ):
+                    del index_del[i]
+                else:
+                    i += 1
+            else:
+                i += 1
+        if len(index_del) == 1:
+            index_del = []
+
+        tstart = tstart.tolist()
+        tstop = tstop.tolist()
+        # fill the missing time
+        i = 0
+        tstartadd = []
+        tstopadd = []
+        while i < len(tstart) - 1:
+            if tstart[i + 1] > tstop[i] + 0.1:
+                tstartadd.append(tstop[i])
+                tstopadd.append(tstart[i + 1])
+            i += 1
+        # delete the bins that are above the threshold
+        sub = 0
+        for i in index_del:
+            del tstart[i - sub]
+            del tstop[i - sub]
+            sub += 1
+        tstart = sorted(tstart + tstartadd)
+        tstop = sorted(tstop + tstopadd)
+        time_bins = np.vstack((tstart, tstop)).T
+        time_bins = time_bins.tolist()
+        # delete time_bins outside of -150-150
+        i = 0
+        while i < len(time_bins):
+            if time_bins[i][0] < -150 or time_bins[i][0] > 150:
+                del time_bins[i]
+            else:
+                i += 1
+        # merge time_bins that are less than 0.2 sec seperated
+        i = 0
+        while i < len(time_bins) - 1:
+            if len(time_bins) == 1:
+                not_whole_time = False
+                break
+            if time_bins[i + 1][0] - time_bins[i][1] < 0.2:
+                time_bins[i] = [time_bins[i][0], time_bins[i + 1][1]]
+                del time_bins[i + 1]
+            else:
+                i += 1
+        # delete time selections that are shorter than 2 seconds
+        i = 0
+        while i < len(time_bins):
+            if time_bins[i][1] - time_bins[i][0] < 2:
+                del time_bins[i]
+            else:
+                i += 1
+
+        # only use the result when it is not one time section from the beginning to the end
+        if len(time_bins) > 1:
+            time_intervals_all.append(time_bins)
+        j += 1
+
+    return time_intervals_all
+
+
+def _fake_residuals(seed, n_det=14):
+    """
+    Trigdat like bins with a data gap and residuals with a burst,
+    some single bins and some nan values
+    """
+    rng = np.random.default_rng(seed)
+
+    tstart = np.concatenate(
+        [
+            np.arange(-400, -20, 8.192),
+            np.arange(-20, 40, 1.024),
+            np.arange(41, 120, 1.024),
+            np.arange(120.3, 700, 8.192),
+        ]
+    )
+    tstop = np.append(tstart[1:], tstart[-1] + 8.192)
+    # a data gap
+    tstop[-20] -= 3
+
+    residuals = rng.normal(0, 1.5, size=(n_det, len(tstart)))
+    burst = (tstart > rng.uniform(-5, 5)) & (tstart < rng.uniform(10, 60))
+    residuals[:, burst] += rng.uniform(0, 10, size=(n_det, 1))
+    residuals[rng.uniform(size=residuals.shape) < 0.01] = np.nan
+
+    return residuals, tstart, tstop
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("sigma_lim", [1, 2, 3, 5])
+def test_time_with_less_sigma_matches_legacy(seed, sigma_lim):
+
+    residuals, tstart, tstop = _fake_residuals(seed)
+
+    legacy = _legacy_time_with_less_sigma(list(residuals), tstart, tstop, sigma_lim)
+    new = time_with_less_sigma(residuals, tstart, tstop, sigma_lim)
+
+    assert new == legacy
+
+
+def test_interval_algebra():
+
+    mask = np.array([1, 0, 1, 1, 0, 1, 1, 1, 0, 1], dtype=bool)
+
+    starts, lengths = runs(mask)
+
+    np.testing.assert_array_equal(starts, [0, 2, 5, 9])
+    np.testing.assert_array_equal(lengths, [1, 2, 3, 1])
+    np.testing.assert_array_equal(
+        drop_short_runs(mask, 2), [0, 0, 1, 1, 0, 1, 1, 1, 0, 0]
+    )
+
+    starts, stops = merge_intervals(
+        np.array([0.0, 1.1, 5.0, 10.0]), np.array([1.0, 4.0, 9.0, 12.0]), 0.2
+    )
+
+    np.testing.assert_array_equal(starts, [0.0, 5.0, 10.0])
+    np.testing.assert_array_equal(stops, [4.0, 9.0, 12.0])
+
+
+def test_time_with_less_sigma_benchmark():
+
+    residuals, tstart, tstop = _fake_residuals(0)
+
+    t0 = time.perf_counter()
+    for sigma_lim in range(1, 8):
+        legacy = _legacy_time_with_less_sigma(list(residuals), tstart, tstop, sigma_lim)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for sigma_lim in range(1, 8):
+        new = time_with_less_sigma(residuals, tstart, tstop, sigma_lim)
+    t_new = time.perf_counter() - t0
+
+    print(f"7 sigma levels: legacy {t_legacy * 1e3:.1f} ms, arrays {t_new * 1e3:.1f} ms")
+
+    assert new == legacy
+
+
+def _fake_lightcurve(seed):
+    rng = np.random.default_rng(seed)
+
+    times = np.concatenate(
+        [np.arange(-400, -20, 8.192), np.arange(-20, 120, 1.024), np.arange(120, 600, 8.192)]
+    )
+    cps = rng.poisson(1000, size=len(times)).astype(float)
+    burst = (times > 0) & (times < rng.uniform(5, 60))
+    cps[burst] += rng.uniform(100, 3000)
+    cps[-1] = 0
+
+    return times.tolist(), list(map(int, cps))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bb_binner_matches_loop(seed):
+    from astropy.stats import bayesian_blocks
+
+    from morgoth.auto_loc.utils.functions_for_auto_loc import (
+        _bb_binner_loop,
+        bb_binner,
+    )
+
+    times, cps = _fake_lightcurve(seed)
+
+    rng = np.random.default_rng(seed)
+    mid = 0.5 * (np.array(times[1:]) + np.array(times[:-1]))
+    random_edges = np.concatenate(
+        ([times[0]], np.sort(rng.choice(mid, 20, replace=False)), [times[-1]])
+    )
+
+    for edges in [
+        bayesian_blocks(times, cps, fitness="events", gamma=0.776),
+        random_edges,
+    ]:
+        bb_t, bb_x, bb_w = bb_binner(times, cps, edges)
+        loop_t, loop_x, loop_w = _bb_binner_loop(times, cps, edges)
+
+        np.testing.assert_array_equal(bb_t, loop_t)
+        np.testing.assert_array_equal(bb_w, loop_w)
+        np.testing.assert_allclose(bb_x, loop_x, rtol=1e-12)
+
+
+def _legacy_start_stop_to_obs_times(times, start_trigger, end_trigger):
+    start_trigger_id = 0
+    end_trigger_id = len(times) - 1
+    for i, t in enumerate(times):
+        if t < start_trigger and i > start_trigger_id:
+            start_trigger_id = i
+        elif t > end_trigger and i < end_trigger_id:
+            end_trigger_id = i
+    start_trigger_id += 1
+    end_trigger_id -= 1
+
+    return start_trigger_id, end_trigger_id
+
+
+def test_start_stop_to_obs_times():
+    from morgoth.auto_loc.time_selection import TimeSelectionBB
+
+    times, _ = _fake_lightcurve(0)
+
+    ts = TimeSelectionBB.__new__(TimeSelectionBB)
+    ts._times = times
+    ts._times_array = np.array(times)
+
+    bounds = [-1000, -400, -150, -30, -10, -8.192, 0, 0.5, 1.024, 30, 70, 600, 1000]
+    bounds += times[::7]
+
+    for start in bounds:
+        for stop in bounds:
+            assert ts.startStopToObsTimes(start, stop) == _legacy_start_stop_to_obs_times(
+                times, start, stop
+            )
+
+
+def test_bb_binner_benchmark():
+    from astropy.stats import bayesian_blocks
+
+    from morgoth.auto_loc.utils.functions_for_auto_loc import (
+        _bb_binner_loop,
+        bb_binner,
+    )
+
+    times, cps = _fake_lightcurve(0)
+    edges = bayesian_blocks(times, cps, fitness="events", gamma=0.776)
+
+    t0 = time.perf_counter()
+    for _ in range(15):
+        _bb_binner_loop(times, cps, edges)
+        for _ in range(20):
+            _legacy_start_stop_to_obs_times(times, -10, 50)
+    t_legacy = time.perf_counter() - t0
+
+    from morgoth.auto_loc.time_selection import TimeSelectionBB
+
+    ts = TimeSelectionBB.__new__(TimeSelectionBB)
+    ts._times = times
+    ts._times_array = np.array(times)
+
+    t0 = time.perf_counter()
+    for _ in range(15):
+        bb_binner(times, cps, edges)
+        for _ in range(20):
+            ts.startStopToObsTimes(-10, 50)
+    t_new = time.perf_counter() - t0
+
+    print(f"15 detectors: legacy {t_legacy * 1e3:.1f} ms, vectorized {t_new * 1e3:.1f} ms")
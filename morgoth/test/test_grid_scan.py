@@ -0,0 +1,218 @@
+import os
+import time
+
+import gbm_drm_gen
+import healpy as hp
+import numpy as np
+import pytest
+from astromodels import (
+    Cutoff_powerlaw,
+    Log_uniform_prior,
+    Model,
+    PointSource,
+    Powerlaw,
+    Uniform_prior,
+)
+from gbm_drm_gen.drmgen import DRMGen
+from gbm_drm_gen.input_edges import trigdat_edges, trigdat_out_edge
+from gbm_drm_gen.io.balrog_drm import BALROG_DRM
+from gbm_drm_gen.io.balrog_like import BALROGLike
+from gbmgeometry import PositionInterpolator
+from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
+
+import morgoth.auto_loc.utils.grid_scan as grid_scan_module
+from morgoth.auto_loc.utils.grid_scan import GridScan, grid_localization, prior_box
+from morgoth.auto_loc.utils.joint_balrog import JointBALROG
+from morgoth.configuration import morgoth_config
+
+
+class _FakeResponse(object):
+    location = None
+
+
+class _FakePlugin(object):
+    # likelihood of a source at ra=100, dec=20 with K=10 and index=-1
+    def __init__(self):
+        self.response = _FakeResponse()
+        self._source = hp.ang2vec(100.0, 20.0, lonlat=True)
+
+    def set_model(self, model):
+        self._shape = model.point_sources["GRB_cpl_"].spectrum.main.shape
+
+    def get_log_like(self, flux_scale=1.0):
+        cos_sep = np.clip(self.response.location.dot(self._source), -1, 1)
+        sep = np.rad2deg(np.arccos(cos_sep))
+
+        return (
+            -0.5 * (sep / 5.0) ** 2
+            - 50 * (np.log10(flux_scale * self._shape.K.value) - 1) ** 2
+            - 50 * (self._shape.index.value + 1) ** 2
+        )
+
+
+class _FakeJoint(object):
+    # the matrices of a position are its direction
+    def __init__(self, plugins, n_threads=1):
+        self._plugins = plugins
+        self.batches = []
+
+    def build(self, ra, dec):
+        self.batches.append(len(ra))
+        return list(hp.ang2vec(ra, dec, lonlat=True))
+
+    def set_matrices(self, ra, dec, matrices):
+        for plugin in self._plugins:
+            plugin.response.location = matrices
+
+    def set_location(self, ra, dec):
+        self.set_matrices(ra, dec, self.build([ra], [dec])[0])
+
+    def get_log_like(self, flux_scale=1.0):
+        return sum(plugin.get_log_like(flux_scale) for plugin in self._plugins)
+
+
+def _model():
+    cpl = Cutoff_powerlaw()
+    cpl.K.max_value = 10**4
+    cpl.K.prior = Log_uniform_prior(lower_bound=1e-3, upper_bound=10**4)
+    cpl.xc.prior = Log_uniform_prior(lower_bound=1, upper_bound=1e4)
+    cpl.index.set_uninformative_prior(Uniform_prior)
+
+    return Model(PointSource("GRB_cpl_", 0.0, 0.0, spectral_shape=cpl))
+
+
+def test_grid_scan(monkeypatch):
+    monkeypatch.setattr(grid_scan_module, "JointBALROG", _FakeJoint)
+
+    nside = 4
+    model = _model()
+
+    grid_scan = GridScan(
+        [_FakePlugin(), _FakePlugin()], model, nside=nside, batch_size=50, max_iter=30
+    )
+
+    assert grid_scan.param_names == ["K", "index", "xc"]
+
+    log_like, best_params = grid_scan.scan()
+
+    # the responses are built in batches
+    assert grid_scan._joint.batches == [50, 50, 50, 42]
+
+    # every pixel starts from the same spectrum, with a capped number of
+    # likelihood evaluations
+    np.testing.assert_allclose(best_params[:, 0], 10.0, rtol=1e-3)
+    np.testing.assert_allclose(best_params[:, 1], -1.0, atol=1e-3)
+    assert grid_scan.n_evaluations < 30 * grid_scan.n_pixels
+
+    # the pixels of the ranks give the same result
+    pixels = np.array_split(np.arange(grid_scan.n_pixels), 3)
+    parts = [grid_scan.scan(p)[0] for p in pixels]
+    np.testing.assert_allclose(np.concatenate(parts), log_like, rtol=1e-6)
+
+    result = grid_localization(nside, log_like)
+
+    assert hp.ang2pix(nside, result["ra"], result["dec"], lonlat=True) == hp.ang2pix(
+        nside, 100.0, 20.0, lonlat=True
+    )
+    assert result["two_sig_err_circle"] >= result["one_sig_err_circle"] > 0
+
+    # the model of the fit is not changed
+    assert model.point_sources["GRB_cpl_"].spectrum.main.shape.K.value == 1.0
+
+
+def test_prior_box():
+    # the ra range is wide enough at the dec furthest from the equator
+    ra_width = 30.0 / np.cos(np.deg2rad(30.0))
+    np.testing.assert_allclose(
+        prior_box(100.0, 0.0, 30.0), (100 - ra_width, 100 + ra_width, -30.0, 30.0)
+    )
+
+    # crossing ra=0 or containing a pole gives the full ra circle
+    assert prior_box(10.0, 0.0, 30.0) == (0.0, 360.0, -30.0, 30.0)
+    assert prior_box(100.0, 70.0, 30.0) == (0.0, 360.0, 40.0, 90.0)
+
+
+def _simulated_plugins(dets, ra, dec):
+    # a burst seen by the responses at the time of the trigdat file of gbm_drm_gen
+    trigdat = os.path.join(
+        os.path.dirname(gbm_drm_gen.__file__),
+        "data",
+        "example_data",
+        "glg_trigdat_all_bn110721200_v01.fit",
+    )
+
+    position_interpolator = PositionInterpolator.from_trigdat(trigdat_file=trigdat)
+
+    np.random.seed(1234)
+
+    plugins = []
+
+    for det in dets:
+        kind = "bgo" if det > 11 else "nai"
+
+        gen = DRMGen(
+            position_interpolator,
+            det,
+            trigdat_edges[kind],
+            mat_type=2,
+            ebin_edge_out=trigdat_out_edge[kind],
+            occult=True,
+        )
+
+        spectrum_like = DispersionSpectrumLike.from_function(
+            f"det{det}",
+            source_function=Cutoff_powerlaw(K=10.0, index=-1.0, xc=300.0),
+            background_function=Powerlaw(K=10.0, index=-1.5),
+            response=BALROG_DRM(gen, ra, dec),
+        )
+
+        plugins.append(
+            BALROGLike.from_spectrumlike(spectrum_like, 0.0, gen, free_position=False)
+        )
+
+    return plugins
+
+
+@pytest.mark.benchmark
+def test_grid_scan_benchmark():
+    plugins = _simulated_plugins([0, 1, 3, 6, 12], 100.0, 20.0)
+    model = _model()
+
+    start = time.time()
+    grid_scan = GridScan(plugins, model, nside=8)
+    log_like, best_params = grid_scan.scan()
+    scan_time = time.time() - start
+
+    result = grid_localization(8, log_like)
+
+    assert hp.rotator.angdist(
+        [result["ra"], result["dec"]], [100.0, 20.0], lonlat=True
+    )[0] < np.deg2rad(10.0)
+
+    # a likelihood evaluation of the fit at a new position
+    for plugin in plugins:
+        plugin.set_model(model)
+
+    joint = JointBALROG(plugins)
+    rng = np.random.default_rng(1)
+
+    n = 200
+
+    start = time.time()
+    for ra, dec in zip(rng.uniform(0, 360, n), rng.uniform(-90, 90, n)):
+        joint.set_location(ra, dec)
+        joint.get_log_like()
+    evaluation_time = (time.time() - start) / n
+
+    # nested sampling shrinks the prior volume by e per n_live_points evaluations,
+    # so the fit needs at least n_live_points * (1 + ln(sky / error circle))
+    n_live_points = morgoth_config["multinest"]["n_live_points"]
+    circle = np.pi * np.deg2rad(result["one_sig_err_circle"]) ** 2
+    fit_time = evaluation_time * n_live_points * (1 + np.log(4 * np.pi / circle))
+
+    print(
+        f"Grid scan {scan_time:.1f} s, at least {fit_time:.1f} s for the fit, "
+        f"{fit_time / scan_time:.1f} times faster"
+    )
+
+    assert scan_time * 3 < fit_time
@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+import pytest
+
+from morgoth.utils.intervals import prune_trigdat_bins
+
+
+def _legacy_prune(tstart, tstop, delta, fine):
+    # the nested loops TrigReader used before
+    if fine:
+        all_index = list(range(len(tstart)))
+        temp1 = delta < 0.1
+        temp2 = np.logical_and(delta > 0.1, delta < 1.0)
+        temp3 = np.logical_and(delta > 1.0, delta < 2.0)
+        temp4 = delta > 2.0
+        midT1 = (tstart[temp1] + tstop[temp1]) / 2.0
+        midT2 = (tstart[temp2] + tstop[temp2]) / 2.0
+        midT3 = (tstart[temp3] + tstop[temp3]) / 2.0
+
+        for coarse, mids in ((temp2, midT1), (temp3, midT2), (temp4, midT3)):
+            for indx in np.where(coarse)[0]:
+                for x in mids:
+                    if tstart[indx] < x < tstop[indx]:
+                        if indx in all_index:
+                            all_index.remove(indx)
+    else:
+        all_index = np.where(delta > 1.0)[0].tolist()
+        temp1 = np.logical_and(delta > 1.0, delta < 2.0)
+        temp2 = delta > 2.0
+        midT1 = (tstart[temp1] + tstop[temp1]) / 2.0
+
+        for indx in np.where(temp2)[0]:
+            for x in midT1:
+                if tstart[indx] < x < tstop[indx]:
+                    if indx in all_index:
+                        all_index.remove(indx)
+
+    return np.array(all_index)
+
+
+def _fake_trigdat_times(seed=0, scale=1):
+    """
+    Bin layout of a trigdat file: 8.192 s background bins, 1.024 s bins
+    around the trigger and 0.256 s and 0.064 s bins right after it,
+    written out of order like GBM sometimes does
+    """
+    rng = np.random.default_rng(seed)
+
+    starts = [
+        np.arange(-800 * scale, 800 * scale, 8.192),
+        np.arange(-50 * scale, 250 * scale, 1.024),
+        np.arange(-10 * scale, 50 * scale, 0.256),
+        np.arange(-2 * scale, 10 * scale, 0.064),
+    ]
+    widths = [8.192, 1.024, 0.256, 0.064]
+
+    tstart = np.concatenate(starts)
+    tstop = np.concatenate([s + w for s, w in zip(starts, widths)])
+
+    order = rng.permutation(len(tstart))
+    tstart = tstart[order]
+    tstop = tstop[order]
+
+    delta = tstop - tstart
+    tstart[delta < 0.1] = np.round(tstart[delta < 0.1], 4)
+    tstop[delta < 0.1] = np.round(tstop[delta < 0.1], 4)
+    tstart[~(delta < 0.1)] = np.round(tstart[~(delta < 0.1)], 3)
+    tstop[~(delta < 0.1)] = np.round(tstop[~(delta < 0.1)], 3)
+
+    return tstart, tstop, delta
+
+
+@pytest.mark.parametrize("fine", [True, False])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_prune_matches_legacy(fine, seed):
+
+    tstart, tstop, delta = _fake_trigdat_times(seed)
+
+    legacy = _legacy_prune(tstart, tstop, delta, fine)
+    new = prune_trigdat_bins(tstart, tstop, fine=fine, delta=delta)
+
+    np.testing.assert_array_equal(new, legacy)
+
+
+def test_prune_matches_legacy_long_trigdat():
+
+    tstart, tstop, delta = _fake_trigdat_times(scale=2)
+
+    legacy = _legacy_prune(tstart, tstop, delta, True)
+    new = prune_trigdat_bins(tstart, tstop, fine=True, delta=delta)
+
+    np.testing.assert_array_equal(new, legacy)
+
+
+@pytest.mark.benchmark
+def test_prune_benchmark():
+
+    tstart, tstop, delta = _fake_trigdat_times(scale=2)
+
+    t0 = time.perf_counter()
+    legacy = _legacy_prune(tstart, tstop, delta, True)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = prune_trigdat_bins(tstart, tstop, fine=True, delta=delta)
+    t_new = time.perf_counter() - t0
+
+    print(
+        f"{len(tstart)} bins: legacy {t_legacy * 1e3:.1f} ms, vectorized {t_new * 1e3:.3f} ms"
+    )
+
+    np.testing.assert_array_equal(new, legacy)
+    assert t_new < t_legacy
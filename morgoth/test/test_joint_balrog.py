@@ -0,0 +1,415 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import gbm_drm_gen
+import gbm_drm_gen.drmgen as drmgen
+import numba as nb
+import numpy as np
+from astromodels import Cutoff_powerlaw, Model, PointSource
+from gbm_drm_gen.drmgen import DRMGen
+from gbm_drm_gen.input_edges import trigdat_edges, trigdat_out_edge
+from gbm_drm_gen.io.balrog_drm import BALROG_DRM
+from gbmgeometry import PositionInterpolator
+
+import morgoth.auto_loc.utils.joint_balrog as joint_balrog
+from morgoth.auto_loc.utils.joint_balrog import JointBALROG
+
+
+class _Generator(DRMGen):
+    # a DRMGen with a cheap matrix that depends on the source direction
+    def __init__(self, det, quaternions, n_in=6):
+        self._det_number = det
+        self._nobins_in = n_in
+        self._nobins_out = 4
+        self._in_edge = np.geomspace(5.0, 50000.0, n_in + 1)
+        self._out_edge = np.geomspace(10.0, 2000.0, 5)
+        self._occult = True
+
+        self._quaternions = quaternions / np.linalg.norm(quaternions)
+        self._sc_pos = np.array([6000.0, 3000.0, 1000.0])
+        self._compute_spacecraft_coordinates()
+
+        self.builds = 0
+
+    def _make_drm_numba(self, src_az, src_el, geo_az, geo_el):
+        self.builds += 1
+        rows = np.arange(self._nobins_in).reshape(-1, 1)
+        return np.ones((self._nobins_in, self._nobins_out)) * (
+            self._det_number + src_az + 10 * src_el + rows
+        )
+
+
+class _SmoothGenerator(_Generator):
+    # a matrix that is smooth on the sky, for the interpolation
+    def _make_drm_numba(self, src_az, src_el, geo_az, geo_el):
+        self.builds += 1
+        rows = np.arange(self._nobins_in).reshape(-1, 1)
+        return np.ones((self._nobins_in, self._nobins_out)) * (
+            10 + self._det_number + np.cos(np.deg2rad(src_el)) + rows
+        )
+
+
+class _Plugin(object):
+    def __init__(self, response, model, integrals):
+        self.response = response
+        self._like_model = model
+        self._integrals = integrals
+
+    def _integral_flux(self):
+        self._integrals.append(self)
+        shape = self._like_model.point_sources["GRB"].spectrum.main.shape
+        return shape.K.value * np.ones(len(self.response.monte_carlo_energies) - 1)
+
+    def get_log_like(self, precalc_fluxes=None):
+        return -np.sum(self.response.convolve(precalc_fluxes=precalc_fluxes))
+
+
+def _generators(generator=_Generator):
+    same = np.array([0.1, 0.2, 0.3, 0.9])
+    other = np.array([0.5, -0.2, 0.3, 0.7])
+
+    return [
+        generator(0, same),
+        generator(5, same),
+        generator(12, same, n_in=8),
+        generator(1, other),
+    ]
+
+
+def test_joint_responses_match_single_responses():
+    single = [BALROG_DRM(gen, 0.0, 0.0) for gen in _generators()]
+
+    generators = _generators()
+    plugins = [
+        SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0)) for gen in generators
+    ]
+    joint = JointBALROG(plugins)
+
+    # one frame for the detectors of the same time
+    assert list(joint._frame_index) == [0, 0, 0, 1]
+
+    # the last position is below the horizon
+    for ra, dec in [(26.57, 8.13), (200.0, -10.0), (310.0, 60.0), (206.57, -8.48)]:
+        for response in single:
+            response.set_location(ra, dec)
+
+        builds = [gen.builds for gen in generators]
+
+        # the plugins set the location of their responses, the first builds all
+        for plugin in plugins:
+            plugin.response.set_location(ra, dec, cache=False)
+
+        added = [gen.builds - n for gen, n in zip(generators, builds)]
+        assert added in ([0, 0, 0, 0], [1, 1, 1, 1])
+
+        for response, plugin in zip(single, plugins):
+            np.testing.assert_allclose(plugin.response.matrix, response.matrix)
+            np.testing.assert_allclose(
+                plugin.response._matrix_transpose, response.matrix.T
+            )
+
+    assert added == [0, 0, 0, 0]
+    assert not any(np.any(plugin.response.matrix) for plugin in plugins)
+
+
+def _moving(generators):
+    # the attitude and position of the spacecraft change with the time
+    for gen in generators:
+        quaternions = gen._quaternions
+
+        gen._position_interpolator = SimpleNamespace(
+            quaternion=lambda t, q=quaternions: (q + [0.0, 0.0, 0.1 * t, 0.0])
+            / np.linalg.norm(q + [0.0, 0.0, 0.1 * t, 0.0]),
+            sc_pos=lambda t: np.array([6000.0, 3000.0 - 1000.0 * t, 1000.0]),
+        )
+
+    return generators
+
+
+def test_set_time_updates_the_frames():
+    single = [BALROG_DRM(gen, 0.0, 0.0) for gen in _moving(_generators())]
+
+    plugins = [
+        SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0))
+        for gen in _moving(_generators())
+    ]
+    joint = JointBALROG(plugins)
+
+    grid = JointBALROG(
+        [
+            SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0))
+            for gen in _moving(_generators(_SmoothGenerator))
+        ],
+        interpolation=dict(nside=8, tolerance=np.inf, max_cost=np.inf),
+    )
+
+    for time in [0.0, 3.0]:
+        for plugin in single + plugins + grid._plugins:
+            response = getattr(plugin, "response", plugin)
+            response.set_time(time)
+
+        # the pixels of the old time were dropped
+        assert grid.response_grid.stats["pixels"] == 0
+
+        # the same positions at another time are built again
+        for ra, dec in [(26.57, 8.13), (200.0, -10.0)]:
+            for response in single:
+                response.set_location(ra, dec)
+
+            joint.set_location(ra, dec)
+            grid.set_location(ra, dec)
+
+            for response, plugin in zip(single, plugins):
+                np.testing.assert_allclose(plugin.response.matrix, response.matrix)
+
+
+def _threads_build_the_same_responses():
+    serial = JointBALROG(
+        [SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0)) for gen in _generators()]
+    )
+
+    generators = _generators()
+    threaded = JointBALROG(
+        [SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0)) for gen in generators],
+        n_threads=4,
+    )
+
+    for ra, dec in [(26.57, 8.13), (200.0, -10.0), (206.57, -8.48)]:
+        serial.set_location(ra, dec)
+        threaded.set_location(ra, dec)
+
+        for plugin, other in zip(threaded._plugins, serial._plugins):
+            np.testing.assert_array_equal(plugin.response.matrix, other.response.matrix)
+
+    assert [gen.builds for gen in generators] == [2, 2, 2, 2]
+
+
+@nb.njit(parallel=True, nogil=True)
+def _parallel_kernel(values, el):
+    # a parallel kernel like at_scat of gbm_drm_gen
+    out = np.empty_like(values)
+
+    for i in nb.prange(values.shape[0]):
+        for j in range(values.shape[1]):
+            out[i, j] = values[i, j] * np.cos(np.deg2rad(el))
+
+    return out
+
+
+class _ParallelGenerator(_Generator):
+    def _make_drm_numba(self, src_az, src_el, geo_az, geo_el):
+        matrix = super()._make_drm_numba(src_az, src_el, geo_az, geo_el)
+
+        return _parallel_kernel(matrix, src_el)
+
+
+def _threads_launch_parallel_kernels():
+    positions = [(ra, dec) for ra in range(0, 360, 30) for dec in range(-60, 61, 30)]
+
+    serial = JointBALROG(
+        [
+            SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0))
+            for gen in _generators(_ParallelGenerator)
+        ]
+    )
+
+    threaded = JointBALROG(
+        [
+            SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0))
+            for gen in _generators(_ParallelGenerator)
+        ],
+        n_threads=4,
+    )
+
+    # the parallel kernels run on a thread safe layer
+    assert threaded._pool is not None
+    assert nb.threading_layer() in ("tbb", "omp")
+
+    for ra, dec in positions:
+        serial.set_location(ra, dec)
+        threaded.set_location(ra, dec)
+
+        for plugin, other in zip(threaded._plugins, serial._plugins):
+            np.testing.assert_array_equal(plugin.response.matrix, other.response.matrix)
+
+
+def _nogil_kernel_builds_the_same_drm():
+    trigdat = os.path.join(
+        os.path.dirname(gbm_drm_gen.__file__),
+        "data",
+        "example_data",
+        "glg_trigdat_all_bn110721200_v01.fit",
+    )
+
+    gen = DRMGen(
+        PositionInterpolator.from_trigdat(trigdat_file=trigdat),
+        6,
+        trigdat_edges["nai"],
+        mat_type=2,
+        ebin_edge_out=trigdat_out_edge["nai"],
+        occult=True,
+    )
+
+    assert joint_balrog._release_gil()
+
+    # a copy of the kernel, gbm_drm_gen is not changed
+    assert joint_balrog._build_drm_nogil.targetoptions["nogil"]
+    assert not drmgen._build_drm.targetoptions.get("nogil", False)
+
+    for az, el in [(10.0, 20.0), (200.0, -45.0)]:
+        np.testing.assert_array_equal(
+            joint_balrog._make_drm(gen, az, el, gen._geo_az, gen._geo_el),
+            gen._make_drm_numba(az, el, gen._geo_az, gen._geo_el),
+        )
+
+
+def test_threads():
+    # the threads start the threading layer of numba, which is not fork safe,
+    # so they run in a new process and the later tests can still fork
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import test_joint_balrog as t; "
+            "t._threads_build_the_same_responses(); "
+            "t._threads_launch_parallel_kernels(); "
+            "t._nogil_kernel_builds_the_same_drm()",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        check=True,
+    )
+
+
+def test_threads_need_the_pinned_gbm_drm_gen(monkeypatch):
+    monkeypatch.setattr(joint_balrog, "_nogil_version", "0.0.0")
+
+    joint = JointBALROG(
+        [SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0)) for gen in _generators()],
+        n_threads=4,
+    )
+
+    assert joint._pool is None
+
+
+def test_spectrum_is_shared():
+    model = Model(PointSource("GRB", 0.0, 0.0, spectral_shape=Cutoff_powerlaw()))
+
+    integrals = []
+    plugins = [
+        _Plugin(BALROG_DRM(gen, 0.0, 0.0), model, integrals)
+        for gen in _generators()
+    ]
+    joint = JointBALROG(plugins)
+
+    joint.set_location(100.0, 20.0)
+    log_like = joint.get_log_like()
+
+    # one integral for the grid of the nai and one for the bgo
+    assert integrals == [plugins[0], plugins[2]]
+
+    expected = sum(
+        -np.sum(plugin.response.convolve(precalc_fluxes=plugin._integral_flux()))
+        for plugin in plugins
+    )
+    np.testing.assert_allclose(log_like, expected)
+
+    # a new position reuses the integral
+    del integrals[:]
+    model.GRB.position.ra.value = 120.0
+    joint.set_location(120.0, 20.0)
+    joint.get_log_like()
+    assert integrals == []
+
+    # a new spectrum is integrated again
+    model.GRB.spectrum.main.shape.K.value = 2.0
+    joint.get_log_like()
+    assert len(integrals) == 2
+
+    # the likelihood of the sampler calls the plugins one by one
+    del integrals[:]
+    model.GRB.spectrum.main.shape.K.value = 3.0
+    log_likes = [plugin.get_log_like() for plugin in plugins]
+    assert integrals == [plugins[0], plugins[2]]
+    np.testing.assert_allclose(sum(log_likes), joint.get_log_like())
+
+
+def test_interpolated_responses():
+    generators = _generators(_SmoothGenerator)[:3]
+    exact = [BALROG_DRM(gen, 0.0, 0.0) for gen in _generators(_SmoothGenerator)[:3]]
+
+    plugins = [
+        SimpleNamespace(response=BALROG_DRM(gen, 0.0, 0.0)) for gen in generators
+    ]
+    joint = JointBALROG(
+        plugins,
+        interpolation=dict(
+            nside=32, max_pixels=8, tolerance=0.05, validate=True, max_cost=np.inf
+        ),
+    )
+
+    # positions close to each other share their pixels
+    for ra, dec in [(100.0, 20.0), (100.3, 20.2), (100.6, 19.9)]:
+        builds = generators[0].builds
+        joint.set_location(ra, dec)
+
+        for response, plugin in zip(exact, plugins):
+            response.set_location(ra, dec)
+            np.testing.assert_allclose(
+                plugin.response.matrix, response.matrix, rtol=0.05
+            )
+
+    stats = joint.response_grid.stats
+
+    assert stats["interpolated"] == 3
+    assert stats["exact"] == 0
+    assert stats["validated"] == 3
+    assert 0 < stats["max_error"] < 0.05
+    assert stats["above_tolerance"] == 0
+    assert stats["pixel_builds"] < 3 * 4
+
+    # the least recently used pixels are dropped
+    for ra in [150.0, 200.0, 250.0]:
+        joint.set_location(ra, -30.0)
+
+    stats = joint.response_grid.stats
+    assert stats["pixel_builds"] > 8
+    assert stats["pixels"] == 8
+
+    # at the horizon the pixels do not agree and the response is built exactly,
+    # the horizon is about 70 deg from the nadir at ra=206.57, dec=-8.48
+    for dec in np.linspace(55.0, 68.0, 27):
+        joint.set_location(206.57, dec)
+
+    assert joint.response_grid.stats["exact"] > 0
+
+
+def test_pixels_are_only_built_within_the_cost():
+    generator = _generators(_SmoothGenerator)[0]
+
+    joint = JointBALROG(
+        [SimpleNamespace(response=BALROG_DRM(generator, 0.0, 0.0))],
+        interpolation=dict(nside=32, max_cost=1.0, cost_window=50),
+    )
+
+    rng = np.random.default_rng(1)
+
+    # the sampler explores the whole sky, the pixels are rarely reused
+    for ra, dec in zip(rng.uniform(0, 360, 500), rng.uniform(-60, 60, 500)):
+        joint.set_location(ra, dec)
+
+    stats = joint.response_grid.stats
+
+    assert stats["fallback"] > 400
+    assert stats["builds_per_response"] < 1.1
+
+    # the sampler contracted, the pixels are built and reused
+    for ra, dec in zip(rng.normal(100, 1, 500), rng.normal(20, 1, 500)):
+        joint.set_location(ra, dec)
+
+    contracted = joint.response_grid.stats
+
+    assert contracted["interpolated"] - stats["interpolated"] > 400
+    assert contracted["builds"] - stats["builds"] < 100
@@ -0,0 +1,55 @@
+import os
+
+from morgoth.utils.multinest_chains import (
+    ChainProgressMonitor,
+    chain_progress,
+    prepare_chains_dir,
+    resume_file,
+)
+
+
+def _partial_run(chain_path, n_samples):
+    # the files a killed MultiNest run leaves behind
+    with open(resume_file(chain_path), "w") as f:
+        f.write(" T\n")
+
+    with open(f"{chain_path}ev.dat", "w") as f:
+        for i in range(n_samples):
+            f.write(f"{i} 0.1 -100.0 0\n")
+
+
+def test_resume_only_with_the_same_inputs(tmp_path):
+    chains_dir = str(tmp_path / "c_trig_v00")
+    chain_path = os.path.join(chains_dir, "trigdat_v00_")
+
+    assert not prepare_chains_dir(chains_dir, chain_path, "key")
+
+    _partial_run(chain_path, 120)
+
+    assert prepare_chains_dir(chains_dir, chain_path, "key")
+    assert chain_progress(chain_path, n_live_points=800) == dict(
+        n_samples=120, log_volume=-0.15
+    )
+
+    assert not prepare_chains_dir(chains_dir, chain_path, "key", resume=False)
+    assert not os.path.exists(resume_file(chain_path))
+
+    # the chains of other inputs are removed
+    _partial_run(chain_path, 120)
+
+    assert not prepare_chains_dir(chains_dir, chain_path, "other key")
+    assert os.listdir(chains_dir) == ["chain_inputs.yml"]
+    assert chain_progress(chain_path) == dict(n_samples=0)
+
+
+def test_progress_monitor(tmp_path):
+    chain_path = str(tmp_path / "tte_v00_")
+
+    messages = []
+
+    with ChainProgressMonitor(
+        chain_path, messages.append, n_live_points=100, interval=0.01
+    ):
+        _partial_run(chain_path, 50)
+
+    assert messages[-1] == "MultiNest: 50 samples, ln(X) = -0.50"
@@ -0,0 +1,129 @@
+import os
+
+import gbm_drm_gen
+import numpy as np
+from gbm_drm_gen.drmgen import DRMGen
+from gbm_drm_gen.input_edges import trigdat_edges, trigdat_out_edge
+from gbm_drm_gen.io.balrog_drm import BALROG_DRM
+from gbmgeometry import PositionInterpolator
+
+from morgoth.utils.response_cache import ResponseCache
+
+
+def test_response_cache(tmp_path):
+
+    trigdat_file = tmp_path / "glg_trigdat_all_bn230514996_v00.fit"
+    trigdat_file.write_bytes(b"trigdat")
+
+    tstart = np.arange(10.0)
+    tstop = tstart + 1
+
+    built = []
+
+    def build(det):
+        built.append(det)
+        return {"det": det, "matrix": np.ones((8, 140))}
+
+    cache = ResponseCache(max_items=2)
+
+    for det in ["n0", "n1", "n0", "n2"]:
+        response = cache.get_or_build(
+            str(trigdat_file), det, tstart, tstop, lambda det=det: build(det)
+        )
+        assert response["det"] == det
+
+    assert built == ["n0", "n1", "n2"]
+    assert len(cache) == 2
+
+    # n1 was evicted from memory but is read from disk
+    cache.get_or_build(str(trigdat_file), "n1", tstart, tstop, lambda: build("n1"))
+    assert built == ["n0", "n1", "n2"]
+
+    # a new process finds the responses on disk
+    other = ResponseCache()
+    other.get_or_build(str(trigdat_file), "n0", tstart, tstop, lambda: build("n0"))
+    assert built == ["n0", "n1", "n2"]
+    assert other.hits == 1
+
+    # a new version of the file or other time bins need a new response
+    other.get_or_build(str(trigdat_file), "n0", tstart, tstop + 1, lambda: build("n0"))
+    trigdat_file.write_bytes(b"trigdat v01")
+    other.get_or_build(str(trigdat_file), "n0", tstart, tstop, lambda: build("n0"))
+    assert built == ["n0", "n1", "n2", "n0", "n0"]
+
+
+def test_disk_eviction(tmp_path):
+
+    trigdat_file = tmp_path / "glg_trigdat_all_bn230514996_v00.fit"
+    trigdat_file.write_bytes(b"trigdat")
+
+    tstart = np.arange(10.0)
+    tstop = tstart + 1
+
+    # a response is about 9 kB on disk, room for two of them
+    cache = ResponseCache(max_items=1, max_disk_size_gb=20000 / 1024 ** 3)
+
+    for det in ["n0", "n1", "n2"]:
+        cache.get_or_build(
+            str(trigdat_file), det, tstart, tstop, lambda: np.ones((8, 140))
+        )
+
+    cache_dir = tmp_path / "response_cache"
+    assert len(os.listdir(cache_dir)) == 2
+
+    # n0 was deleted, n1 and n2 are still on disk
+    for det, misses in [("n1", 3), ("n2", 3), ("n0", 4)]:
+        cache.get_or_build(
+            str(trigdat_file), det, tstart, tstop, lambda: np.ones((8, 140))
+        )
+        assert cache.misses == misses
+
+
+def test_balrog_drm_round_trip(tmp_path):
+
+    trigdat_file = os.path.join(
+        os.path.dirname(gbm_drm_gen.__file__),
+        "data",
+        "example_data",
+        "glg_trigdat_all_bn110721200_v01.fit",
+    )
+
+    def build():
+        drm_gen = DRMGen(
+            PositionInterpolator.from_trigdat(trigdat_file=trigdat_file),
+            6,
+            trigdat_edges["nai"],
+            mat_type=2,
+            ebin_edge_out=trigdat_out_edge["nai"],
+            occult=True,
+        )
+
+        return BALROG_DRM(drm_gen, 0, 0)
+
+    tstart = np.arange(10.0)
+    tstop = tstart + 1
+
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    response = cache.get_or_build(trigdat_file, "n6", tstart, tstop, build)
+
+    # from memory and from the disk in a new process
+    from_memory = cache.get_or_build(trigdat_file, "n6", tstart, tstop, None)
+    from_disk = ResponseCache(cache_dir=str(tmp_path)).get_or_build(
+        trigdat_file, "n6", tstart, tstop, None
+    )
+
+    assert len(os.listdir(tmp_path)) == 1
+
+    for other in [from_memory, from_disk]:
+        assert other is not response
+
+        for ra, dec in [(0.0, 0.0), (120.0, -30.0)]:
+            response.set_location(ra, dec)
+            other.set_location(ra, dec)
+
+            np.testing.assert_array_equal(other.matrix, response.matrix)
+
+    # the copies share the detector databases of gbm_drm_gen
+    assert (
+        from_memory._drm_generator._database_nb is response._drm_generator._database_nb
+    )
@@ -0,0 +1,216 @@
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+
+import gbm_drm_gen
+import numpy as np
+import pytest
+from astromodels import Model, PointSource, Powerlaw
+from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
+from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
+from threeML.utils.OGIP.response import InstrumentResponse
+from threeML.utils.time_series.event_list import EventListWithDeadTime
+
+from morgoth.utils.shared_data import (
+    share_arrays,
+    spectrum_from_arrays,
+    spectrum_to_arrays,
+)
+
+
+def _spectrum_like(response, det="n0"):
+    # a binned time series of a constant background and a burst
+    rng = np.random.default_rng(1)
+
+    arrival_times = np.sort(
+        np.concatenate([rng.uniform(-200, 300, 20000), rng.uniform(0, 5, 2000)])
+    )
+
+    event_list = EventListWithDeadTime(
+        arrival_times=arrival_times,
+        measurement=rng.integers(0, 8, len(arrival_times)),
+        n_channels=8,
+        start_time=-200,
+        stop_time=300,
+        dead_time=np.zeros(len(arrival_times)),
+        first_channel=0,
+        verbose=False,
+    )
+
+    ts = TimeSeriesBuilder(
+        det, event_list, poly_order=1, unbinned=False, verbose=False, response=response
+    )
+    ts.set_background_interval("-150--20", "50-250")
+    ts.set_active_time_interval("0-5")
+
+    return ts.to_spectrumlike()
+
+
+def test_spectrum_from_arrays():
+    ebounds = np.geomspace(10, 1000, 9)
+    response = InstrumentResponse(np.eye(8), ebounds, ebounds)
+
+    sl = _spectrum_like(response)
+
+    spectra = {}
+
+    for kind, spectrum in [
+        ("observed", sl.observed_spectrum),
+        ("background", sl.background_spectrum),
+    ]:
+        arrays, info = spectrum_to_arrays(spectrum, f"n0_{kind}_")
+
+        assert all(isinstance(array, np.ndarray) for array in arrays.values())
+
+        # the arrays get copied into the shared memory
+        arrays = {key: array.copy() for key, array in arrays.items()}
+
+        spectra[kind] = spectrum_from_arrays(
+            arrays, info, f"n0_{kind}_", response=response
+        )
+
+    rebuilt = DispersionSpectrumLike(
+        "n0", spectra["observed"], spectra["background"], verbose=False
+    )
+
+    np.testing.assert_array_equal(
+        rebuilt.background_spectrum.count_errors,
+        sl.background_spectrum.count_errors,
+    )
+    assert not rebuilt.background_spectrum.is_poisson
+
+    model = Model(PointSource("GRB", 0.0, 0.0, spectral_shape=Powerlaw()))
+
+    for plugin in [sl, rebuilt]:
+        plugin.set_active_measurements("20-700")
+        plugin.set_model(model)
+
+    assert rebuilt.get_log_like() == sl.get_log_like()
+
+
+def test_share_arrays():
+    MPI = pytest.importorskip("mpi4py.MPI")
+
+    arrays = dict(counts=np.arange(10.0), matrix=np.ones((3, 4), dtype=np.float32).T)
+
+    shared, window = share_arrays(MPI.COMM_WORLD, arrays)
+
+    for key, array in arrays.items():
+        np.testing.assert_array_equal(shared[key], array)
+        assert shared[key].dtype == array.dtype
+
+    window.Free()
+
+
+def test_drm_gen_tte():
+    import morgoth.auto_loc.utils.fit as fit
+
+    data_dir = os.path.join(
+        os.path.dirname(gbm_drm_gen.__file__), "data", "example_data"
+    )
+
+    rsp = gbm_drm_gen.DRMGenTTE(
+        tte_file=os.path.join(data_dir, "glg_tte_n6_bn110721200_v00.fit"),
+        trigdat=os.path.join(data_dir, "glg_trigdat_all_bn110721200_v01.fit"),
+        mat_type=2,
+        cspecfile=os.path.join(data_dir, "glg_cspec_n6_bn110721200_v00.pha"),
+        occult=True,
+    )
+
+    # the other ranks get the position interpolator and the edges of rank 0
+    position_interpolator = pickle.loads(pickle.dumps(rsp._position_interpolator))
+
+    rebuilt = fit._drm_gen_tte(position_interpolator, "n6", rsp.ebounds.copy())
+
+    assert type(rebuilt) is type(rsp)
+    np.testing.assert_array_equal(
+        [c.cartesian.xyz.value for c in rebuilt._gbm.get_centers()],
+        [c.cartesian.xyz.value for c in rsp._gbm.get_centers()],
+    )
+
+    for gen in [rsp, rebuilt]:
+        gen.set_time(5.0)
+        gen.set_location(100.0, 20.0)
+
+    np.testing.assert_array_equal(rebuilt.matrix, rsp.matrix)
+    np.testing.assert_array_equal(
+        rebuilt.monte_carlo_energies, rsp.monte_carlo_energies
+    )
+
+
+def _share_spectrum_likes():
+    # run by every rank of mpiexec, rank 0 shares the spectrum likes of a NaI
+    # and a BGO det, the other ranks rebuild them like the tte fit does
+    from mpi4py import MPI
+
+    import morgoth.auto_loc.utils.fit as fit
+
+    comm = MPI.COMM_WORLD
+    assert comm.size == 2
+
+    dets = ["n0", "b0"]
+    ebounds = np.geomspace(10, 1000, 9)
+    response = InstrumentResponse(np.eye(8), ebounds, ebounds)
+
+    det_sl = [_spectrum_like(response, det) for det in dets]
+
+    for det, sl in zip(dets, det_sl):
+        sl.set_active_measurements(fit._active_measurements(det))
+
+    arrays, infos = None, None
+
+    if comm.rank == 0:
+        arrays, infos = fit._spectrum_arrays(dets, det_sl, [response] * len(dets))
+
+    infos = comm.bcast(infos, root=0)
+
+    shared, window = share_arrays(comm, arrays)
+
+    model = Model(PointSource("GRB", 0.0, 0.0, spectral_shape=Powerlaw()))
+
+    for det, sl in zip(dets, det_sl):
+        rebuilt = fit._spectrum_like_from_arrays(det, shared, infos)
+
+        np.testing.assert_array_equal(rebuilt.mask, sl.mask)
+
+        for plugin in [sl, rebuilt]:
+            plugin.set_model(model)
+
+        assert rebuilt.get_log_like() == sl.get_log_like()
+
+    comm.Barrier()
+    window.Free()
+
+
+def test_share_spectrum_likes_mpi():
+    pytest.importorskip("mpi4py.MPI")
+
+    mpiexec = shutil.which("mpiexec")
+
+    if mpiexec is None:
+        pytest.skip("mpiexec is not installed")
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(sys.path),
+        OMPI_ALLOW_RUN_AS_ROOT="1",
+        OMPI_ALLOW_RUN_AS_ROOT_CONFIRM="1",
+        OMPI_MCA_rmaps_base_oversubscribe="1",
+    )
+
+    subprocess.run(
+        [
+            mpiexec,
+            "-n",
+            "2",
+            sys.executable,
+            "-c",
+            "import test_shared_data as t; t._share_spectrum_likes()",
+        ],
+        cwd=os.path.dirname(__file__),
+        env=env,
+        check=True,
+        timeout=600,
+    )
@@ -0,0 +1,107 @@
+import numpy as np
+
+from morgoth.auto_loc.time_selection import TimeSelectionBB
+from morgoth.auto_loc.utils.bayesian_blocks import BayesianBlocks
+from morgoth.utils.trig_reader import lu
+
+
+class _FakeTrigReader(object):
+    """Stands in for the TrigReader, the selection only passes the
+    background and active selections to it. The significance of a
+    detector depends on its selections"""
+
+    def __init__(self, n_bins):
+        self.selections = []
+        self._n_bins = n_bins
+
+    def set_background_selections(self, *intervals, det_sel=None):
+        self.selections.append(("background", det_sel, intervals))
+
+    def set_active_time_interval(self, *intervals, det_sel=None):
+        self.selections.append(("active", det_sel, intervals))
+
+    @property
+    def time_series(self):
+        selections = self.selections
+
+        class _Det(object):
+            def __init__(self, det, n_bins):
+                fit = [s for s in selections if s[1] == det]
+                self.significance_per_interval = np.full(
+                    n_bins, float(sum(map(ord, repr(fit))))
+                )
+
+        return {det: _Det(det, self._n_bins) for det in lu}
+
+
+def _time_selection(n_workers):
+    rng = np.random.default_rng(42)
+
+    times = np.concatenate(
+        [np.arange(-400, -20, 8.192), np.arange(-20, 120, 1.024), np.arange(120, 600, 8.192)]
+    ).tolist()
+
+    ts = TimeSelectionBB.__new__(TimeSelectionBB)
+    ts.dets = list(lu)
+    ts._n_workers = n_workers
+    ts._gamma = 0.776
+    ts._mean_factor = 1.1
+    ts._times = times
+    ts._times_array = np.array(times)
+    ts._bb_engine = BayesianBlocks(ts._times_array, gamma=ts._gamma)
+    ts._max_time = times[-1]
+    ts._trigreader_obj = _FakeTrigReader(len(times))
+
+    ts._cps_dets = {}
+    ts._timebin_widths = {}
+    width = np.diff(times).tolist()
+    for det_nr, det in enumerate(ts.dets):
+        cps = rng.poisson(1000, size=len(times))
+        cps[(ts._times_array > 0) & (ts._times_array < 5 + det_nr)] += 50 * det_nr
+        cps[-1] = 0
+        ts._cps_dets[det] = cps.tolist()
+        ts._timebin_widths[det] = width[det_nr]
+
+    for name in [
+        "_bayesian_block_edges_dict",
+        "_bayesian_block_times_dict",
+        "_bayesian_block_cps_dict",
+        "_bayesian_block_widths_dict",
+        "_start_trigger_dict",
+        "_stop_trigger_dict",
+        "pos_bkg_dict",
+        "neg_bkg_dict",
+        "_bkg_list_dict",
+        "_significance_dict",
+    ]:
+        setattr(ts, name, {})
+
+    ts.timeselection()
+
+    return ts
+
+
+def test_parallel_timeselection_matches_serial():
+
+    serial = _time_selection(n_workers=1)
+    parallel = _time_selection(n_workers=4)
+
+    for det in serial.dets:
+        np.testing.assert_array_equal(
+            serial._bayesian_block_edges_dict[det],
+            parallel._bayesian_block_edges_dict[det],
+        )
+        assert serial.bayesian_block_cps_dict[det] == parallel.bayesian_block_cps_dict[det]
+        assert serial.start_trigger_dict[det] == parallel.start_trigger_dict[det]
+        assert serial.stop_trigger_dict[det] == parallel.stop_trigger_dict[det]
+        assert serial._bkg_list_dict[det] == parallel._bkg_list_dict[det]
+
+        # the fits and significances of the workers got the same selections
+        assert serial._significance_dict[det][0] > 0
+        np.testing.assert_array_equal(
+            serial._significance_dict[det], parallel._significance_dict[det]
+        )
+
+    # the detectors are only fitted in the workers
+    assert len(serial.trigreader_object.selections) == 2 * len(serial.dets)
+    assert parallel.trigreader_object.selections == []
@@ -0,0 +1,220 @@
+from morgoth.utils.trig_reader import TrigReader, lu
+
+
+class _FakeTimeSeries(object):
+    def __init__(self, name):
+        self.name = name
+        self.selections = []
+
+    def set_background_interval(self, *intervals, unbinned=True):
+        self.selections.append(("background", intervals))
+
+    def set_active_time_interval(self, *intervals):
+        self.selections.append(("active", intervals))
+
+
+def _reader(lazy):
+    # a TrigReader without a trigdat file, that creates fake time series
+    reader = TrigReader.__new__(TrigReader)
+    reader._lazy = lazy
+    reader._pending_selections = {}
+    reader._created = []
+
+    def create(name):
+        reader._created.append(name)
+        return _FakeTimeSeries(name)
+
+    reader._create_detector_timeseries = create
+    reader._create_timeseries()
+
+    return reader
+
+
+def test_lazy_time_series():
+
+    reader = _reader(lazy=True)
+
+    reader.set_background_selections("-20--5", "50-100")
+    reader.set_active_time_interval("0-10", det_sel="n3")
+
+    assert reader._created == []
+
+    n3 = reader.time_series["n3"]
+    n4 = reader.time_series["n4"]
+
+    assert reader._created == ["n3", "n4"]
+    assert n3.selections == [
+        ("background", ("-20--5", "50-100")),
+        ("active", ("0-10",)),
+    ]
+    assert n4.selections == [("background", ("-20--5", "50-100"))]
+
+    # selections of created detectors are applied directly
+    reader.set_active_time_interval("1-2")
+
+    assert n4.selections[-1] == ("active", ("1-2",))
+    assert reader._created == ["n3", "n4"]
+    assert list(reader.time_series) == list(lu)
+
+
+def test_eager_time_series():
+
+    reader = _reader(lazy=False)
+
+    assert reader._created == list(lu)
+
+    reader.set_background_selections("-20--5", det_sel="b0")
+
+    assert reader.time_series["b0"].selections == [("background", ("-20--5",))]
+    assert reader.time_series["b1"].selections == []
+
+
+def _binned_reader(fit_dets, lazy=False):
+    # a TrigReader with time series built from fake rates, without responses
+    import numpy as np
+    from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
+    from threeML.utils.OGIP.response import InstrumentResponse
+    from threeML.utils.spectrum.binned_spectrum import BinnedSpectrum
+    from threeML.utils.spectrum.binned_spectrum_set import BinnedSpectrumSet
+    from threeML.utils.time_interval import TimeIntervalSet
+    from threeML.utils.time_series.binned_spectrum_series import (
+        BinnedSpectrumSeries,
+    )
+
+    rng = np.random.default_rng(1)
+
+    reader = TrigReader.__new__(TrigReader)
+    reader._lazy = lazy
+    reader._pending_selections = {}
+    reader._restore_poly_fit = None
+    reader._created = []
+    reader._tstart = np.concatenate(
+        [np.arange(-1200, -8, 8.192), np.arange(-8, 300, 1.024)]
+    )
+    reader._tstop = np.append(reader._tstart[1:], reader._tstart[-1] + 1.024)
+    reader._time_intervals = TimeIntervalSet.from_starts_and_stops(
+        reader._tstart, reader._tstop
+    )
+    reader._rates = rng.poisson(100, size=(len(reader._tstart), 14, 8)).astype(
+        np.float32
+    )
+
+    ebounds = np.arange(9.0) + 1
+    response = InstrumentResponse(np.eye(8), ebounds, ebounds)
+
+    def create(name):
+        det_num = lu.index(name)
+        reader._created.append(name)
+        counts = reader._rates[:, det_num, :] * reader._time_intervals.widths.reshape(
+            (len(reader._time_intervals), 1)
+        )
+        spectra = [
+            BinnedSpectrum(
+                counts=c, exposure=stop - start, ebounds=ebounds, tstart=start, tstop=stop
+            )
+            for c, start, stop in zip(counts, reader._tstart, reader._tstop)
+        ]
+        bss = BinnedSpectrumSet(
+            spectra, reference_time=0.0, time_intervals=reader._time_intervals
+        )
+        return TimeSeriesBuilder(
+            name,
+            BinnedSpectrumSeries(bss, first_channel=0),
+            response=response,
+            verbose=False,
+            poly_order=1,
+        )
+
+    reader._create_detector_timeseries = create
+    reader._create_timeseries()
+
+    for name in fit_dets:
+        reader.set_background_selections("-500--20", "100-250", det_sel=name)
+
+    return reader
+
+
+def _per_bin_rates(time_series_builder, start=-1000, stop=1000):
+    # the observed and bkg rate of one detector computed bin by bin
+    import numpy as np
+
+    time_series = time_series_builder.time_series
+    bins = time_series.binned_spectrum_set.time_intervals.containing_interval(
+        start, stop
+    )
+
+    observed = []
+    bkg = []
+    for tb in bins:
+        counts = time_series.counts_over_interval(tb.start_time, tb.stop_time)
+        observed.append(counts / tb.duration)
+
+        if time_series.poly_fit_exists:
+            tmpbkg = 0.0
+            for poly in time_series.polynomials:
+                tmpbkg += poly.integral(tb.start_time, tb.stop_time)
+            bkg.append(tmpbkg / tb.duration)
+
+    return np.array(observed), np.array(bkg)
+
+
+def test_observed_and_background_matches_per_bin_loop():
+    import numpy as np
+
+    reader = _binned_reader(fit_dets=["n0", "b1"])
+
+    observed, background = reader.observed_and_background_array()
+    observed_list, background_list = reader.observed_and_background()
+
+    assert observed.shape == background.shape == (14, len(observed_list[0]))
+
+    for det_num, name in enumerate(lu):
+        obs, bkg = _per_bin_rates(reader.time_series[name])
+
+        np.testing.assert_array_equal(observed[det_num], obs)
+        np.testing.assert_array_equal(observed_list[det_num], obs)
+
+        if name in ["n0", "b1"]:
+            np.testing.assert_array_equal(background[det_num], bkg)
+            np.testing.assert_array_equal(background_list[det_num], bkg)
+        else:
+            assert np.all(np.isnan(background[det_num]))
+            assert background_list[det_num].item() is None
+
+
+def test_observed_and_background_lazy():
+    import numpy as np
+
+    reader = _binned_reader(fit_dets=["n0", "b1"])
+    lazy_reader = _binned_reader(fit_dets=["n0", "b1"], lazy=True)
+
+    observed, background = reader.observed_and_background_array()
+    lazy_observed, lazy_background = lazy_reader.observed_and_background_array()
+
+    # only the detectors with a bkg selection are created
+    assert lazy_reader._created == ["n0", "b1"]
+
+    np.testing.assert_array_equal(lazy_observed, observed)
+    np.testing.assert_array_equal(lazy_background, background)
+
+
+def test_significances_match_plugins():
+    import numpy as np
+
+    reader = _binned_reader(fit_dets=["n0", "n7", "b1"])
+    for tsb in reader.time_series.values():
+        tsb.set_active_time_interval("0-10")
+
+    significances = reader.significances()
+
+    for det_num, name in enumerate(lu):
+        expected = reader.time_series[name].to_spectrumlike().significance
+
+        if name in ["n0", "n7", "b1"]:
+            np.testing.assert_allclose(significances[det_num], expected, rtol=1e-12)
+        else:
+            assert np.isnan(significances[det_num])
+
+    np.testing.assert_array_equal(
+        reader.significances("b1", "n0"), significances[[13, 0]]
+    )
@@ -0,0 +1,165 @@
+import threading
+import time
+
+from morgoth.utils.trigdat_watcher import TrigdatWatcher
+
+
+def test_watcher_fires_each_version(http_server):
+
+    url, directory = http_server
+
+    grb = "GRB230514996"
+
+    (directory / f"glg_trigdat_all_bn{grb[3:]}_v00.fit").write_bytes(b"trigdat")
+    # other files in the directory are ignored
+    (directory / f"glg_tte_n0_bn{grb[3:]}_v00.fit").write_bytes(b"tte")
+
+    def late_versions():
+        time.sleep(0.5)
+        for v in ["v01", "v02"]:
+            (directory / f"glg_trigdat_all_bn{grb[3:]}_{v}.fit").write_bytes(b"trigdat")
+
+    thread = threading.Thread(target=late_versions)
+    thread.start()
+
+    events = []
+
+    watcher = TrigdatWatcher(
+        url,
+        grb,
+        interval=0.1,
+        max_time=10,
+        trigger_time="2023-05-14T23:54:33.47Z",
+    )
+    watcher.add_callback(lambda version, uri: events.append((version, uri)))
+
+    latencies = watcher.run()
+
+    thread.join()
+
+    assert [v for v, _ in events] == ["v00", "v01", "v02"]
+    assert events[0][1] == f"{url}glg_trigdat_all_bn{grb[3:]}_v00.fit"
+    assert len(watcher.missing) == 0
+    assert latencies["v00"]["since_start"] < 0.5
+    assert latencies["v01"]["since_start"] >= 0.5
+    assert latencies["v00"]["since_trigger"] > 0
+    assert watcher.n_listings > 1
+
+
+def test_watcher_gives_up(http_server):
+
+    url, directory = http_server
+
+    watcher = TrigdatWatcher(f"{url}missing", "GRB230514996", interval=0.1, max_time=0.5)
+
+    latencies = watcher.run()
+
+    assert latencies == {}
+    assert watcher.missing == ["v00", "v01", "v02"]
+
+
+def test_watch_trigdat_records_failed_downloads(http_server, tmp_path, monkeypatch):
+    import yaml
+
+    import morgoth.downloaders as downloaders
+    import morgoth.trigger as trigger
+    from morgoth.utils.download_file import BackgroundDownload
+
+    url, directory = http_server
+
+    grb = "GRB230514996"
+
+    for v in ["v00", "v01", "v02"]:
+        (directory / f"glg_trigdat_all_bn{grb[3:]}_{v}.fit").write_bytes(b"trigdat")
+
+    base = tmp_path / "data"
+
+    monkeypatch.setattr(downloaders, "base_dir", str(base))
+    monkeypatch.setattr(trigger, "base_dir", str(base))
+
+    (base / grb).mkdir(parents=True)
+
+    trigger.GBMTriggerFile(
+        trigger_number=1,
+        trigger_time="2023-05-14T23:54:33.47Z",
+        name=grb,
+        ra=0.0,
+        dec=0.0,
+        radius=1.0,
+        uri=url,
+        most_likely="GRB",
+        most_likely_prob=1.0,
+        most_likely_2="",
+        most_likely_prob_2=0.0,
+    ).write(base / grb / "grb_parameters.yml")
+
+    class FailingV01(BackgroundDownload):
+        def run(self):
+            if self._url.endswith("_v01.fit"):
+                raise AssertionError("broken transfer")
+
+            return super().run()
+
+    monkeypatch.setattr(downloaders, "BackgroundDownload", FailingV01)
+
+    triggered = []
+    monkeypatch.setattr(downloaders, "_trigger_pipeline", triggered.append)
+
+    downloaders.watch_trigdat(grb)
+
+    # the pipeline runs again after every download
+    assert triggered == [grb, grb]
+
+    with open(base / grb / "trigdat" / "trigdat_watcher.yml") as f:
+        watcher_dict = yaml.safe_load(f)
+
+    # the other versions are still downloaded and the latencies are kept
+    assert list(watcher_dict["errors"]) == ["v01"]
+    assert sorted(watcher_dict["latencies"]) == ["v00", "v01", "v02"]
+
+    for v in ["v00", "v02"]:
+        assert (base / grb / "trigdat" / f"glg_trigdat_all_bn{grb[3:]}_{v}.fit").exists()
+
+    with open(base / grb / "gather_trigdat_complete.yml") as f:
+        assert yaml.safe_load(f)["trigdat_version"] in ["v00", "v02"]
+
+
+def test_watcher_lock(tmp_path, monkeypatch):
+    import fcntl
+    import os
+    import sys
+    import time
+
+    import morgoth.downloaders as downloaders
+
+    monkeypatch.setattr(downloaders, "base_dir", str(tmp_path))
+
+    task = downloaders.WatchTrigdat(grb_name="GRB230514996")
+    lock_file = task._lock_file()
+
+    assert not task.running()
+
+    os.makedirs(os.path.dirname(lock_file))
+
+    # a lock file left by a crashed watcher
+    open(lock_file, "w").close()
+    assert not task.running()
+
+    fd = os.open(lock_file, os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+    downloaders._detach(
+        [sys.executable, "-c", "import time; time.sleep(2)"], pass_fds=(fd,)
+    )
+    os.close(fd)
+
+    # the detached process holds the lock
+    assert task.running()
+    assert task.complete()
+
+    t0 = time.time()
+    while task.running():
+        assert time.time() - t0 < 30
+        time.sleep(0.1)
+
+    assert not task.complete()
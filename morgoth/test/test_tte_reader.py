@@ -0,0 +1,103 @@
+import astropy.io.fits as fits
+import numpy as np
+import pytest
+from threeML.utils.data_builders.fermi.gbm_data import GBMTTEFile
+
+from morgoth.utils.tte_reader import TTEReader, align_window
+
+
+def _write_tte(path, sort=True, seed=0):
+    # a minimal tte file with the header keys and columns of a GBM tte file
+    rng = np.random.default_rng(seed)
+
+    trigtime = 5.0e8
+    times = trigtime + rng.uniform(-30, 300, 50000)
+    if sort:
+        times = np.sort(times)
+    pha = rng.integers(0, 128, len(times))
+
+    primary = fits.PrimaryHDU()
+    for key, value in dict(
+        TRIGTIME=trigtime,
+        TSTART=trigtime - 30,
+        TSTOP=trigtime + 300,
+        INSTRUME="GBM",
+        DETNAM="NAI_00",
+        TELESCOP="GLAST",
+    ).items():
+        primary.header[key] = value
+    primary.header["DATE-OBS"] = "2016-11-05T00:00:00"
+    primary.header["DATE-END"] = "2016-11-05T00:05:30"
+
+    ebounds = fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="CHANNEL", format="I", array=np.arange(128)),
+            fits.Column(name="E_MIN", format="E", array=np.arange(128.0)),
+            fits.Column(name="E_MAX", format="E", array=np.arange(1.0, 129.0)),
+        ],
+        name="EBOUNDS",
+    )
+
+    events = fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="TIME", format="D", array=times),
+            fits.Column(name="PHA", format="I", array=pha),
+        ],
+        name="EVENTS",
+    )
+
+    fits.HDUList([primary, ebounds, events]).writeto(path)
+
+
+@pytest.mark.parametrize("sort", [True, False])
+def test_matches_gbm_tte_file(tmp_path, sort):
+    tte_file = str(tmp_path / "glg_tte_n0_bn000000000_v00.fit")
+    _write_tte(tte_file, sort=sort)
+
+    expected = GBMTTEFile(tte_file)
+
+    with TTEReader(tte_file) as tte:
+        np.testing.assert_array_equal(tte.arrival_times, expected.arrival_times)
+        np.testing.assert_array_equal(tte.energies, expected.energies)
+        np.testing.assert_array_equal(tte.deadtime, expected.deadtime)
+        np.testing.assert_array_equal(
+            tte.relative_arrival_times, expected.arrival_times - expected.trigger_time
+        )
+
+        for name in ["trigger_time", "tstart", "tstop", "n_channels", "det_name", "mission"]:
+            assert getattr(tte, name) == getattr(expected, name)
+
+        if sort:
+            # the events are not copied into memory
+            assert not tte.arrival_times.flags.owndata
+            assert not tte.energies.flags.owndata
+
+
+def test_window(tmp_path):
+    tte_file = str(tmp_path / "glg_tte_n0_bn000000000_v00.fit")
+    _write_tte(tte_file)
+
+    expected = GBMTTEFile(tte_file)
+    relative = expected.arrival_times - expected.trigger_time
+
+    with TTEReader(tte_file, tmin=-10, tmax=100) as tte:
+        mask = (relative >= -10) & (relative <= 100)
+
+        np.testing.assert_array_equal(tte.relative_arrival_times, relative[mask])
+        np.testing.assert_array_equal(tte.energies, expected.energies[mask])
+
+        assert tte.tstart - tte.trigger_time == -10
+        assert tte.tstop - tte.trigger_time == 100
+
+        # the window is clipped to the file
+        tte.set_window(-1000, None)
+
+        assert tte.tstart == expected.tstart
+        assert tte.n_events == len(relative)
+
+
+def test_align_window():
+    # the window is extended to the 1 s bins from the start of the file
+    assert align_window(-10.3, 100.2, -30.5, 300.0, grid=1.0) == (-10.5, 101.5)
+    assert align_window(-10.3, 100.2, -30.5, 300.0) == (-10.3, 100.2)
+    assert align_window(-100, 400, -30.5, 300.0, grid=1.0) == (-30.5, 300.0)
@@ -1,10 +1,12 @@
 import os
+import shutil
 
 import luigi
 import yaml
 
 from morgoth.auto_loc.time_selection import TimeSelection, TimeSelectionBB
 from morgoth.downloaders import GatherTrigdatDownload, DownloadTrigdat
+from morgoth.utils.analysis_cache import AnalysisCache
 
 base_dir = os.environ.get("GBM_TRIGGER_DATA_DIR")
 
@@ -56,18 +58,38 @@ class TimeSelectionHandler(luigi.Task):
 
             trigdat_file = os.path.join(base_dir, self.grb_name, "trigdat", tf_name)
 
-            time_selection = TimeSelectionBB(
-                grb_name=self.grb_name, trigdat_file=trigdat_file, fine=True
+            time_selection_file = os.path.join(
+                base_dir,
+                self.grb_name,
+                self.report_type,
+                f"time_selection_{self.version}.yml",
             )
 
-            time_selection.save_yaml(
-                os.path.join(
-                    base_dir,
-                    self.grb_name,
-                    self.report_type,
-                    f"time_selection_{self.version}.yml",
-                )
+            # a retry or a trigdat file with the same content reuses the selection
+            analysis_cache = AnalysisCache(self.grb_name)
+            key = analysis_cache.key(
+                trigdat_file, **TimeSelectionBB.cache_params(fine=True)
             )
+            cached = analysis_cache.get("time_selection", key)
+
+            if cached is not None:
+                shutil.copy(
+                    os.path.join(cached, "time_selection.yml"), time_selection_file
+                )
+
+            else:
+                time_selection = TimeSelectionBB(
+                    grb_name=self.grb_name,
+                    trigdat_file=trigdat_file,
+                    fine=True,
+                    analysis_cache=analysis_cache,
+                )
+
+                time_selection.save_yaml(time_selection_file)
+
+                analysis_cache.put_files(
+                    "time_selection", key, {"time_selection.yml": time_selection_file}
+                )
         elif self.report_type == "tte":
             for tv in trigdat_versions:
                 try:
@@ -3,7 +3,7 @@ import os
 import luigi
 import yaml
 
-from morgoth.balrog_handlers import ProcessFitResults
+from morgoth.balrog_handlers import ProcessFitResults, ProcessGridResults
 from morgoth.plots import (
     Create3DLocationPlot,
     CreateBalrogSwiftPlot,
@@ -63,6 +63,36 @@ class UploadReport(luigi.Task):
             yaml.dump(report, f, default_flow_style=False)
 
 
+class UploadGridReport(luigi.Task):
+    resources = {"max_workers": 1}
+    grb_name = luigi.Parameter()
+    version = luigi.Parameter(default="v00")
+    priority = 200
+
+    def requires(self):
+        return ProcessGridResults(grb_name=self.grb_name, version=self.version)
+
+    def output(self):
+        filename = f"grid_{self.version}_report.yml"
+        return luigi.LocalTarget(
+            os.path.join(base_dir, self.grb_name, "trigdat", self.version, filename)
+        )
+
+    def run(self):
+        with self.input()["result_file"].open() as f:
+            result = yaml.safe_load(f)
+
+        report = upload_grb_report(
+            grb_name=self.grb_name,
+            result=result,
+            wait_time=float(morgoth_config["upload"]["report"]["interval"]),
+            max_time=float(morgoth_config["upload"]["report"]["max_time"]),
+        )
+
+        with open(self.output().path, "w") as f:
+            yaml.dump(report, f, default_flow_style=False)
+
+
 class UploadAllDataFiles(luigi.Task):
     resources = {"max_workers": 1}
     grb_name = luigi.Parameter()
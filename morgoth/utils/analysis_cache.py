@@ -0,0 +1,371 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import morgoth.utils.file_utils as file_utils
+from morgoth.configuration import morgoth_config
+from morgoth.utils.env import get_env_value
+from morgoth.utils.response_cache import file_hash
+
+_arrays_file = "arrays.npz"
+
+# part of every key, increase it when the format of the entries changes
+cache_version = 1
+
+# (path, mtime, size) -> hash, so every input file is hashed only once
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+# the caches of all bursts are walked at most once per interval in seconds
+# by every process, the time of the last walk of every data dir
+eviction_interval = 600.0
+_last_eviction = {}
+_eviction_lock = threading.Lock()
+
+
+def _file_hash(file_name):
+    stat = os.stat(file_name)
+    file_id = (os.path.abspath(file_name), stat.st_mtime, stat.st_size)
+
+    with _hashes_lock:
+        if file_id not in _hashes:
+            _hashes[file_id] = file_hash(file_name)
+
+        return _hashes[file_id]
+
+
+def _update_with_param(h, value):
+    """
+    Add a parameter to a hash, arrays are hashed by their content
+
+    :param h: the hashlib object
+    :param value: the parameter
+    :returns:
+    :rtype:
+
+    """
+    if isinstance(value, np.ndarray):
+        h.update(str(value.dtype).encode())
+        h.update(str(value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for v in value:
+            _update_with_param(h, v)
+            h.update(b",")
+        h.update(b"]")
+
+    elif isinstance(value, dict):
+        h.update(json.dumps(value, sort_keys=True, default=str).encode())
+
+    else:
+        h.update(repr(value).encode())
+
+
+def input_key(*files, **params):
+    """
+    Hash of the content of the input files and the parameters
+
+    :param files: paths of the input files
+    :param params: parameters, arrays are hashed by their content
+    :returns: the key
+    :rtype: str
+
+    """
+    h = hashlib.sha256()
+
+    h.update(f"v{cache_version}".encode())
+
+    for f in files:
+        h.update(_file_hash(f).encode())
+
+    for name in sorted(params):
+        h.update(name.encode())
+        _update_with_param(h, params[name])
+
+    return h.hexdigest()[:32]
+
+
+def _entry_size(path):
+    size = 0
+
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+
+    return size
+
+
+def evict(data_dir, max_size):
+    """
+    Delete the least recently used cache entries of all bursts
+    until the caches together are smaller than max_size
+
+    :param data_dir: the GBM_TRIGGER_DATA_DIR with one folder per burst
+    :param max_size: the max size of all caches in bytes
+    :returns: list of the deleted entries
+    :rtype: list
+
+    """
+    entries = []
+
+    if not os.path.isdir(data_dir):
+        return []
+
+    for grb in os.listdir(data_dir):
+        cache_dir = os.path.join(data_dir, grb, "cache")
+
+        if not os.path.isdir(cache_dir):
+            continue
+
+        for stage in os.listdir(cache_dir):
+            stage_dir = os.path.join(cache_dir, stage)
+
+            if not os.path.isdir(stage_dir):
+                continue
+
+            for key in os.listdir(stage_dir):
+                # entries that are still written
+                if key.startswith("."):
+                    continue
+
+                path = os.path.join(stage_dir, key)
+
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+
+                entries.append((mtime, path, _entry_size(path)))
+
+    total = sum(e[2] for e in entries)
+
+    deleted = []
+
+    # oldest first
+    for mtime, path, size in sorted(entries):
+        if total <= max_size:
+            break
+
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        deleted.append(path)
+
+    return deleted
+
+
+class AnalysisCache(object):
+    def __init__(self, grb_name, data_dir=None, max_size_gb=None, enabled=None):
+        """
+        Content addressed cache for the intermediate results of the analysis
+        of one burst. Every stage stores its results under a key built from
+        the hashes of its input files and its parameters, so a retried task or
+        a task that gets the same inputs again can skip the work.
+
+        The cache lives in GBM_TRIGGER_DATA_DIR/<grb>/cache/<stage>/<key>, the
+        least recently used entries of all bursts are deleted when the caches
+        together get larger than cache.max_size_gb of the config. The eviction
+        walks the caches of all bursts, so a process only runs it after a new
+        entry if the last walk is more than eviction_interval seconds ago.
+
+        :param grb_name: the name of the burst
+        :param data_dir: the directory with the bursts, default is GBM_TRIGGER_DATA_DIR,
+        which has to be set then
+        :param max_size_gb: the max size of the caches of all bursts, default from the config
+        :param enabled: use the cache, default from the config
+        :returns:
+        :rtype:
+
+        """
+        if data_dir is None:
+            data_dir = get_env_value("GBM_TRIGGER_DATA_DIR")
+
+        if max_size_gb is None:
+            max_size_gb = morgoth_config["cache"]["max_size_gb"]
+
+        if enabled is None:
+            enabled = morgoth_config["cache"]["enabled"]
+
+        self._data_dir = data_dir
+        self._cache_dir = os.path.join(data_dir, grb_name, "cache")
+        self._max_size = float(max_size_gb) * 1024 ** 3
+        self._enabled = bool(enabled)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def key(self, *files, **params):
+        """
+        The key of an entry: hash of the content of the input files and the parameters
+
+        :param files: paths of the input files
+        :param params: parameters of the stage, arrays are hashed by their content
+        :returns: the key
+        :rtype: str
+
+        """
+        return input_key(*files, **params)
+
+    def _entry_path(self, stage, key):
+        return os.path.join(self._cache_dir, stage, key)
+
+    def get(self, stage, key):
+        """
+        Get the directory of an entry
+
+        :param stage: the name of the stage
+        :param key: the key of the entry
+        :returns: the directory of the entry or None if it is not cached
+        :rtype: str
+
+        """
+        if not self._enabled:
+            return None
+
+        path = self._entry_path(stage, key)
+
+        if not os.path.isdir(path):
+            return None
+
+        # mark as recently used for the eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return path
+
+    def load_arrays(self, stage, key):
+        """
+        Load the arrays of an entry
+
+        :param stage: the name of the stage
+        :param key: the key of the entry
+        :returns: dict with the arrays or None if it is not cached
+        :rtype: dict
+
+        """
+        path = self.get(stage, key)
+
+        if path is None:
+            return None
+
+        try:
+            with np.load(os.path.join(path, _arrays_file), allow_pickle=False) as data:
+                return {name: data[name] for name in data.files}
+
+        except Exception as e:
+            print(f"Could not read the cache entry {path}: {e}")
+            return None
+
+    def put_arrays(self, stage, key, **arrays):
+        """
+        Store arrays in an entry
+
+        :param stage: the name of the stage
+        :param key: the key of the entry
+        :param arrays: the arrays to store
+        :returns: the directory of the entry
+        :rtype: str
+
+        """
+        return self._put(
+            stage,
+            key,
+            lambda tmp: np.savez(os.path.join(tmp, _arrays_file), **arrays),
+        )
+
+    def put_files(self, stage, key, files):
+        """
+        Store copies of files in an entry
+
+        :param stage: the name of the stage
+        :param key: the key of the entry
+        :param files: dict with the names in the entry and the paths of the files
+        :returns: the directory of the entry
+        :rtype: str
+
+        """
+
+        def copy_files(tmp):
+            for name, path in files.items():
+                shutil.copy2(path, os.path.join(tmp, name))
+
+        return self._put(stage, key, copy_files)
+
+    def _put(self, stage, key, fill):
+        """
+        Write an entry into a temporary directory and rename it when
+        it is complete, so nobody ever reads a partial entry
+
+        :param stage: the name of the stage
+        :param key: the key of the entry
+        :param fill: function that writes the entry into the given directory
+        :returns: the directory of the entry
+        :rtype: str
+
+        """
+        if not self._enabled:
+            return None
+
+        path = self._entry_path(stage, key)
+        tmp = os.path.join(self._cache_dir, stage, f".{key}.{os.getpid()}.tmp")
+
+        try:
+            file_utils.if_directory_not_existing_then_make(tmp)
+
+            fill(tmp)
+
+            os.rename(tmp, path)
+
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+            if not os.path.isdir(path):
+                print(f"Could not store the cache entry {path}")
+                return None
+
+        except Exception as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            print(f"Could not store the cache entry {path}: {e}")
+            return None
+
+        self._evict()
+
+        return path
+
+    def _evict(self):
+        """
+        Run the eviction if this process did not walk the caches within the
+        last eviction_interval seconds
+
+        :returns:
+        :rtype:
+
+        """
+        now = time.monotonic()
+
+        with _eviction_lock:
+            last = _last_eviction.get(self._data_dir)
+
+            if last is not None and now - last < eviction_interval:
+                return
+
+            _last_eviction[self._data_dir] = now
+
+        evict(self._data_dir, self._max_size)
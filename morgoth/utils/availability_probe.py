@@ -0,0 +1,152 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def make_session(pool_size=32):
+    """
+    Create a requests session with a keep-alive connection pool
+    large enough to probe all files of a burst in parallel
+
+    :param pool_size: number of connections kept alive per host
+    :returns: the session
+    :rtype: requests.Session
+
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+class AvailabilityProbe(object):
+    def __init__(
+        self,
+        urls,
+        min_wait=2,
+        max_wait=30,
+        backoff_factor=1.5,
+        max_time=None,
+        max_workers=28,
+        timeout=10,
+        session=None,
+    ):
+        """
+        Probes a set of URLs concurrently with HEAD requests until all of them
+        are available. Between sweeps that did not find anything new it waits
+        with an adaptive backoff, that is reset as soon as a new file shows up.
+
+        :param urls: the URLs to probe
+        :param min_wait: the shortest wait between two sweeps
+        :param max_wait: the longest wait between two sweeps
+        :param backoff_factor: factor to increase the wait after an empty sweep
+        :param max_time: the max time to wait for all files. None waits forever
+        :param max_workers: number of threads probing in parallel
+        :param timeout: timeout of a single request
+        :param session: an optional requests session to reuse
+        :returns:
+        :rtype:
+
+        """
+        self._urls = list(urls)
+        self._min_wait = min_wait
+        self._max_wait = max_wait
+        self._backoff_factor = backoff_factor
+        self._max_time = max_time
+        self._max_workers = max_workers
+        self._timeout = timeout
+
+        if session is None:
+            session = make_session(pool_size=max_workers)
+
+        self._session = session
+
+        # url -> seconds after the start of the probe when it was found
+        self._found = {}
+        self._n_sweeps = 0
+
+    @property
+    def found(self):
+        return self._found
+
+    @property
+    def missing(self):
+        return [url for url in self._urls if url not in self._found]
+
+    @property
+    def n_sweeps(self):
+        return self._n_sweeps
+
+    def _is_available(self, url):
+        try:
+            response = self._session.head(
+                url, timeout=self._timeout, allow_redirects=True
+            )
+        except requests.RequestException:
+            return False
+
+        return response.status_code == 200
+
+    def sweep(self, pool, start):
+        """
+        Probe all missing URLs once in parallel
+
+        :param pool: the thread pool
+        :param start: the start time of the probe
+        :returns: list of the newly found URLs
+        :rtype: list
+
+        """
+        missing = self.missing
+
+        available = pool.map(self._is_available, missing)
+
+        self._n_sweeps += 1
+
+        new = []
+
+        for url, is_available in zip(missing, available):
+            if is_available:
+                self._found[url] = time.time() - start
+                new.append(url)
+
+        return new
+
+    def run(self):
+        """
+        Probe until all URLs are available
+
+        :returns: dict of the URLs and the time it took until they were found
+        :rtype: dict
+
+        """
+        start = time.time()
+        wait = self._min_wait
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            while True:
+                new = self.sweep(pool, start)
+
+                if len(self.missing) == 0:
+                    break
+
+                if new:
+                    wait = self._min_wait
+                else:
+                    wait = min(wait * self._backoff_factor, self._max_wait)
+
+                if (
+                    self._max_time is not None
+                    and time.time() - start + wait > self._max_time
+                ):
+                    raise AssertionError(
+                        f"{len(self.missing)} files not found in {self._max_time} seconds"
+                    )
+
+                time.sleep(wait)
+
+        return self._found
@@ -1,49 +1,160 @@
+import hashlib
 import os
-import shutil
 import time
 
-import astropy.utils.data as astro_data
+import requests
 
 import morgoth.utils.file_utils as file_utils
+from morgoth.configuration import morgoth_config
+from morgoth.utils.availability_probe import make_session
 
+# one keep-alive session shared by all downloads of this process
+_session = None
 
-def download_file(url, path="/tmp"):
+
+def get_session():
+    """
+    The requests session that is shared by all downloads
+
+    :returns: the session
+    :rtype: requests.Session
+
+    """
+    global _session
+
+    if _session is None:
+        _session = make_session()
+
+    return _session
+
+
+class FileNotAvailable(Exception):
+    pass
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def download_file(
+    url,
+    path="/tmp",
+    chunk_size=None,
+    checksum=None,
+    hash_name="sha256",
+    timeout=30,
+    session=None,
+):
     """
-    Download a file to the given path
+    Download a file to the given path. The file is streamed in chunks
+    into a .part file next to the destination and renamed when it is
+    complete, so nobody ever sees a partial file. If a .part file of an
+    earlier attempt exists, the download resumes with a HTTP Range request.
+
+    :param url: the URL of the file
+    :param path: the directory to store the file in
+    :param chunk_size: bytes per chunk, default from the config
+    :param checksum: optional hex digest the file has to match
+    :param hash_name: the hashlib algorithm of the checksum
+    :param timeout: timeout of the connection
+    :param session: optional requests session, default is the shared one
+    :returns: path of the downloaded file
+    :rtype: str
+
     """
+    if chunk_size is None:
+        chunk_size = int(morgoth_config["download"]["chunk_size"])
+
+    if session is None:
+        session = get_session()
+
+    file_utils.if_directory_not_existing_then_make(path)
 
     fname = url.split("/")[-1]
-    f = astro_data.download_file(url)
+    destination = os.path.join(path, fname)
+    part = f"{destination}.part"
+
+    resume_from = os.path.getsize(part) if os.path.exists(part) else 0
+
+    headers = {}
+    if resume_from > 0:
+        headers["Range"] = f"bytes={resume_from}-"
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 404:
+            raise FileNotAvailable(f"{url} is not available (yet?)")
+
+        if response.status_code == 416:
+            # the .part file does not fit to the file on the server
+            os.remove(part)
+            raise requests.HTTPError(f"Can not resume {url}", response=response)
 
-    return f
+        response.raise_for_status()
+
+        # the server ignored the range request and sends the full file
+        mode = "ab" if response.status_code == 206 else "wb"
+
+        with open(part, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+    if checksum is not None:
+        h = hashlib.new(hash_name)
+
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+
+        if h.hexdigest() != checksum:
+            os.remove(part)
+            raise ChecksumError(f"Checksum of {fname} does not match")
+
+    os.replace(part, destination)
+
+    return destination
 
 
 class BackgroundDownload(object):
     def __init__(
-        self, url, store_path=None, wait_time=60, max_time=60 * 60,
+        self,
+        url,
+        store_path=None,
+        wait_time=60,
+        max_time=60 * 60,
+        retry_wait=1,
+        chunk_size=None,
+        checksum=None,
+        hash_name="sha256",
     ):
         """
         An worker to download objects in the background to avoid blocking the GCN
         listen function.
 
-        If a bot is specfied, it will upload an the image with the bot.
-
+        A file that is not on the server yet is checked again after wait_time,
+        a failed transfer (connection error, timeout, server error) is retried
+        after retry_wait and resumes where it stopped.
 
         :param url: The URL to download the file
-        :param bot: the optional bot
-        :param description: the description for the bot's plot
+        :param store_path: the directory to store the file in
         :param wait_time: the wait time interval for checking files
         :param max_time: the max time to wait for files
-        :returns: 
-        :rtype: 
+        :param retry_wait: the wait time before a failed transfer is retried
+        :param chunk_size: bytes per chunk, default from the config
+        :param checksum: optional hex digest the file has to match
+        :param hash_name: the hashlib algorithm of the checksum
+        :returns:
+        :rtype:
 
         """
 
         self._wait_time = wait_time
         self._max_time = max_time
+        self._retry_wait = min(retry_wait, wait_time)
 
         self._url = url
-        self._store_file = True
+        self._chunk_size = chunk_size
+        self._checksum = checksum
+        self._hash_name = hash_name
 
         # get the file name  at the end
         self._file_name = url.split("/")[-1]
@@ -52,55 +163,45 @@ class BackgroundDownload(object):
 
     def run(self):
 
-        # set a flag to kill the job
-
-        flag = True
-
         # the time spent waiting so far
         time_spent = 0  # seconds
 
-        while flag:
+        while True:
 
             # try to download the file
             try:
 
-                path = download_file(self._url)
+                return download_file(
+                    self._url,
+                    self._store_path,
+                    chunk_size=self._chunk_size,
+                    checksum=self._checksum,
+                    hash_name=self._hash_name,
+                )
 
-                # create the directory
-
-                file_utils.if_directory_not_existing_then_make(self._store_path)
-
-                # move the file
-
-                shutil.move(path, os.path.join(self._store_path, self._file_name))
-
-                # kill the loop
-
-                flag = False
-
-            except:
+            except FileNotAvailable:
 
                 # ok, we have not found a file yet
+                wait = self._wait_time
 
-                # see if we should still wait for the file
-
-                if time_spent >= self._max_time:
-
-                    # we are out of time so give up
-
-                    break
+            except (requests.RequestException, ChecksumError) as e:
 
-                else:
+                # the file is there but the transfer failed
+                print(f"Download of {self._file_name} failed, retrying: {e}")
+                wait = self._retry_wait
 
-                    # ok, let's sleep for a bit and then check again
+            # see if we should still wait for the file
+            if time_spent >= self._max_time:
 
-                    time.sleep(self._wait_time)
+                # we are out of time so give up
+                break
 
-                    # up date the time we have left
+            # ok, let's sleep for a bit and then check again
+            time.sleep(wait)
 
-                    time_spent += self._wait_time
+            # up date the time we have left
+            time_spent += wait
 
-        if flag:
-            raise AssertionError(f"File not found in {self._max_time} seconds. Maybe try a newer version?")
-        
-        return path
+        raise AssertionError(
+            f"File not found in {self._max_time} seconds. Maybe try a newer version?"
+        )
@@ -0,0 +1,306 @@
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+
+def events_file_path(data_dir, grb_name, report_type, version):
+    """
+    Path of the JSON lines file with the instrumentation events of a fit
+
+    :param data_dir: the GBM_TRIGGER_DATA_DIR
+    :param grb_name: the name of the burst
+    :param report_type: trigdat or tte
+    :param version: the version of the data
+    :returns: path of the events file
+    :rtype: str
+
+    """
+    return os.path.join(
+        data_dir,
+        grb_name,
+        report_type,
+        version,
+        f"{report_type}_{version}_fit_events.jsonl",
+    )
+
+
+class FitInstrumentation(object):
+    def __init__(self, events_file, run_info, rank=0, interval=30):
+        """
+        Instrumentation of a MultiNest run. Every rank counts its likelihood
+        evaluations and writes the count to its own small file, rank 0 writes
+        a JSON line with the state of the whole run to the events file every
+        interval seconds. The evidence state comes from the MultiNest dumper,
+        the rates from the counts of all ranks.
+
+        :param events_file: the JSON lines file of the run
+        :param run_info: dict with the description of the run that is added to
+        every event, e.g. grb, report type, version and the used detectors
+        :param rank: MPI rank of this process
+        :param interval: seconds between two events
+        :returns:
+        :rtype:
+
+        """
+        self._events_file = events_file
+        self._run_info = run_info
+        self._rank = rank
+        self._interval = interval
+
+        self._n_like = 0
+        self._like_time = 0.0
+
+        self._start = time.time()
+        self._last_write = time.monotonic()
+        self._last_n_like_total = 0
+        self._last_event_time = self._start
+
+        self._evidence = {}
+
+        if self._rank == 0:
+            if not os.path.exists(os.path.dirname(os.path.abspath(events_file))):
+                os.makedirs(os.path.dirname(os.path.abspath(events_file)))
+
+            # the counts of an old run
+            for f in glob.glob(f"{events_file}.rank*"):
+                os.remove(f)
+
+            self._write_event("start")
+
+    def attach(self, sampler):
+        """
+        Count the likelihood evaluations of a 3ML sampler
+
+        :param sampler: the sampler of the BayesianAnalysis
+        :returns:
+        :rtype:
+
+        """
+        log_like = sampler._log_like
+
+        def counting_log_like(trial_values):
+            t0 = time.perf_counter()
+
+            value = log_like(trial_values)
+
+            self._like_time += time.perf_counter() - t0
+            self._n_like += 1
+
+            if time.monotonic() - self._last_write >= self._interval:
+                self._last_write = time.monotonic()
+                self._write_rank_counts()
+
+                if self._rank == 0:
+                    self._write_event("progress")
+
+            return value
+
+        sampler._log_like = counting_log_like
+
+    def dump_callback(
+        self,
+        n_samples,
+        n_live,
+        n_params,
+        live_points,
+        posterior,
+        constraints,
+        max_log_like,
+        log_z,
+        ins_log_z,
+        log_z_err,
+        *args,
+    ):
+        """
+        The dump_callback of pymultinest, called on rank 0 every
+        n_iter_before_update iterations
+        """
+        # the evidence that is left in the prior volume of the live points
+        log_volume = -n_samples / n_live
+        log_z_live = float(np.max(live_points[:, -1])) + log_volume
+
+        self._evidence = dict(
+            n_samples=int(n_samples),
+            n_live=int(n_live),
+            log_z=float(log_z),
+            log_z_err=float(log_z_err),
+            max_log_like=float(max_log_like),
+            log_volume=float(log_volume),
+            delta_log_z=float(np.logaddexp(log_z, log_z_live) - log_z),
+        )
+
+    def finish(self):
+        """
+        Write the final counts and the end event
+        """
+        self._write_rank_counts()
+
+        if self._rank == 0:
+            self._write_event("end")
+
+    def _write_rank_counts(self):
+        tmp = f"{self._events_file}.rank{self._rank}.tmp"
+
+        with open(tmp, "w") as f:
+            json.dump(dict(n_like=self._n_like, like_time=self._like_time), f)
+
+        os.replace(tmp, f"{self._events_file}.rank{self._rank}")
+
+    def _rank_counts(self):
+        counts = {}
+
+        for f in glob.glob(f"{self._events_file}.rank*"):
+            if f.endswith(".tmp"):
+                continue
+
+            rank = int(f.rsplit(".rank", 1)[1])
+
+            try:
+                with open(f, "r") as g:
+                    counts[rank] = json.load(g)["n_like"]
+
+            except (OSError, ValueError, KeyError):
+                continue
+
+        # this rank is always up to date
+        counts[self._rank] = self._n_like
+
+        return counts
+
+    def _write_event(self, event):
+        now = time.time()
+
+        rank_counts = self._rank_counts()
+        n_like = sum(rank_counts.values())
+
+        record = dict(self._run_info)
+        record.update(
+            event=event,
+            time=now,
+            elapsed=now - self._start,
+            n_like=n_like,
+            like_rate=(n_like - self._last_n_like_total)
+            / max(now - self._last_event_time, 1e-9),
+            rank_n_like={str(rank): n for rank, n in sorted(rank_counts.items())},
+        )
+        record.update(self._evidence)
+
+        if "n_samples" in self._evidence and n_like > 0:
+            record["efficiency"] = self._evidence["n_samples"] / n_like
+
+        self._last_n_like_total = n_like
+        self._last_event_time = now
+
+        with open(self._events_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def read_events(events_file):
+    """
+    Read the events of a run, a line that is still written is skipped
+
+    :param events_file: the JSON lines file of the run
+    :returns: list of the events
+    :rtype: list
+
+    """
+    events = []
+
+    try:
+        with open(events_file, "r") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+
+                except ValueError:
+                    continue
+
+    except OSError:
+        pass
+
+    return events
+
+
+def status_message(event):
+    """
+    Short message with the state of the run in an event
+
+    :param event: an event of the run
+    :returns: the message
+    :rtype: str
+
+    """
+    message = f"MultiNest {event['event']}: {event['n_like']} likelihood evaluations"
+
+    message += f", {event['like_rate']:.0f}/s"
+
+    if "n_samples" in event:
+        message += (
+            f", {event['n_samples']} samples, efficiency {event['efficiency']:.3f}"
+            f", ln(Z) = {event['log_z']:.2f}, remaining {event['delta_log_z']:.2f}"
+        )
+
+    return message
+
+
+# name, help and key in the events of the gauges of the text file
+_metrics = [
+    ("likelihood_evaluations", "Likelihood evaluations of all ranks", "n_like"),
+    ("likelihood_rate", "Likelihood evaluations per second", "like_rate"),
+    ("samples", "Dead points of the run", "n_samples"),
+    ("efficiency", "Samples per likelihood evaluation", "efficiency"),
+    ("log_evidence", "ln(Z) of the dead points", "log_z"),
+    ("delta_log_evidence", "ln(Z) that is left in the live points", "delta_log_z"),
+    ("elapsed_seconds", "Time since the start of the run", "elapsed"),
+]
+
+
+def write_prometheus(event, prom_file):
+    """
+    Write the state of the run in an event as Prometheus text file, e.g. for the
+    text file collector of the node exporter
+
+    :param event: an event of the run
+    :param prom_file: the text file, it is replaced atomically
+    :returns:
+    :rtype:
+
+    """
+    labels = ",".join(
+        f'{key}="{event[key]}"'
+        for key in ["grb", "report_type", "version"]
+        if key in event
+    )
+
+    lines = []
+
+    for name, description, key in _metrics:
+        if key not in event:
+            continue
+
+        lines.append(f"# HELP morgoth_multinest_{name} {description}")
+        lines.append(f"# TYPE morgoth_multinest_{name} gauge")
+        lines.append(f"morgoth_multinest_{name}{{{labels}}} {event[key]}")
+
+    lines.append(
+        "# HELP morgoth_multinest_rank_likelihood_evaluations "
+        "Likelihood evaluations of every rank"
+    )
+    lines.append("# TYPE morgoth_multinest_rank_likelihood_evaluations gauge")
+
+    for rank, n_like in event["rank_n_like"].items():
+        rank_labels = ",".join(filter(None, [labels, f'rank="{rank}"']))
+
+        lines.append(
+            f"morgoth_multinest_rank_likelihood_evaluations{{{rank_labels}}} {n_like}"
+        )
+
+    tmp = f"{prom_file}.tmp"
+
+    with open(tmp, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    os.replace(tmp, prom_file)
@@ -0,0 +1,164 @@
+import numpy as np
+
+
+def covered_by(tstart, tstop, mid_points):
+    """
+    Check for every interval if one of the mid points lies inside of it
+
+    :param tstart: start times of the intervals
+    :param tstop: stop times of the intervals
+    :param mid_points: the mid points of the finer bins
+    :returns: boolean array, True if the interval contains a mid point
+    :rtype: np.ndarray
+
+    """
+    mid_points = np.sort(mid_points)
+
+    # number of mid points with tstart < x < tstop
+    first = np.searchsorted(mid_points, tstart, side="right")
+    last = np.searchsorted(mid_points, tstop, side="left")
+
+    return last > first
+
+
+def prune_trigdat_bins(tstart, tstop, fine=False, delta=None):
+    """
+    Get the indices of the trigdat bins that should be used. A bin is
+    dumped if a bin of the next finer resolution lies inside of it.
+    This routine is modeled off the procedure in RMFIT.
+
+    :param tstart: start times of the trigdat bins
+    :param tstop: stop times of the trigdat bins
+    :param fine: use the fine resolution data
+    :param delta: optional bin widths used to sort the bins into the
+    resolutions, default is tstop - tstart
+    :returns: the sorted indices of the bins to keep
+    :rtype: np.ndarray
+
+    """
+    if delta is None:
+        delta = tstop - tstart
+
+    def mid(mask):
+        return (tstart[mask] + tstop[mask]) / 2.0
+
+    if fine:
+
+        # masks for all the different delta times
+        temp1 = delta < 0.1
+        temp2 = np.logical_and(delta > 0.1, delta < 1.0)
+        temp3 = np.logical_and(delta > 1.0, delta < 2.0)
+        temp4 = delta > 2.0
+
+        keep = np.ones(len(tstart), dtype=bool)
+
+        for coarse, finer in ((temp2, temp1), (temp3, temp2), (temp4, temp3)):
+            keep[coarse] &= ~covered_by(tstart[coarse], tstop[coarse], mid(finer))
+
+    else:
+
+        # Just deal with the first level of fine data
+        temp1 = np.logical_and(delta > 1.0, delta < 2.0)
+        temp2 = delta > 2.0
+
+        keep = delta > 1.0
+        keep[temp2] &= ~covered_by(tstart[temp2], tstop[temp2], mid(temp1))
+
+    return np.flatnonzero(keep)
+
+
+def runs(mask):
+    """
+    Run length encoding of a boolean mask
+
+    :param mask: the boolean mask
+    :returns: start indices and lengths of the runs of True values
+    :rtype: tuple
+
+    """
+    mask = np.asarray(mask, dtype=bool)
+
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+
+    return starts, stops - starts
+
+
+def drop_short_runs(mask, min_length=2):
+    """
+    Set all runs of True values that are shorter than min_length to False
+
+    :param mask: the boolean mask
+    :param min_length: the min length of a run that is kept
+    :returns: the new mask
+    :rtype: np.ndarray
+
+    """
+    starts, lengths = runs(mask)
+
+    keep = lengths >= min_length
+
+    # +1 at the start and -1 after the end of every kept run
+    edges = np.zeros(len(mask) + 1, dtype=int)
+    np.add.at(edges, starts[keep], 1)
+    np.add.at(edges, starts[keep] + lengths[keep], -1)
+
+    return np.cumsum(edges[:-1]) > 0
+
+
+def gaps(tstart, tstop, min_gap=0.1):
+    """
+    The gaps between consecutive time bins
+
+    :param tstart: start times of the bins
+    :param tstop: stop times of the bins
+    :param min_gap: only gaps longer than this are returned
+    :returns: start and stop times of the gaps
+    :rtype: tuple
+
+    """
+    is_gap = tstart[1:] > tstop[:-1] + min_gap
+
+    return tstop[:-1][is_gap], tstart[1:][is_gap]
+
+
+def merge_intervals(tstart, tstop, max_gap=0.2):
+    """
+    Merge consecutive intervals that are separated by less than max_gap.
+    A merged interval ends at the stop of the last interval merged into it.
+
+    :param tstart: start times of the intervals
+    :param tstop: stop times of the intervals
+    :param max_gap: the max separation of intervals that are merged
+    :returns: start and stop times of the merged intervals
+    :rtype: tuple
+
+    """
+    if len(tstart) == 0:
+        return tstart, tstop
+
+    # a new interval starts where the gap to the previous one is large enough
+    new = np.logical_not(tstart[1:] - tstop[:-1] < max_gap)
+
+    first = np.concatenate(([0], np.flatnonzero(new) + 1))
+    last = np.concatenate((first[1:] - 1, [len(tstart) - 1]))
+
+    return tstart[first], tstop[last]
+
+
+def min_length(tstart, tstop, length=2):
+    """
+    Drop the intervals that are shorter than length
+
+    :param tstart: start times of the intervals
+    :param tstop: stop times of the intervals
+    :param length: the min length
+    :returns: start and stop times of the remaining intervals
+    :rtype: tuple
+
+    """
+    keep = np.logical_not(tstop - tstart < length)
+
+    return tstart[keep], tstop[keep]
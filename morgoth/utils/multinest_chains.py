@@ -0,0 +1,186 @@
+import os
+import shutil
+import threading
+
+import yaml
+
+from morgoth.utils.fit_events import read_events, status_message, write_prometheus
+
+# file in the chains dir with the key of the inputs of the run
+_inputs_file = "chain_inputs.yml"
+
+
+def resume_file(chain_path):
+    """
+    The file MultiNest writes every n_iter_before_update iterations to resume from
+
+    :param chain_path: the outputfiles_basename of the MultiNest run
+    :returns: path of the resume file
+    :rtype: str
+
+    """
+    return f"{chain_path}resume.dat"
+
+
+def prepare_chains_dir(chains_dir, chain_path, key, resume=True):
+    """
+    Prepare the chains dir of a MultiNest run. A partial run in the dir is kept
+    if it was started with the same inputs, otherwise the dir is cleared so
+    MultiNest does not resume from the chains of other data or another model.
+
+    :param chains_dir: the chains dir
+    :param chain_path: the outputfiles_basename of the MultiNest run in the dir
+    :param key: key of the inputs of the run, see analysis_cache.input_key
+    :param resume: resume a partial run, if False the dir is always cleared
+    :returns: if MultiNest can resume from the dir
+    :rtype: bool
+
+    """
+    inputs_file = os.path.join(chains_dir, _inputs_file)
+
+    can_resume = False
+
+    if resume and os.path.exists(resume_file(chain_path)):
+        try:
+            with open(inputs_file, "r") as f:
+                can_resume = yaml.safe_load(f)["key"] == key
+
+        except (OSError, TypeError, KeyError, yaml.YAMLError):
+            can_resume = False
+
+    if can_resume:
+        progress = chain_progress(chain_path)
+
+        print(
+            f"Resume the MultiNest run in {chains_dir} "
+            f"after {progress['n_samples']} samples"
+        )
+
+        return True
+
+    if os.path.exists(chains_dir):
+        print(f"Start a new MultiNest run in {chains_dir}, removing the old chains")
+        shutil.rmtree(chains_dir)
+
+    os.makedirs(chains_dir)
+
+    with open(inputs_file, "w") as f:
+        yaml.dump(dict(key=key), f, default_flow_style=False)
+
+    return False
+
+
+def chain_progress(chain_path, n_live_points=None):
+    """
+    Progress of a MultiNest run from its output files. Every iteration replaces
+    the worst live point, which is written to the ev.dat file, and shrinks the
+    prior volume by about exp(-1/n_live_points).
+
+    :param chain_path: the outputfiles_basename of the MultiNest run
+    :param n_live_points: number of live points, to estimate the prior volume
+    :returns: dict with the number of samples and the log of the prior volume
+    :rtype: dict
+
+    """
+    n_samples = 0
+
+    try:
+        with open(f"{chain_path}ev.dat", "rb") as f:
+            for _ in f:
+                n_samples += 1
+
+    except OSError:
+        pass
+
+    progress = dict(n_samples=n_samples)
+
+    if n_live_points is not None:
+        progress["log_volume"] = -n_samples / n_live_points
+
+    return progress
+
+
+class ChainProgressMonitor(threading.Thread):
+    def __init__(
+        self,
+        chain_path,
+        callback,
+        n_live_points=None,
+        interval=60,
+        events_file=None,
+        prom_file=None,
+    ):
+        """
+        Thread that reports the progress of a MultiNest run, that is running in
+        another process, every interval seconds while it is used as context manager.
+        If the run writes an events file, the last event is reported and written
+        to the Prometheus text file, otherwise the progress is read from the chains.
+
+        :param chain_path: the outputfiles_basename of the MultiNest run
+        :param callback: called with a message when the progress changed
+        :param n_live_points: number of live points, to estimate the prior volume
+        :param interval: seconds between two checks
+        :param events_file: optional JSON lines file of the FitInstrumentation of the run
+        :param prom_file: optional Prometheus text file for the last event
+        :returns:
+        :rtype:
+
+        """
+        super().__init__(daemon=True)
+
+        self._chain_path = chain_path
+        self._callback = callback
+        self._n_live_points = n_live_points
+        self._interval = interval
+        self._events_file = events_file
+        self._prom_file = prom_file
+
+        self._stop_event = threading.Event()
+        self._last = None
+
+    def message(self):
+        """
+        Message with the current progress
+
+        :returns: the message
+        :rtype: str
+
+        """
+        events = read_events(self._events_file) if self._events_file else []
+
+        if events:
+            if self._prom_file is not None:
+                write_prometheus(events[-1], self._prom_file)
+
+            return status_message(events[-1])
+
+        progress = chain_progress(self._chain_path, self._n_live_points)
+
+        message = f"MultiNest: {progress['n_samples']} samples"
+
+        if "log_volume" in progress:
+            message += f", ln(X) = {progress['log_volume']:.2f}"
+
+        return message
+
+    def check(self):
+        message = self.message()
+
+        if message != self._last:
+            self._last = message
+            self._callback(message)
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self.check()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop_event.set()
+        self.join()
+
+        # the final state of the run
+        self.check()
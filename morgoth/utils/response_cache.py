@@ -0,0 +1,362 @@
+import collections
+import copy
+import hashlib
+import os
+import pickle
+import threading
+
+import numpy as np
+from gbm_drm_gen.basersp_numba import get_database, get_trigdat_precalc_database
+from gbm_drm_gen.drmgen import lu
+
+import morgoth.utils.file_utils as file_utils
+from morgoth.configuration import morgoth_config
+
+# the detector databases of gbm_drm_gen loaded by this process
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def file_hash(file_name, chunk_size=1048576):
+    """
+    sha256 of the content of a file
+
+    :param file_name: path of the file
+    :param chunk_size: bytes read at once
+    :returns: hex digest
+    :rtype: str
+
+    """
+    h = hashlib.sha256()
+
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _shared_databases(response):
+    """
+    The detector databases of the generator of a response. They are read
+    from the data files of gbm_drm_gen and keep their closed h5py groups,
+    so they can neither be copied nor pickled. They never change, so all
+    responses share them and only their names are stored.
+
+    :param response: the response
+    :returns: dict of id of the database -> (database, name of the database)
+    :rtype: dict
+
+    """
+    drm_gen = getattr(response, "_drm_generator", None)
+
+    if drm_gen is None:
+        return {}
+
+    det = lu[drm_gen._det_number]
+
+    # the generator loads a dummy database if it has no trigdat mask
+    mask = drm_gen._trigdat_mask if drm_gen._trigdat_mask is not None else [0]
+
+    return {
+        id(drm_gen._database_nb): (drm_gen._database_nb, ("database", det)),
+        id(drm_gen._database_precalc_trigdat): (
+            drm_gen._database_precalc_trigdat,
+            ("trigdat_precalc", det, tuple(int(i) for i in mask)),
+        ),
+    }
+
+
+def _load_database(name):
+    """
+    Load a detector database once per process
+
+    :param name: the name of the database from _shared_databases
+    :returns: the database
+    :rtype:
+
+    """
+    with _databases_lock:
+        if name not in _databases:
+            if name[0] == "database":
+                _databases[name] = get_database(name[1])
+
+            else:
+                _databases[name] = get_trigdat_precalc_database(
+                    name[1], np.array(name[2])
+                )
+
+        return _databases[name]
+
+
+def _copy(response):
+    """
+    Deep copy of a response that shares the detector databases
+
+    :param response: the response
+    :returns: the copy
+    :rtype:
+
+    """
+    memo = {i: database for i, (database, _) in _shared_databases(response).items()}
+
+    return copy.deepcopy(response, memo)
+
+
+class _Pickler(pickle.Pickler):
+    # stores the names of the detector databases instead of the databases
+    def __init__(self, f, response):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self._names = {i: name for i, (_, name) in _shared_databases(response).items()}
+
+    def persistent_id(self, obj):
+        return self._names.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    def persistent_load(self, name):
+        return _load_database(tuple(name))
+
+
+class ResponseCache(object):
+    def __init__(
+        self, max_items=64, cache_dir=None, use_disk=True, max_disk_size_gb=None
+    ):
+        """
+        Cache for the trigdat responses. The responses are kept in memory
+        with LRU eviction and pickled to disk, so every consumer of the
+        same trigdat file (time selection, background fit, all MPI ranks
+        of the localization) builds them only once. The least recently
+        used files of a disk cache folder are deleted when the folder gets
+        larger than max_disk_size_gb.
+
+        :param max_items: max number of responses kept in memory
+        :param cache_dir: directory of the disk cache, default is a
+        response_cache folder next to the trigdat file
+        :param use_disk: store the responses on disk
+        :param max_disk_size_gb: max size of a disk cache folder, default
+        from the config
+        :returns:
+        :rtype:
+
+        """
+        if max_disk_size_gb is None:
+            max_disk_size_gb = morgoth_config["response_cache"]["max_disk_size_gb"]
+
+        self._max_items = max_items
+        self._cache_dir = cache_dir
+        self._use_disk = use_disk
+        self._max_disk_size = float(max_disk_size_gb) * 1024 ** 3
+
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+
+        # (path, mtime, size) -> hash, so the file is hashed only once
+        self._hashes = {}
+
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _file_hash(self, file_name):
+        stat = os.stat(file_name)
+        file_id = (os.path.abspath(file_name), stat.st_mtime, stat.st_size)
+
+        if file_id not in self._hashes:
+            self._hashes[file_id] = file_hash(file_name)
+
+        return self._hashes[file_id]
+
+    def key(self, trigdat_file, det, tstart, tstop):
+        """
+        The key of a response: hash of the trigdat file, the detector
+        and the hash of the time bins the response is built for
+
+        :param trigdat_file: path of the trigdat file
+        :param det: the detector name
+        :param tstart: start times of the bins
+        :param tstop: stop times of the bins
+        :returns: the key
+        :rtype: str
+
+        """
+        h = hashlib.sha256()
+        h.update(np.ascontiguousarray(tstart, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(tstop, dtype=np.float64).tobytes())
+
+        return f"{self._file_hash(trigdat_file)[:16]}_{det}_{h.hexdigest()[:16]}"
+
+    def _disk_file(self, trigdat_file, key):
+        cache_dir = self._cache_dir
+
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                os.path.dirname(os.path.abspath(trigdat_file)), "response_cache"
+            )
+
+        return os.path.join(cache_dir, f"{key}.pkl")
+
+    def _remember(self, key, response):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self._max_items:
+            self._memory.popitem(last=False)
+
+    def get(self, trigdat_file, key):
+        """
+        Get a response from memory or disk
+
+        :param trigdat_file: path of the trigdat file
+        :param key: the key of the response
+        :returns: a copy of the response or None if it is not cached
+        :rtype:
+
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._hits += 1
+
+                # the responses are changed when the location is set
+                return _copy(self._memory[key])
+
+        disk_file = self._disk_file(trigdat_file, key)
+
+        if self._use_disk and os.path.exists(disk_file):
+            try:
+                with open(disk_file, "rb") as f:
+                    response = _Unpickler(f).load()
+
+                # the mtime orders the files for the eviction
+                os.utime(disk_file)
+
+            except Exception as e:
+                print(f"Could not read the cached response {disk_file}: {e}")
+
+            else:
+                with self._lock:
+                    self._remember(key, response)
+                    self._hits += 1
+
+                return _copy(response)
+
+        return None
+
+    def put(self, trigdat_file, key, response):
+        """
+        Store a response in memory and on disk
+
+        :param trigdat_file: path of the trigdat file
+        :param key: the key of the response
+        :param response: the response
+        :returns:
+        :rtype:
+
+        """
+        with self._lock:
+            self._remember(key, _copy(response))
+
+        if not self._use_disk:
+            return
+
+        disk_file = self._disk_file(trigdat_file, key)
+
+        try:
+            file_utils.if_directory_not_existing_then_make(os.path.dirname(disk_file))
+
+            tmp_file = f"{disk_file}.{os.getpid()}.tmp"
+
+            with open(tmp_file, "wb") as f:
+                _Pickler(f, response).dump(response)
+
+            # other processes only ever see complete files
+            os.replace(tmp_file, disk_file)
+
+        except Exception as e:
+            print(f"Could not store the response on disk: {e}")
+
+        else:
+            self._evict(os.path.dirname(disk_file))
+
+    def _evict(self, cache_dir):
+        """
+        Delete the least recently used responses of a disk cache folder
+        until it is smaller than max_disk_size_gb
+
+        :param cache_dir: the disk cache folder
+        :returns:
+        :rtype:
+
+        """
+        files = []
+
+        for name in os.listdir(cache_dir):
+            # files that are still written
+            if not name.endswith(".pkl"):
+                continue
+
+            path = os.path.join(cache_dir, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            files.append((stat.st_mtime, path, stat.st_size))
+
+        total = sum(f[2] for f in files)
+
+        # oldest first
+        for mtime, path, size in sorted(files):
+            if total <= self._max_disk_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            total -= size
+
+    def get_or_build(self, trigdat_file, det, tstart, tstop, build):
+        """
+        Get a response from the cache or build and store it
+
+        :param trigdat_file: path of the trigdat file
+        :param det: the detector name
+        :param tstart: start times of the bins
+        :param tstop: stop times of the bins
+        :param build: function without arguments that builds the response
+        :returns: the response
+        :rtype:
+
+        """
+        key = self.key(trigdat_file, det, tstart, tstop)
+
+        response = self.get(trigdat_file, key)
+
+        if response is None:
+            with self._lock:
+                self._misses += 1
+
+            response = build()
+
+            self.put(trigdat_file, key, response)
+
+        return response
+
+
+# the cache shared by all TrigReaders of this process
+response_cache = ResponseCache()
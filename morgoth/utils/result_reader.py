@@ -559,6 +559,63 @@ class ResultReader(object):
         return self._model
 
 
+class GridResultReader(ResultReader):
+    def __init__(
+        self,
+        grb_name,
+        report_type,
+        version,
+        trigger_file,
+        time_selection_file,
+        background_file,
+        grid_result_file,
+        trigdat_file,
+    ):
+        """
+        Reader for the result of the grid scan, that builds the same report
+        as the ResultReader with the position and spectrum of the best pixel
+        instead of the MultiNest posterior. The spectral parameters have no errors.
+        """
+        super(GridResultReader, self).__init__(
+            grb_name=grb_name,
+            report_type=report_type,
+            version=version,
+            trigger_file=trigger_file,
+            time_selection_file=time_selection_file,
+            background_file=background_file,
+            post_equal_weights_file=None,
+            result_file=grid_result_file,
+            trigdat_file=trigdat_file,
+        )
+
+    def _read_fit_result(self, result_file):
+        with open(result_file, "r") as f:
+            data = yaml.safe_load(f)
+
+        self._model = data["model"]
+
+        self._ra = data["ra"]
+        self._ra_err = data["ra_err"]
+        self._dec = data["dec"]
+        self._dec_err = data["dec_err"]
+
+        self._balrog_one_sig_err_circle = data["one_sig_err_circle"]
+        self._balrog_two_sig_err_circle = data["two_sig_err_circle"]
+
+        spectrum = data["spectrum"]
+
+        self._K = spectrum.get("K")
+        self._index = spectrum.get("index")
+        self._xc = spectrum.get("xc")
+        self._alpha = spectrum.get("alpha")
+        self._xp = spectrum.get("xp")
+        self._beta = spectrum.get("beta")
+
+    def _read_post_equal_weights_file(self, post_equal_weights_file):
+        # the grid scan has no chains, the position is read with the fit result
+        pass
+
+
 model_param_lookup = {
     "pl": ["ra (deg)", "dec (deg)", "K", "index"],
     "cpl": ["ra (deg)", "dec (deg)", "K", "index", "xc"],
@@ -0,0 +1,146 @@
+import numpy as np
+from threeML.utils.spectrum.binned_spectrum import (
+    BinnedSpectrum,
+    BinnedSpectrumWithDispersion,
+    Quality,
+)
+
+# the arrays in a window start at multiples of this
+_alignment = 64
+
+
+def share_arrays(comm, arrays=None, root=0):
+    """
+    Put arrays into MPI shared memory windows, one window per node. The root rank
+    has the arrays, it sends them once to the first rank of every other node. The
+    first rank of every node fills the window of its node and the other ranks of
+    the node attach to the window without a copy.
+
+    :param comm: the MPI communicator of all ranks
+    :param arrays: dict with the arrays on the root rank, ignored on the other ranks
+    :param root: the rank with the arrays
+    :returns: dict with the shared arrays and the window, that has to be kept as
+    long as the arrays are used
+    :rtype: tuple
+
+    """
+    from mpi4py import MPI
+
+    # the ranks of this node, the root is the first rank of its node
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=0 if comm.rank == root else 1)
+
+    leaders = comm.Split(
+        0 if node.rank == 0 else MPI.UNDEFINED, key=0 if comm.rank == root else 1
+    )
+
+    if leaders != MPI.COMM_NULL:
+        arrays = leaders.bcast(
+            {key: np.ascontiguousarray(array) for key, array in arrays.items()}
+            if comm.rank == root
+            else None,
+            root=0,
+        )
+        leaders.Free()
+
+    # the layout of the arrays in the window
+    layout = None
+
+    if node.rank == 0:
+        layout = {}
+        offset = 0
+
+        for key, array in arrays.items():
+            layout[key] = (offset, array.shape, array.dtype.str)
+            offset += -(-array.nbytes // _alignment) * _alignment
+
+        layout = (layout, offset)
+
+    layout, n_bytes = node.bcast(layout, root=0)
+
+    window = MPI.Win.Allocate_shared(
+        max(n_bytes, 1) if node.rank == 0 else 0, 1, comm=node
+    )
+    buffer, _ = window.Shared_query(0)
+
+    shared = {}
+
+    for key, (offset, shape, dtype) in layout.items():
+        shared[key] = np.ndarray(
+            buffer=buffer, dtype=np.dtype(dtype), shape=shape, offset=offset
+        )
+
+        if node.rank == 0:
+            shared[key][...] = arrays[key]
+
+    node.Barrier()
+    node.Free()
+
+    return shared, window
+
+
+def spectrum_to_arrays(spectrum, prefix):
+    """
+    Split a binned spectrum into its arrays and the other information, so it can
+    be put into shared memory and build again with spectrum_from_arrays
+
+    :param spectrum: the BinnedSpectrum or BinnedSpectrumWithDispersion
+    :param prefix: prefix of the keys of the arrays
+    :returns: dict with the arrays and dict with the other information
+    :rtype: tuple
+
+    """
+    arrays = {
+        f"{prefix}counts": np.asarray(spectrum.counts),
+        f"{prefix}edges": np.asarray(spectrum.edges),
+        f"{prefix}quality": np.asarray(spectrum.quality.to_ogip()),
+    }
+
+    if spectrum.count_errors is not None:
+        arrays[f"{prefix}count_errors"] = np.asarray(spectrum.count_errors)
+
+    if spectrum.sys_errors is not None:
+        arrays[f"{prefix}sys_errors"] = np.asarray(spectrum.sys_errors)
+
+    info = dict(
+        dispersion=isinstance(spectrum, BinnedSpectrumWithDispersion),
+        exposure=spectrum.exposure,
+        scale_factor=spectrum.scale_factor,
+        is_poisson=spectrum.is_poisson,
+        mission=spectrum.mission,
+        instrument=spectrum.instrument,
+        tstart=spectrum.tstart,
+        tstop=spectrum.tstop,
+    )
+
+    return arrays, info
+
+
+def spectrum_from_arrays(arrays, info, prefix, response=None):
+    """
+    Build a binned spectrum from the arrays of spectrum_to_arrays
+
+    :param arrays: dict with the arrays
+    :param info: dict with the other information
+    :param prefix: prefix of the keys of the arrays
+    :param response: the response if it was a BinnedSpectrumWithDispersion
+    :returns: the spectrum
+    :rtype: BinnedSpectrum
+
+    """
+    info = dict(info)
+    dispersion = info.pop("dispersion")
+
+    kwargs = dict(
+        counts=arrays[f"{prefix}counts"],
+        count_errors=arrays.get(f"{prefix}count_errors"),
+        sys_errors=arrays.get(f"{prefix}sys_errors"),
+        quality=Quality.from_ogip(arrays[f"{prefix}quality"]),
+        **info,
+    )
+
+    if dispersion:
+        assert response is not None, "The spectrum needs its response"
+
+        return BinnedSpectrumWithDispersion(response=response, **kwargs)
+
+    return BinnedSpectrum(ebounds=arrays[f"{prefix}edges"], **kwargs)
@@ -2,6 +2,7 @@
 import numpy as np
 
 import collections
+import collections.abc
 
 from threeML.utils.spectrum.binned_spectrum import BinnedSpectrumWithDispersion
 from threeML.utils.time_series.binned_spectrum_series import BinnedSpectrumSeries
@@ -10,6 +11,7 @@ from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
 from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
 
 from threeML.utils.time_interval import TimeIntervalSet
+from threeML.utils.statistics.stats_tools import Significance
 
 import astropy.io.fits as fits
 
@@ -17,6 +19,9 @@ from gbm_drm_gen.io.balrog_drm import BALROG_DRM
 from gbm_drm_gen.io.balrog_like import BALROGLike
 from gbm_drm_gen.drmgen_trig import DRMGenTrig
 
+from morgoth.utils.intervals import prune_trigdat_bins
+from morgoth.utils.response_cache import response_cache
+
 # This is a holder of the detector names
 
 lu = (
@@ -37,6 +42,40 @@ lu = (
 )
 
 
+class _LazyTimeSeries(collections.abc.Mapping):
+    """
+    Mapping of the detector names to their time series,
+    that creates a time series when it is accessed the first time
+    """
+
+    def __init__(self, create, names):
+        self._create = create
+        self._names = list(names)
+        self._time_series = collections.OrderedDict()
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+
+        if name not in self._time_series:
+            self._time_series[name] = self._create(name)
+
+        return self._time_series[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def is_materialized(self, name):
+        return name in self._time_series
+
+    @property
+    def materialized(self):
+        return list(self._time_series.keys())
+
+
 class TrigReader(object):
     """
     This class reads a GBM trigdat file and performs background fitting, source selection, and plotting.
@@ -44,6 +83,10 @@ class TrigReader(object):
     :param triddat_file: string that is the path to the trigdat file you wish ot read
     :param fine: optional argument to use trigdat fine resolution data. Defaults to False
     :poly_order: optional argument to set the order of the polynomial used in the background fit.
+    :param responses: optional dict with the BALROG_DRM of every detector, e.g. broadcasted by MPI rank 0
+    :param use_response_cache: get the responses from the shared response cache
+    :param lazy: create the time series of a detector only when it is accessed
+    :param analysis_cache: optional AnalysisCache for the parsed trigdat data
     """
 
     def __init__(
@@ -54,6 +97,10 @@ class TrigReader(object):
         verbose=True,
         poly_order=-1,
         restore_poly_fit=None,
+        responses=None,
+        use_response_cache=True,
+        lazy=False,
+        analysis_cache=None,
     ):
 
         # self._backgroundexists = False
@@ -64,9 +111,11 @@ class TrigReader(object):
         self._poly_order = poly_order
         self._restore_poly_fit = restore_poly_fit
         self._trigdat_file = trigdat_file
-        # Read the trig data file and get the appropriate info
+        self._responses = dict(responses) if responses is not None else {}
+        self._use_response_cache = use_response_cache
+        self._lazy = lazy
+        self._pending_selections = {}
 
-        trigdat = fits.open(trigdat_file)
         self._filename = trigdat_file
         self._out_edge_bgo = np.array(
             [150.0, 400.0, 850.0, 1500.0, 3000.0,
@@ -79,26 +128,67 @@ class TrigReader(object):
         self._binwidth_bgo = self._out_edge_bgo[1:] - self._out_edge_bgo[:-1]
         self._binwidth_nai = self._out_edge_nai[1:] - self._out_edge_nai[:-1]
 
+        # Read the trig data file or get the parsed data from the cache
+        if analysis_cache is not None:
+            key = analysis_cache.key(trigdat_file, fine=fine)
+            data = analysis_cache.load_arrays("trigdat", key)
+
+            if data is None:
+                data = self._read_trigdat(trigdat_file, fine)
+                analysis_cache.put_arrays("trigdat", key, **data)
+
+        else:
+            data = self._read_trigdat(trigdat_file, fine)
+
+        self._trigtime = float(data["trigtime"])
+        self._tstart = data["tstart"]
+        self._tstop = data["tstop"]
+        self._rates = data["rates"]
+        self._qauts = data["qauts"]
+        self._sc_pos = data["sc_pos"]
+        self._fsw_ra = float(data["fsw_ra"])
+        self._fsw_dec = float(data["fsw_dec"])
+        self._fsw_err = float(data["fsw_err"])
+
+        self._time_intervals = TimeIntervalSet.from_starts_and_stops(
+            self._tstart, self._tstop
+        )
+
+        # self._pos_interp = PositionInterpolator(trigdat=trigdat_file)
+
+        self._create_timeseries()
+
+    @staticmethod
+    def _read_trigdat(trigdat_file, fine):
+        """
+        read the times, rates and positions of the trigdat file and
+        dump the bins that are covered by finer bins
+        :param trigdat_file: path to the trigdat file
+        :param fine: use the fine resolution data
+        :return: dict with the arrays
+        """
+        trigdat = fits.open(trigdat_file)
+
         # Get the times
         evntrate = "EVNTRATE"
 
-        self._trigtime = trigdat[evntrate].header["TRIGTIME"]
-        self._tstart = trigdat[evntrate].data["TIME"] - self._trigtime
-        self._tstop = trigdat[evntrate].data["ENDTIME"] - self._trigtime
+        trigtime = trigdat[evntrate].header["TRIGTIME"]
+        tstart = trigdat[evntrate].data["TIME"] - trigtime
+        tstop = trigdat[evntrate].data["ENDTIME"] - trigtime
 
-        self._rates = trigdat[evntrate].data["RATE"]
+        rates = trigdat[evntrate].data["RATE"]
 
-        num_times = len(self._tstart)
-        self._rates = self._rates.reshape(num_times, 14, 8)
+        num_times = len(tstart)
+        rates = rates.reshape(num_times, 14, 8)
 
         # Obtain the positional information
-        self._qauts = trigdat[evntrate].data["SCATTITD"]  # [condition][0]
-        self._sc_pos = trigdat[evntrate].data["EIC"]  # [condition][0]
+        qauts = trigdat[evntrate].data["SCATTITD"]  # [condition][0]
+        sc_pos = trigdat[evntrate].data["EIC"]  # [condition][0]
 
         # Get the flight software location
-        self._fsw_ra = trigdat["PRIMARY"].header["RA_OBJ"]
-        self._fsw_dec = trigdat["PRIMARY"].header["DEC_OBJ"]
-        self._fsw_err = trigdat["PRIMARY"].header["ERR_RAD"]
+        fsw_ra = trigdat["PRIMARY"].header["RA_OBJ"]
+        fsw_dec = trigdat["PRIMARY"].header["DEC_OBJ"]
+        fsw_err = trigdat["PRIMARY"].header["ERR_RAD"]
 
         # Clean up
         trigdat.close()
@@ -108,190 +198,230 @@ class TrigReader(object):
 
         # The delta time in the file.
         # This routine is modeled off the procedure in RMFIT.
-        myDelta = self._tstop - self._tstart
-        self._tstart[myDelta < 0.1] = np.round(self._tstart[myDelta < 0.1], 4)
-        self._tstop[myDelta < 0.1] = np.round(self._tstop[myDelta < 0.1], 4)
-
-        self._tstart[~(myDelta < 0.1)] = np.round(
-            self._tstart[~(myDelta < 0.1)], 3)
-        self._tstop[~(myDelta < 0.1)] = np.round(
-            self._tstop[~(myDelta < 0.1)], 3)
-
-        if fine:
-
-            # Create a starting list of array indices.
-            # We will dumb then ones that are not needed
-
-            all_index = list(range(len(self._tstart)))
-
-            # masks for all the different delta times and
-            # the mid points for the different binnings
-            temp1 = myDelta < 0.1
-            temp2 = np.logical_and(myDelta > 0.1, myDelta < 1.0)
-            temp3 = np.logical_and(myDelta > 1.0, myDelta < 2.0)
-            temp4 = myDelta > 2.0
-            midT1 = (self._tstart[temp1] + self._tstop[temp1]) / 2.0
-            midT2 = (self._tstart[temp2] + self._tstop[temp2]) / 2.0
-            midT3 = (self._tstart[temp3] + self._tstop[temp3]) / 2.0
-
-            # Dump any index that occurs in a lower resolution
-            # binning when a finer resolution covers the interval
-
-            for indx in np.where(temp2)[0]:
-                for x in midT1:
-                    if self._tstart[indx] < x < self._tstop[indx]:
-                        if indx in all_index:
-                            all_index.remove(indx)
-
-            for indx in np.where(temp3)[0]:
-                for x in midT2:
-                    if self._tstart[indx] < x < self._tstop[indx]:
-                        if indx in all_index:
-                            all_index.remove(indx)
-
-            for indx in np.where(temp4)[0]:
-                for x in midT3:
-                    if self._tstart[indx] < x < self._tstop[indx]:
-                        if indx in all_index:
-                            all_index.remove(indx)
-
-            all_index = np.array(all_index)
-        else:
-
-            # Just deal with the first level of fine data
-            all_index = np.where(myDelta > 1.0)[0].tolist()
+        myDelta = tstop - tstart
+        tstart[myDelta < 0.1] = np.round(tstart[myDelta < 0.1], 4)
+        tstop[myDelta < 0.1] = np.round(tstop[myDelta < 0.1], 4)
+
+        tstart[~(myDelta < 0.1)] = np.round(
+            tstart[~(myDelta < 0.1)], 3)
+        tstop[~(myDelta < 0.1)] = np.round(
+            tstop[~(myDelta < 0.1)], 3)
+
+        # Dump any index that occurs in a lower resolution
+        # binning when a finer resolution covers the interval
+        all_index = prune_trigdat_bins(
+            tstart, tstop, fine=fine, delta=myDelta
+        )
 
-            temp1 = np.logical_and(myDelta > 1.0, myDelta < 2.0)
-            temp2 = myDelta > 2.0
-            midT1 = (self._tstart[temp1] + self._tstop[temp1]) / 2.0
+        # Now dump the indices we do not need
+        tstart = tstart[all_index]
+        tstop = tstop[all_index]
+        qauts = qauts[all_index]
+        sc_pos = sc_pos[all_index]
+        rates = rates[all_index, :, :]
 
-            for indx in np.where(temp2)[0]:
-                for x in midT1:
-                    if self._tstart[indx] < x < self._tstop[indx]:
+        # Now we need to sort because GBM may not have done this!
 
-                        try:
+        sort_mask = np.argsort(tstart)
+        tstart = tstart[sort_mask]
+        tstop = tstop[sort_mask]
+        qauts = qauts[sort_mask]
+        sc_pos = sc_pos[sort_mask]
+        rates = rates[sort_mask, :, :]
+
+        return dict(
+            trigtime=trigtime,
+            tstart=tstart,
+            tstop=tstop,
+            rates=rates,
+            qauts=qauts,
+            sc_pos=sc_pos,
+            fsw_ra=fsw_ra,
+            fsw_dec=fsw_dec,
+            fsw_err=fsw_err,
+        )
 
-                            all_index.remove(indx)
+    @property
+    def time_series(self):
+        return self._time_series
 
-                        except:
-                            pass
+    @property
+    def responses(self):
+        return self._responses
 
-            all_index = np.array(all_index)
+    def _build_response(self, det_num):
+        """
+        build the response of one detector
+        :param det_num: the detector number
+        :return: BALROG_DRM
+        """
+        drm_gen = DRMGenTrig(
+            trigdat_file=self._trigdat_file,
+            det=det_num,  # det number
+            tstart=self._tstart,
+            tstop=self._tstop,
+            mat_type=2,
+            time=0,
+            occult=True
+        )
 
-        # Now dump the indices we do not need
-        self._tstart = self._tstart[all_index]
-        self._tstop = self._tstop[all_index]
-        self._qauts = self._qauts[all_index]
-        self._sc_pos = self._sc_pos[all_index]
-        self._rates = self._rates[all_index, :, :]
+        # we will use a single response for each detector
 
-        # Now we need to sort because GBM may not have done this!
+        return BALROG_DRM(drm_gen, 0, 0)
 
-        sort_mask = np.argsort(self._tstart)
-        self._tstart = self._tstart[sort_mask]
-        self._tstop = self._tstop[sort_mask]
-        self._qauts = self._qauts[sort_mask]
-        self._sc_pos = self._sc_pos[sort_mask]
-        self._rates = self._rates[sort_mask, :, :]
+    def response(self, name):
+        """
+        get the response of one detector, built only once per trigdat file
+        :param name: the detector name
+        :return: BALROG_DRM
+        """
+        if name not in self._responses:
 
-        self._time_intervals = TimeIntervalSet.from_starts_and_stops(
-            self._tstart, self._tstop
-        )
+            det_num = lu.index(name)
 
-        # self._pos_interp = PositionInterpolator(trigdat=trigdat_file)
+            if self._use_response_cache:
+                self._responses[name] = response_cache.get_or_build(
+                    self._trigdat_file,
+                    name,
+                    self._tstart,
+                    self._tstop,
+                    lambda: self._build_response(det_num),
+                )
 
-        self._create_timeseries()
+            else:
+                self._responses[name] = self._build_response(det_num)
 
-    @property
-    def time_series(self):
-        return self._time_series
+        return self._responses[name]
 
     def _create_timeseries(self):
         """
-        create all the time series for each detector
+        create all the time series for each detector. In lazy mode
+        the time series of a detector is created on first access
         :return: None
         """
 
-        self._time_series = collections.OrderedDict()
+        if self._lazy:
 
-        for det_num in range(14):
+            self._time_series = _LazyTimeSeries(self._materialize, lu)
 
-            # detectors are arranged [time,det,channel]
+        else:
 
-            # for now just keep the normal exposure
+            self._time_series = collections.OrderedDict()
 
-            # we will create binned spectra for each time slice
+            for name in lu:
 
-            drm_gen = DRMGenTrig(
-                trigdat_file=self._trigdat_file,
-                det=det_num,  # det number
-                tstart=self._tstart,
-                tstop=self._tstop,
-                mat_type=2,
-                time=0,
-                occult=True
-            )
+                self._time_series[name] = self._create_detector_timeseries(name)
 
-            # we will use a single response for each detector
+    def _materialize(self, name):
+        """
+        create the time series of a detector in lazy mode and
+        apply the selections that were set before
+        :param name: the detector name
+        :return: TimeSeriesBuilder
+        """
+        tsb = self._create_detector_timeseries(name)
 
-            tmp_drm = BALROG_DRM(drm_gen, 0, 0)
+        for selection, intervals in self._pending_selections.pop(name, []):
 
-            # extract the counts
+            if selection == "background":
+                tsb.set_background_interval(*intervals, unbinned=False)
 
-            counts = self._rates[:, det_num, :] * self._time_intervals.widths.reshape(
-                (len(self._time_intervals), 1)
-            )
+            else:
+                tsb.set_active_time_interval(*intervals)
 
-            # now create a binned spectrum for each interval
+        return tsb
 
-            binned_spectrum_list = []
+    def _is_materialized(self, name):
 
-            for c, start, stop in zip(counts, self._tstart, self._tstop):
-                binned_spectrum_list.append(
-                    BinnedSpectrumWithDispersion(
-                        counts=c,
-                        exposure=stop - start,
-                        response=tmp_drm,
-                        tstart=start,
-                        tstop=stop,
-                    )
-                )
+        if self._lazy:
+            return self._time_series.is_materialized(name)
 
-            # make a binned spectrum set
+        return True
 
-            bss = BinnedSpectrumSet(
-                binned_spectrum_list,
-                reference_time=0.0,
-                time_intervals=self._time_intervals,
-            )
+    def _may_have_background_fit(self, name):
+        """
+        check without creating the time series whether a detector can have
+        a bkg fit, i.e. it was created, has a pending bkg selection or a bkg
+        fit to restore
+        :param name: name of the detector
+        :return: bool
+        """
+        if self._is_materialized(name):
+            return True
 
-            # convert that set to a series
+        if self._restore_poly_fit is not None and name in self._restore_poly_fit:
+            return True
 
-            bss2 = BinnedSpectrumSeries(bss, first_channel=0)
+        return any(
+            selection == "background"
+            for selection, _ in self._pending_selections.get(name, [])
+        )
 
-            # now we need to get the name of the detector
+    def _create_detector_timeseries(self, name):
+        """
+        create the time series of one detector
+        :param name: the detector name
+        :return: TimeSeriesBuilder
+        """
 
-            name = lu[det_num]
+        det_num = lu.index(name)
 
-            if self._restore_poly_fit is not None:
-                bkg_fit_file = self._restore_poly_fit.get(name, None)
-            else:
-                bkg_fit_file = None
+        # detectors are arranged [time,det,channel]
+
+        # for now just keep the normal exposure
+
+        # we will create binned spectra for each time slice
 
-            # create a time series builder which can produce plugins
+        tmp_drm = self.response(name)
 
-            tsb = TimeSeriesBuilder(
-                name,
-                bss2,
-                response=tmp_drm,
-                verbose=self._verbose,
-                poly_order=self._poly_order,
-                restore_poly_fit=bkg_fit_file,
+        # extract the counts
+
+        counts = self._rates[:, det_num, :] * self._time_intervals.widths.reshape(
+            (len(self._time_intervals), 1)
+        )
+
+        # now create a binned spectrum for each interval
+
+        binned_spectrum_list = []
+
+        for c, start, stop in zip(counts, self._tstart, self._tstop):
+            binned_spectrum_list.append(
+                BinnedSpectrumWithDispersion(
+                    counts=c,
+                    exposure=stop - start,
+                    response=tmp_drm,
+                    tstart=start,
+                    tstop=stop,
+                )
             )
 
-            # attach that to the full list
+        # make a binned spectrum set
+
+        bss = BinnedSpectrumSet(
+            binned_spectrum_list,
+            reference_time=0.0,
+            time_intervals=self._time_intervals,
+        )
 
-            self._time_series[name] = tsb
+        # convert that set to a series
+
+        bss2 = BinnedSpectrumSeries(bss, first_channel=0)
+
+        if self._restore_poly_fit is not None:
+            bkg_fit_file = self._restore_poly_fit.get(name, None)
+        else:
+            bkg_fit_file = None
+
+        # create a time series builder which can produce plugins
+
+        return TimeSeriesBuilder(
+            name,
+            bss2,
+            response=tmp_drm,
+            verbose=self._verbose,
+            poly_order=self._poly_order,
+            restore_poly_fit=bkg_fit_file,
+        )
 
     def view_lightcurve(self, start=-30, stop=30, return_plots=False):
         """
@@ -324,13 +454,7 @@ class TrigReader(object):
         :param det_sel: select specific detector
         :return:
         """
-        if det_sel is None:
-            for name, det in self._time_series.items():
-                det.set_background_interval(*intervals, unbinned=False)
-        else:
-            for name, det in self._time_series.items():
-                if name == det_sel:
-                    det.set_background_interval(*intervals, unbinned=False)
+        self._set_selection("background", intervals, det_sel)
 
     def set_active_time_interval(self, *intervals, det_sel=None):
         """
@@ -338,20 +462,44 @@ class TrigReader(object):
         :param intervals:
         :return:
         """
-        if det_sel is None:
-            for name, det in self._time_series.items():
-                det.set_active_time_interval(*intervals)
-        else:
-            for name, det in self._time_series.items():
-                if name == det_sel:
-                    det.set_active_time_interval(*intervals)
+        self._set_selection("active", intervals, det_sel)
+
+    def _set_selection(self, selection, intervals, det_sel):
+        """
+        set a selection for all or a specific detector. In lazy mode
+        the selection of a detector that was not created yet is applied
+        when it is created
+        :param selection: background or active
+        :param intervals: str of intervals
+        :param det_sel: select specific detector
+        :return:
+        """
+        for name in lu:
+
+            if det_sel is not None and name != det_sel:
+                continue
+
+            if not self._is_materialized(name):
+                self._pending_selections.setdefault(name, []).append(
+                    (selection, intervals)
+                )
+
+            elif selection == "background":
+                self._time_series[name].set_background_interval(
+                    *intervals, unbinned=False
+                )
+
+            else:
+                self._time_series[name].set_active_time_interval(*intervals)
 
-    def to_plugin(self, *detectors):
+    def to_plugin(self, *detectors, free_position=True):
         """
 
         convert the series to a BALROGLike plugin
 
         :param detectors: detectors to use
+        :param free_position: free the position of the model, if False the response
+        keeps the location it was set to
         :return:
         """
 
@@ -367,7 +515,9 @@ class TrigReader(object):
             time = 0.5 * \
                 (self._time_series[det].tstart + self._time_series[det].tstop)
 
-            balrog_like = BALROGLike.from_spectrumlike(speclike, time=time)
+            balrog_like = BALROGLike.from_spectrumlike(
+                speclike, time=time, free_position=free_position
+            )
 
             balrog_like.set_active_measurements("c1-c6")
 
@@ -375,63 +525,113 @@ class TrigReader(object):
 
         return data
 
-    def counts_and_background(self, time_series_builder):
-        """
-        Method that returns the observed rate and the rate of the poly bkg fit
-        :return: returns the observed rate and bkg rate for one detector for all time_bins
-        """
-        start = -1000
-        stop = 1000
-        time_series = time_series_builder.time_series
-        poly_fit_exists = time_series.poly_fit_exists
-        binned_spectrum_set = time_series.binned_spectrum_set
-        counts = []
-        width = []
-        bins = binned_spectrum_set.time_intervals.containing_interval(
-            start, stop)
-        for bin in bins:
-            counts.append(
-                time_series.counts_over_interval(bin.start_time, bin.stop_time)
-            )
-            width.append(bin.duration)
-        counts = np.array(counts)
-        width = np.array(width)
-        rates_observed = counts / width
+    def significances(self, *detectors):
+        """
+        The significance of the active time interval over the bkg fit for every detector,
+        the same as the significance of the plugins from to_plugin, but computed from the
+        selected counts of the time series for all detectors at once without building
+        the plugins
+        :param detectors: detectors to use, all if none are given
+        :return: array with the significance of every detector, nan for detectors without
+        a bkg fit
+        """
+        if not detectors:
+            detectors = lu
 
-        if poly_fit_exists:
-            polynomials = time_series.polynomials
+        observed = np.zeros(len(detectors))
+        background = np.zeros(len(detectors))
+        background_error = np.zeros(len(detectors))
+        has_bkg = np.zeros(len(detectors), dtype=bool)
 
-            bkg = []
-            for j, tb in enumerate(bins):
-                tmpbkg = 0.0
-                for poly in polynomials:
-                    tmpbkg += poly.integral(tb.start_time, tb.stop_time)
+        for i, det in enumerate(detectors):
 
-                bkg.append(tmpbkg / width[j])
+            if not self._may_have_background_fit(det):
+                continue
 
-        else:
+            time_series = self._time_series[det].time_series
+
+            if not time_series.poly_fit_exists:
+                continue
+
+            # the counts the plugin gets for its observed and background spectrum
+            observed_info = time_series.get_information_dict(use_poly=False)
+            background_info = time_series.get_information_dict(use_poly=True)
+
+            observed[i] = observed_info.counts.sum()
+            background[i] = background_info.counts.sum()
+            background_error[i] = np.sqrt(np.sum(background_info.counts_error ** 2))
+            has_bkg[i] = True
 
-            bkg = None
+        # both spectra have the exposure of the active time interval, so alpha is one
+        significance = Significance(
+            Non=observed, Noff=background, alpha=1.0
+        ).li_and_ma_equivalent_for_gaussian_background(background_error)
 
-        rates_observed = np.array(rates_observed)
-        bkg = np.array(bkg)
-        return rates_observed, bkg
+        return np.where(has_bkg, significance, np.nan)
 
     def observed_and_background(self):
         """
-        Method that returns the observed rate and the rate calculated with the bkg fit. Needs the method counts_and_background in 3ML.
+        Method that returns the observed rate and the rate calculated with the bkg fit.
         Needed for the automatic localisation script to identify the active time and bkg times.
         :return: returns an list with an array in which the observed rate for all time_bins is saved for every det, same for bkg fit
         """
-        observed_rate_all = []
-        background_rate_all = []
-        for name, det in self._time_series.items():
-            observed_rate, bkg_rate = self.counts_and_background(det)
-            observed_rate_all.append(observed_rate)
-            background_rate_all.append(bkg_rate)
+        observed, background = self.observed_and_background_array()
+
+        observed_rate_all = list(observed)
+
+        # detectors without a bkg fit have no bkg rate
+        background_rate_all = [
+            bkg if not np.all(np.isnan(bkg)) else np.array(None)
+            for bkg in background
+        ]
 
         return observed_rate_all, background_rate_all
 
+    def observed_and_background_array(self, start=-1000, stop=1000):
+        """
+        The observed rate and the rate of the poly bkg fit of all detectors for
+        all time bins between start and stop, computed for all bins at once
+        :param start: start time
+        :param stop: stop time
+        :return: observed and bkg rate as arrays with shape (n_det, n_bins), the bkg rate
+        is nan for detectors without a bkg fit. In lazy mode only the detectors
+        which can have a bkg fit are created
+        """
+        bins = self._time_intervals.containing_interval(start, stop, as_mask=True)
+
+        tstart = self._tstart[bins]
+        tstop = self._tstop[bins]
+        width = tstop - tstart
+
+        # counts of every bin summed over the channels
+        counts = (self._rates[bins] * width.reshape((len(width), 1, 1))).sum(axis=2)
+
+        observed = counts.T / width
+
+        background = np.full((len(lu), len(width)), np.nan)
+
+        for det_num, name in enumerate(lu):
+
+            # do not create the time series of detectors that can not have a
+            # bkg fit in lazy mode
+            if not self._may_have_background_fit(name):
+                continue
+
+            time_series = self._time_series[name].time_series
+
+            if not time_series.poly_fit_exists:
+                continue
+
+            tmpbkg = np.zeros(len(width))
+
+            # the polynomials evaluate the integrals of all bins at once
+            for poly in time_series.polynomials:
+                tmpbkg += poly.integral(tstart, tstop)
+
+            background[det_num] = tmpbkg / width
+
+        return observed, background
+
     def tstart_tstop(self):
         """
         :return: start and stops time of bins in trigdata
@@ -0,0 +1,177 @@
+import re
+import time
+from datetime import datetime
+
+import requests
+
+from morgoth.utils.availability_probe import make_session
+
+
+def seconds_since_trigger(trigger_time):
+    """
+    Seconds between the trigger time of the notice and now
+
+    :param trigger_time: the trigger time string of the notice (2023-05-14T23:54:33.47Z)
+    :returns: the seconds since the trigger
+    :rtype: float
+
+    """
+    trigger = datetime.strptime(trigger_time, "%Y-%m-%dT%H:%M:%S.%fZ")
+
+    return (datetime.utcnow() - trigger).total_seconds()
+
+
+class TrigdatWatcher(object):
+    def __init__(
+        self,
+        uri,
+        grb_name,
+        versions=("v00", "v01", "v02"),
+        interval=5,
+        max_time=1800,
+        trigger_time=None,
+        timeout=10,
+        session=None,
+    ):
+        """
+        Watches the current/ directory of a burst for new trigdat versions.
+        The directory is listed once per interval and every registered callback
+        is fired as soon as a version appears.
+
+        :param uri: the URL of the current/ directory of the burst
+        :param grb_name: the name of the burst
+        :param versions: the trigdat versions to watch for
+        :param interval: the time between two listings
+        :param max_time: the max time to wait for all versions
+        :param trigger_time: optional trigger time of the notice to measure the latency
+        :param timeout: timeout of a single listing request
+        :param session: an optional requests session to reuse
+        :returns:
+        :rtype:
+
+        """
+        self._uri = uri if uri.endswith("/") else f"{uri}/"
+        self._grb_name = grb_name
+        self._versions = list(versions)
+        self._interval = interval
+        self._max_time = max_time
+        self._trigger_time = trigger_time
+        self._timeout = timeout
+
+        if session is None:
+            session = make_session(pool_size=1)
+
+        self._session = session
+
+        self._pattern = re.compile(
+            rf"glg_trigdat_all_bn{grb_name[3:]}_(v\d\d)\.fit"
+        )
+
+        self._callbacks = []
+
+        self._n_listings = 0
+
+        # version -> detection latencies
+        self._latencies = {}
+
+    @property
+    def latencies(self):
+        return self._latencies
+
+    @property
+    def missing(self):
+        return [v for v in self._versions if v not in self._latencies]
+
+    @property
+    def n_listings(self):
+        return self._n_listings
+
+    def file_name(self, version):
+        return f"glg_trigdat_all_bn{self._grb_name[3:]}_{version}.fit"
+
+    def add_callback(self, callback):
+        """
+        Register a function that is called with (version, url)
+        every time a new trigdat version is found
+
+        :param callback: the function
+        :returns:
+        :rtype:
+
+        """
+        self._callbacks.append(callback)
+
+    def list_versions(self):
+        """
+        List the trigdat versions that are currently in the directory
+
+        :returns: set of the versions
+        :rtype: set
+
+        """
+        self._n_listings += 1
+
+        try:
+            response = self._session.get(self._uri, timeout=self._timeout)
+        except requests.RequestException:
+            return set()
+
+        # the directory does not exist yet
+        if response.status_code != 200:
+            return set()
+
+        return set(self._pattern.findall(response.text))
+
+    def poll(self, start):
+        """
+        List the directory once and fire the callbacks for the new versions
+
+        :param start: the start time of the watcher
+        :returns: list of the new versions
+        :rtype: list
+
+        """
+        available = self.list_versions()
+
+        new = [v for v in self.missing if v in available]
+
+        for version in new:
+            latency = dict(since_start=time.time() - start)
+
+            if self._trigger_time is not None:
+                latency["since_trigger"] = seconds_since_trigger(self._trigger_time)
+
+            self._latencies[version] = latency
+
+            print(f"Found trigdat {version} of {self._grb_name} after {latency}")
+
+            for callback in self._callbacks:
+                callback(version, f"{self._uri}{self.file_name(version)}")
+
+        return new
+
+    def run(self):
+        """
+        Watch until all versions are found or the max time is over
+
+        :returns: the detection latencies of the found versions
+        :rtype: dict
+
+        """
+        start = time.time()
+
+        while True:
+            self.poll(start)
+
+            if len(self.missing) == 0:
+                break
+
+            if time.time() - start + self._interval > self._max_time:
+                print(
+                    f"Trigdat versions {self.missing} of {self._grb_name} not found in {self._max_time} seconds"
+                )
+                break
+
+            time.sleep(self._interval)
+
+        return self._latencies
@@ -0,0 +1,211 @@
+import astropy.io.fits as fits
+import numpy as np
+
+
+def _check_order(times, chunk_size=1048576):
+    """
+    Check if the times are sorted and if there are duplicates, in chunks
+    so that no temporary array of the size of the file is needed
+
+    :param times: the times
+    :param chunk_size: number of times checked at once
+    :returns: sorted and contains duplicates
+    :rtype: tuple
+
+    """
+    is_sorted = True
+    has_duplicates = False
+
+    for start in range(0, max(len(times) - 1, 0), chunk_size):
+        # the chunks overlap by one element
+        diff = np.diff(times[start : start + chunk_size + 1])
+
+        is_sorted &= not np.any(diff < 0)
+        has_duplicates |= bool(np.any(diff == 0))
+
+    return is_sorted, has_duplicates
+
+
+def align_window(start, stop, file_start, file_stop, grid=None):
+    """
+    Clip a time window to the file and optionally extend it to a grid of bins
+    of width grid that starts at the start of the file. 3ML bins the events
+    for the background fit in 1 s bins from the start of the event list, with
+    an aligned window the bins inside of the window do not change.
+
+    :param start: start of the window
+    :param stop: stop of the window
+    :param file_start: start of the file
+    :param file_stop: stop of the file
+    :param grid: optional bin width to align to
+    :returns: start and stop of the window
+    :rtype: tuple
+
+    """
+    if grid is not None:
+        start = file_start + np.floor((start - file_start) / grid) * grid
+
+        # one more bin, so the last bin is complete
+        stop = file_start + (np.ceil((stop - file_start) / grid) + 1) * grid
+
+    return max(start, file_start), min(stop, file_stop)
+
+
+class TTEReader(object):
+    def __init__(self, tte_file, tmin=None, tmax=None, grid=None):
+        """
+        Reader for GBM TTE files with the interface of the GBMTTEFile of 3ML,
+        that does not load the events into memory. The TIME and PHA columns are
+        views of the memory mapped file, the times relative to the trigger and
+        the dead times are only computed when they are accessed, and only for
+        the events in the time window between tmin and tmax.
+
+        :param tte_file: path to the tte file
+        :param tmin: optional start of the window, relative to the trigger time
+        :param tmax: optional stop of the window, relative to the trigger time
+        :param grid: optional bin width the window is aligned to, see align_window
+        :returns:
+        :rtype:
+
+        """
+        self._tte_file = tte_file
+
+        self._hdul = fits.open(tte_file, memmap=True)
+
+        header = self._hdul["PRIMARY"].header
+
+        self._trigger_time = header.get("TRIGTIME", 0.0)
+        self._file_start = header["TSTART"]
+        self._file_stop = header["TSTOP"]
+
+        self._n_channels = self._hdul["EBOUNDS"].header["NAXIS2"]
+        self._det_name = f"{header['INSTRUME']}_{header['DETNAM']}"
+        self._telescope = header["TELESCOP"]
+
+        events = self._hdul["EVENTS"].data
+
+        times = events["TIME"]
+        pha = events["PHA"]
+
+        is_sorted, has_duplicates = _check_order(times)
+
+        if not is_sorted:
+            # only unsorted files are copied
+            print(
+                f"The TTE file {tte_file} was not sorted in time, "
+                "the events are sorted in memory"
+            )
+            sort_idx = np.argsort(times, kind="stable")
+            times = times[sort_idx]
+            pha = pha[sort_idx]
+
+            _, has_duplicates = _check_order(times)
+
+        if has_duplicates:
+            print(
+                f"The TTE file {tte_file} contains duplicate time tags and is thus "
+                "invalid. Contact the FSSC"
+            )
+
+        self._all_times = times
+        self._all_pha = pha
+
+        self.set_window(tmin, tmax, grid=grid)
+
+    def set_window(self, tmin=None, tmax=None, grid=None):
+        """
+        Select the events between tmin and tmax, without copying them
+
+        :param tmin: start of the window relative to the trigger time, None for the start of the file
+        :param tmax: stop of the window relative to the trigger time, None for the end of the file
+        :param grid: optional bin width the window is aligned to, see align_window
+        :returns:
+        :rtype:
+
+        """
+        if tmin is None and tmax is None:
+            start, stop = self._file_start, self._file_stop
+
+        else:
+            start, stop = align_window(
+                self._file_start if tmin is None else self._trigger_time + tmin,
+                self._file_stop if tmax is None else self._trigger_time + tmax,
+                self._file_start,
+                self._file_stop,
+                grid=grid,
+            )
+
+        first = np.searchsorted(self._all_times, start, side="left")
+        last = np.searchsorted(self._all_times, stop, side="right")
+
+        self._start_events = start
+        self._stop_events = stop
+
+        self._events = self._all_times[first:last]
+        self._pha = self._all_pha[first:last]
+
+    def close(self):
+        self._hdul.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def trigger_time(self):
+        return self._trigger_time
+
+    @property
+    def tstart(self):
+        return self._start_events
+
+    @property
+    def tstop(self):
+        return self._stop_events
+
+    @property
+    def n_events(self):
+        return len(self._events)
+
+    @property
+    def arrival_times(self):
+        """
+        The arrival times (MET) of the events in the window, a view of the file
+        """
+        return self._events
+
+    @property
+    def relative_arrival_times(self):
+        """
+        The arrival times of the events in the window relative to the trigger time
+        """
+        return self._events - self._trigger_time
+
+    @property
+    def n_channels(self):
+        return self._n_channels
+
+    @property
+    def energies(self):
+        """
+        The PHA channels of the events in the window, a view of the file
+        """
+        return self._pha
+
+    @property
+    def mission(self):
+        return self._telescope
+
+    @property
+    def det_name(self):
+        return self._det_name
+
+    @property
+    def deadtime(self):
+        """
+        The dead time of every event in the window following Meegan et al. (2009),
+        10 us for the overflow channel and 2 us for all others
+        """
+        return np.where(self._pha == 127, 10.0e-6, 2.0e-6)